@@ -1,16 +1,134 @@
 ''' Events Controller '''
+import os
+import asyncio
 from models.users import User
 from logs import logger
-from persistance.events import Event, load_persisted_event, persist_event
-from typing import Union
+from persistance.events import Event, load_persisted_event, persist_event, persist_events, dead_letter_events
+from persistance.database import is_transient
+from typing import List, Union
 import json
-from ws import ws
+from ws import updates
+
+EVENTS_MODE = os.getenv('EVENTS_MODE', 'async')                    # async, or sync to write the events inline
+EVENTS_QUEUE_SIZE = int(os.getenv('EVENTS_QUEUE_SIZE', '10000'))   # Events queued before create_event waits
+EVENTS_BATCH_SIZE = int(os.getenv('EVENTS_BATCH_SIZE', '500'))     # Max events per insert
+EVENTS_MAX_ATTEMPTS = int(os.getenv('EVENTS_MAX_ATTEMPTS', '3'))   # Inserts of a batch rejected by the DB before splitting it
+EVENTS_STOP_TIMEOUT = float(os.getenv('EVENTS_STOP_TIMEOUT', '10')) # Seconds to write the queued events on shutdown
+
+class EventJournal():
+    '''
+    Bounded queue of the events, inserted and broadcast in batches by a background task.
+    Inserts are retried while the DB is not available. Batches the DB rejects are split,
+    and the events rejected max_attempts times on their own go to the dead letter stream
+    '''
+    retry_interval = 1
+
+    def __init__(self, size: int = EVENTS_QUEUE_SIZE, batch_size: int = EVENTS_BATCH_SIZE, sync: bool = EVENTS_MODE == 'sync',
+                 max_attempts: int = EVENTS_MAX_ATTEMPTS, stop_timeout: float = EVENTS_STOP_TIMEOUT):
+        self.size = size
+        self.batch_size = batch_size
+        self.sync = sync
+        self.max_attempts = max_attempts
+        self.stop_timeout = stop_timeout
+        self.queue = None
+        self.runner = None
+        self.stopping = False
+
+    async def start(self) -> None:
+        ''' Start the writer, in sync mode the events are written by append '''
+        if self.sync:
+            return
+        self.queue = asyncio.Queue(maxsize=self.size)
+        self.runner = asyncio.create_task(self.run())
+        logger.info('Event journal started')
+
+    async def stop(self) -> None:
+        ''' Write the queued events and stop the writer, for up to stop_timeout seconds '''
+        if not self.runner:
+            return
+        self.stopping = True
+        try:
+            await asyncio.wait_for(self.queue.put(None), self.stop_timeout)
+            await asyncio.wait_for(asyncio.shield(self.runner), self.stop_timeout)
+        except asyncio.TimeoutError:
+            logger.error(f'Event journal not stopped in {self.stop_timeout}s, dropping the events not written')
+            self.runner.cancel()
+        self.runner = None
+
+    async def append(self, event: Event) -> None:
+        ''' Queue an event, only waits when the queue is full '''
+        if not self.runner:
+            await self.write([event])
+            return
+        await self.queue.put(event)
+
+    async def run(self) -> None:
+        ''' Writer loop, None in the queue stops it '''
+        stopping = False
+        while not stopping:
+            batch = []
+            event = await self.queue.get()
+            while event is not None:
+                batch.append(event)
+                if len(batch) >= self.batch_size or self.queue.empty():
+                    break
+                event = self.queue.get_nowait()
+            stopping = event is None
+            # Broadcast once committed, outside of the retries of the insert
+            await self.broadcast(await self.insert(batch))
+
+    async def insert(self, events: List[Event]) -> List[Event]:
+        '''
+        Insert a batch, retrying while the DB is not available and splitting it while the DB rejects it.
+        Returns the events inserted
+        '''
+        attempts = 0
+        while True:
+            try:
+                await persist_events(events)
+                return events
+            except Exception as e:
+                if is_transient(e):
+                    if self.stopping:
+                        logger.error(f'Could not write {len(events)} events on shutdown: {e}')
+                        return []
+                    logger.error(f'Could not write {len(events)} events, will retry: {e}')
+                    await asyncio.sleep(self.retry_interval)
+                    continue
+                attempts += 1
+                if attempts < self.max_attempts:
+                    continue
+                if len(events) > 1:
+                    # Insert the halves on their own, so only the events the DB rejects are left out
+                    half = len(events) // 2
+                    return await self.insert(events[:half]) + await self.insert(events[half:])
+                logger.error(f'Event {events[0].id} rejected by the DB, sent to the dead letter stream: {e}')
+                try:
+                    await dead_letter_events(events, str(e))
+                except Exception as e:
+                    logger.error(f'Could not dead letter event {events[0].model_dump_json()}: {e}')
+                return []
+
+    async def broadcast(self, events: List[Event]) -> None:
+        ''' Send the events to the clients, the updates are sent in batches by the aggregator '''
+        for event in events:
+            try:
+                await updates.publish('events', event.id, event.model_dump(mode='json'))
+            except Exception as e:
+                logger.error(f'Could not broadcast event {event.id}: {e}')
+
+    async def write(self, events: List[Event]) -> None:
+        ''' Insert the events and broadcast them '''
+        await persist_events(events)
+        await self.broadcast(events)
+
+event_journal = EventJournal()
 
 class EventsController():
     ''' Events Controller Class '''
     @staticmethod
     async def create_event(actor: Union[User, str], event_type: str, description: Union[str, dict, None] = None, pizza_id: str = None) -> Event:
-        ''' Create an event '''
+        ''' Create an event, written in the background by the event journal '''
         if isinstance(description, dict):
             description = json.dumps(description)
         try:
@@ -24,7 +142,5 @@ class EventsController():
             pizza_id=pizza_id
         )
         
-        persisted = persist_event(event)
-        await ws.emit('events', persisted.model_dump())
-        return persisted
-    
\ No newline at end of file
+        await event_journal.append(event)
+        return event
@@ -13,8 +13,9 @@ from ws import ws
 class RFAController():
     @staticmethod
     async def resolve_rfa(rfa_id: str, status: RFAStatus, approver: Union[User, str], channel: str) -> RFA:
-        ''' Approve the RFA '''
-        rfa = load_persisted_rfa(rfa_id)
+        ''' Approve the RFA, only one of concurrent resolutions wins '''
+        # Never from the cache, a stale copy would let two replicas resolve it
+        rfa = await load_persisted_rfa(rfa_id, cached=False)
         if not rfa:
             raise Exception("RFA not found")
         if rfa.status is not RFAStatus.pending:
@@ -26,8 +27,8 @@ class RFAController():
         rfa.status = status
         rfa.approval_channel = channel
         rfa.approval_time = datetime.datetime.now()
+        rfa = await persist_rfa(rfa) # StaleRFAException if resolved meanwhile
         await EventsController.create_event(approver, "rfa_resolved", {'rfa_id': rfa_id, 'status': status, 'channel': channel})
-        persist_rfa(rfa)
         #RFAController.send_slack_notification(rfa)
         if rfa.status is RFAStatus.approved:
             if rfa.notes:
@@ -47,7 +48,7 @@ class RFAController():
         rfa.approver = None
         rfa.status = RFAStatus.pending
         rfa.approval_channel = None
-        persist_rfa(rfa)
+        rfa = await persist_rfa(rfa)
         try:
             RFAController.send_slack_notification(rfa)
             await RFAController.ws_notify()
@@ -56,17 +57,17 @@ class RFAController():
         return rfa
 
     @staticmethod
-    def get_rfa(rfa_id: str, user: User) -> RFA:
+    async def get_rfa(rfa_id: str, user: User) -> RFA:
         ''' Get the RFA by id '''
-        rfa = load_persisted_rfa(rfa_id)
+        rfa = await load_persisted_rfa(rfa_id)
         if rfa.requester != user.email and user.role is not UserRole.admin:
             raise Exception("Not enough permissions")
         return rfa
     
     @staticmethod
-    def delete_rfa(rfa_id: str) -> None:
+    async def delete_rfa(rfa_id: str) -> None:
         ''' Delete the RFA by id '''
-        delete_persisted_rfa(rfa_id)
+        await delete_persisted_rfa(rfa_id)
             
     @staticmethod
     def send_slack_notification(rfa: RFA) -> None:
@@ -1,78 +1,88 @@
 ''' PoP Controller'''
 import datetime
-from typing import List
-from functools import cmp_to_key
-from persistance.tasks import load_persisted_task, persist_task, load_pending_tasks_for_region, delete_persisted_task
+from typing import List, Dict, Tuple
+from persistance.tasks import load_persisted_task, load_persisted_tasks, persist_task, persist_tasks, load_pending_tasks_for_region, return_pending_tasks, delete_persisted_task, claim_persisted_task, lease_expiration
 from persistance.operations import load_persisted_operation
-from models.tasks import Task, TaskStatus
+from models.tasks import Task, TaskStatus, reclaimable
 from operations import get_operation_controller
 from logs import logger
-from ws import ws
+from ws import updates, operation_room
 import traceback
 
 class AlreadyRunningException(Exception):
     ''' Task already running '''
 class OperationNotFoundException(Exception):
     ''' Operation not found '''
+class LeaseLostException(Exception):
+    ''' Update from a worker whose lease on the task expired '''
+class UnknownTaskException(Exception):
+    ''' Task whose handler is not in the graph of its operation '''
 
-def sort_tasks_by_priority(task1: Task, task2: Task) -> int:
-    ''' Compare tasks '''
-    # Prioritize non-pending tasks
-    if task1.status != task2.status:
-        if task1.status in (TaskStatus.pending):
-            return -1 # Task 2 wins
-        if task2.status in (TaskStatus.pending):
-            return 1  # Task 1 wins
-        return 0
-    # Prioritize tasks with older last_refresh
-    now = datetime.datetime.now()
-    t1_time = task1.last_refresh or now
-    t2_time = task2.last_refresh or now
-    if t1_time < t2_time:
-        return 1
-    if t1_time > t2_time:
-        return -1
-    # Prioritize older tasks
-    t1_time = task1.started_at or now
-    t2_time = task2.started_at or now
-    if t1_time < t2_time:
-        return 1
-    if t1_time > t2_time:
-        return -1
-    return 0
+MAX_TASKS_PER_PULL = 100
 
-def prioritize_tasks(tasks: List[Task]) -> List[Task]:
-    ''' Prioritize tasks '''
-    logger.debug(f'Prioritizing tasks: {tasks}')
-    prioritized_tasks = []
-    for i, task in enumerate(tasks):
-        is_waiting = task.status is TaskStatus.pending_wait
-        wait_time = task.wait_time or 30
-        wait_timedelta = datetime.datetime.now() - datetime.timedelta(seconds=wait_time)
-        is_recent = (task.last_refresh or datetime.datetime.now()) > wait_timedelta
-        if is_waiting and (task.last_refresh is not None) and is_recent:
+async def get_tasks_for_region(region: str, credits: int | None = None, limits: Dict[str, int] | None = None) -> Tuple[List[Task], bool]:
+    '''
+    Get tasks for a region worker by priority, no more than the credits the worker has.
+    limits caps the tasks of some handlers, ie bake_pizza to the free ovens of the worker.
+    Returns the tasks and whether the worker left tasks behind
+    '''
+    limit = MAX_TASKS_PER_PULL if credits is None else max(0, min(credits, MAX_TASKS_PER_PULL))
+    if not limit:
+        return [], False
+    left = dict(limits) if limits else None
+    # Tasks beyond a limit are skipped, look further down the queue for others
+    candidates, handout = await load_pending_tasks_for_region(region, MAX_TASKS_PER_PULL if left else limit)
+    tasks, returned = [], []
+    for task in candidates:
+        try:
+            task = await set_task_handler(task)
+        except UnknownTaskException as e:
+            # No worker can run it
+            await reject_task(task, str(e))
             continue
-        else:
-            prioritized_tasks.append(task)
+        if len(tasks) >= limit or (left is not None and task.task in left and left[task.task] <= 0):
+            returned.append(task)
+            continue
+        if left is not None and task.task in left:
+            left[task.task] -= 1
+        tasks.append(task)
+    # The pull popped them, the ones not sent are visible again for the next pulls
+    await return_pending_tasks(returned, handout)
+    return [reclaimable(x) for x in tasks], bool(returned) or (credits is not None and len(tasks) >= credits > 0)
 
-    sorted_tasks = sorted(prioritized_tasks, key=cmp_to_key(sort_tasks_by_priority))
-    logger.debug(f'Sorted tasks: {sorted_tasks}')
-    return sorted_tasks
+async def set_task_handler(task: Task) -> Task:
+    '''
+    Tasks created before the handler identifier was stored get it from the graph of their operation.
+    Raises UnknownTaskException if the graph does not have their task_id
+    '''
+    if task.task or not task.operation_id:
+        return task
+    operation = await load_persisted_operation(task.operation_id)
+    ctl = get_operation_controller(operation.operation) if operation else None
+    task.task = ctl.graph.handler_for(task.task_id) if ctl else None
+    if not task.task:
+        raise UnknownTaskException(f'Unknown task {task.task_id} of operation {task.operation_id}')
+    return task
 
-async def get_tasks_for_region(region: str) -> List[Task]:
-    ''' Get tasks for a region worker '''
-    tasks = load_pending_tasks_for_region(region)
-    if tasks:
-        return prioritize_tasks(tasks)
-    return []
+async def reject_task(task: Task, error: str) -> None:
+    ''' Error a task no worker can run, its operation handles the error '''
+    logger.error(f'Task {task.uuid} rejected: {error}')
+    task.status = TaskStatus.errored
+    task.error = error
+    task.lease_expires_at = None
+    await persist_task(task)
+    await send_task_update(task)
+    try:
+        await on_task_errored(task)
+    except Exception as e:
+        logger.error(f'Error in managing the error of task {task.uuid}: {e}')
 
 async def send_task_update(task: Task):
     ''' Send task update '''
     try:
-        payload = {}
-        if task:
-            payload["task"] = task.model_dump()
-        await ws.emit('task_update', payload)
+        if not task:
+            return
+        await updates.publish('task_update', task.uuid, task.model_dump(mode='json'), to=operation_room(task.operation_id))
 
     except Exception as e:
         logger.error(f'Could not send ws update for task: {e}')
@@ -80,7 +90,7 @@ async def send_task_update(task: Task):
 
 async def on_task_errored(task: Task):
     ''' Task errored '''
-    operation = load_persisted_operation(task.operation_id)
+    operation = await load_persisted_operation(task.operation_id)
     ctl = get_operation_controller(operation.operation)
     if not ctl:
         raise OperationNotFoundException('Operation not found')
@@ -89,8 +99,8 @@ async def on_task_errored(task: Task):
 async def on_task_complete(task: Task):
     ''' Task completed '''
     if not task.operation_id:
-        return delete_persisted_task(task.uuid)
-    operation = load_persisted_operation(task.operation_id)
+        return await delete_persisted_task(task.uuid)
+    operation = await load_persisted_operation(task.operation_id)
     ctl = get_operation_controller(operation.operation)
     if not ctl:
         raise OperationNotFoundException('Operation not found')
@@ -100,36 +110,112 @@ async def on_task_complete(task: Task):
         logger.error(f'Error in managing task completion: {e}')        
         logger.exception(traceback.print_exc())
 
+async def claim_task(execution: Task):
+    ''' A worker starts running a task, only one of them can hold it '''
+    task = await claim_persisted_task(execution.uuid, execution.region, execution.started_at)
+    if not task:
+        if not await load_persisted_task(execution.uuid):
+            logger.error(f'Task {execution.uuid} not found in DB')
+            raise OperationNotFoundException('Task not found')
+        logger.error(f'Task {execution.uuid} already running')
+        raise AlreadyRunningException('Task already running')
+    logger.info(f'Task {task.uuid} claimed with lease {task.lease_token}')
+    await send_task_update(task)
+    return {"status": "ok", "lease_token": task.lease_token}
+
+def apply_execution(task: Task, execution: Task):
+    ''' Copy the update of a worker to the persisted task '''
+    if task.lease_token and execution.lease_token != task.lease_token:
+        # Fencing: once claimed, only the worker with the current lease updates the task, a missing token included
+        logger.error(f'Task {execution.uuid} update with lease {execution.lease_token}, current is {task.lease_token}')
+        raise LeaseLostException('Task lease lost')
+    task.started_at = execution.started_at or datetime.datetime.now()
+    task.completed_at = execution.completed_at
+    task.result = execution.result
+    task.error = execution.error
+    if isinstance(execution.status, str):
+        task.status = TaskStatus(execution.status)
+    else:
+        task.status = execution.status
+    task.wait_time = execution.wait_time
+    task.max_wait_time = execution.max_wait_time
+    if execution.last_refresh:
+        task.last_refresh = execution.last_refresh
+    # The worker running or waiting on the task keeps its lease while it sends updates
+    task.lease_expires_at = lease_expiration() if task.status in (TaskStatus.running, TaskStatus.waiting) else None
+
 async def on_task_notify(execution: Task):
     ''' Task notification from worker '''
-    task = load_persisted_task(execution.uuid)
+    if execution.status is TaskStatus.running:
+        return await claim_task(execution)
+    task = await load_persisted_task(execution.uuid)
     if not task:
         logger.error(f'Task {execution.uuid} not found in DB')
         raise OperationNotFoundException('Task not found')
-    if execution.status is TaskStatus.running and execution.started_at != task.started_at:
-        if task.status is not TaskStatus.pending:
-            logger.error(f'Task {execution.uuid} already running')
-            raise AlreadyRunningException('Task already running')
-        task.started_at = execution.started_at
-        task.status = TaskStatus.running
-    else:
-        task.started_at = execution.started_at or datetime.datetime.now()
-        task.completed_at = execution.completed_at
-        task.result = execution.result
-        task.error = execution.error
-        if isinstance(execution.status, str):
-            task.status = TaskStatus(execution.status)
-        else:
-            task.status = execution.status
-        task.wait_time = execution.wait_time
-        task.max_wait_time = execution.max_wait_time
-        if execution.last_refresh:
-            task.last_refresh = execution.last_refresh
+    apply_execution(task, execution)
     logger.info(f'Task {task.uuid} updated with status {task.status}, persisting')
-    persist_task(task)
+    await persist_task(task)
     await send_task_update(task)
     if execution.status == TaskStatus.completed:
         await on_task_complete(task)
     if execution.status == TaskStatus.errored:
         await on_task_errored(task)
     return {"status": "ok"}
+
+async def on_tasks_notify(executions: List[Task]) -> List[dict]:
+    '''
+    Batch of task notifications from a worker, persisted with a single redis pipeline and DB transaction.
+    Returns an ack per execution, in the same order
+    '''
+    acks = [None] * len(executions)
+    updated = []
+    for i, execution in enumerate(executions):
+        if execution.status is not TaskStatus.running:
+            updated.append(i)
+            continue
+        # Claims are atomic on their own
+        try:
+            acks[i] = {"uuid": execution.uuid, **await claim_task(execution)}
+        except (AlreadyRunningException, OperationNotFoundException) as e:
+            acks[i] = {"uuid": execution.uuid, "status": "error", "error": str(e)}
+        except Exception as e:
+            logger.error(f'Error claiming task {execution.uuid}: {e}')
+            acks[i] = {"uuid": execution.uuid, "status": "error", "error": str(e)}
+    uuids = list(dict.fromkeys(executions[i].uuid for i in updated))
+    tasks = {task.uuid: task for task in await load_persisted_tasks(uuids) if task}
+    changed = {}
+    for i in updated:
+        execution = executions[i]
+        task = tasks.get(execution.uuid)
+        if not task:
+            logger.error(f'Task {execution.uuid} not found in DB')
+            acks[i] = {"uuid": execution.uuid, "status": "error", "error": "Task not found"}
+            continue
+        try:
+            apply_execution(task, execution)
+        except LeaseLostException as e:
+            acks[i] = {"uuid": execution.uuid, "status": "error", "error": str(e)}
+            continue
+        changed[task.uuid] = task
+        acks[i] = {"uuid": execution.uuid, "status": "ok"}
+    logger.info(f'Batch of {len(executions)} task updates, persisting {len(changed)} tasks')
+    await persist_tasks(list(changed.values()))
+    for task in changed.values():
+        await send_task_update(task)
+    for i in updated:
+        execution = executions[i]
+        if acks[i]["status"] != "ok":
+            continue
+        try:
+            if execution.status == TaskStatus.completed:
+                await on_task_complete(tasks[execution.uuid])
+            if execution.status == TaskStatus.errored:
+                await on_task_errored(tasks[execution.uuid])
+        except OperationNotFoundException as e:
+            acks[i] = {"uuid": execution.uuid, "status": "error", "error": str(e)}
+        except Exception as e:
+            # The update is persisted, the rest of the batch is not sent again for it
+            logger.error(f'Error managing the update of task {execution.uuid}: {e}')
+            logger.exception(traceback.print_exc())
+            acks[i] = {"uuid": execution.uuid, "status": "error", "error": str(e)}
+    return acks
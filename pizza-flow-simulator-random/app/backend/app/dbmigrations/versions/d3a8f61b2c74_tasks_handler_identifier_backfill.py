@@ -0,0 +1,39 @@
+"""Handler identifier of the tasks created before it was stored
+
+Revision ID: d3a8f61b2c74
+Revises: b7c2e5f8a013
+Create Date: 2026-10-18 22:03:12.640581
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3a8f61b2c74'
+down_revision: Union[str, None] = 'b7c2e5f8a013'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Tasks of each operation when the handler identifier was added, task_id is the position in the list starting at 1
+OPERATION_TASKS = {
+    'create_pizza': ['make_dough', 'add_toppings', 'bake_pizza', 'deliver_pizza'],
+}
+
+
+def upgrade() -> None:
+    for operation, tasks in OPERATION_TASKS.items():
+        for i, task in enumerate(tasks):
+            op.execute(sa.text(
+                'UPDATE tasks SET task = :task FROM operations '
+                'WHERE tasks.operation_id = operations.uuid AND operations.operation = :operation '
+                'AND tasks.task IS NULL AND tasks.task_id = :task_id'
+            ).bindparams(task=task, operation=operation, task_id=str(i + 1)))
+
+
+def downgrade() -> None:
+    # The column is dropped by the downgrade of c5d18a0e7f43
+    pass
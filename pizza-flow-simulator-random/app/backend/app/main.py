@@ -1,12 +1,41 @@
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, APIRouter
 import socketio
 from logs import logger, LogMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    ''' Startup and shutdown hooks '''
+    from persistance.database import dispose_engine
+    from persistance.write_behind import flusher
+    from persistance.tasks import rebuild_pending_index
+    from persistance.redis import create_search_indexes
+    from persistance.cache import invalidations
+    from controllers.events import event_journal
+    await flusher.start()
+    await event_journal.start()
+    await invalidations.start()
+    try:
+        await rebuild_pending_index()
+    except Exception as e:
+        logger.error(f'Could not rebuild the pending tasks index: {e}')
+    try:
+        await create_search_indexes()
+    except Exception as e:
+        logger.error(f'Could not create the search indexes, listings are served by the DB: {e}')
+    yield
+    from ws import updates
+    await event_journal.stop() # Its broadcasts go through updates
+    await updates.close()
+    await invalidations.stop()
+    await flusher.stop()
+    await dispose_engine()
+
 api_app = APIRouter(prefix="/api")
 SECRET_KEY = os.getenv("SECRET_KEY", "b423d5741f142a07621502e45f761ee97779e74d4b80c4d8194cf2f1e02c1f7e")
-app = FastAPI(title="SaaS App")
+app = FastAPI(title="SaaS App", lifespan=lifespan)
 app.add_middleware(SessionMiddleware, secret_key=SECRET_KEY)
 app.add_middleware(LogMiddleware)
 
@@ -26,6 +26,7 @@ class Operation(SQLModel, table=True):
     result: Dict | None = Field(sa_type=JSONB, default_factory=dict)
     start_date: datetime.datetime = Field(default_factory=datetime.datetime.now)
     end_date: datetime.datetime | None = None
+    version: int = 0 # Incremented on every change, sent as the ETag
     tasks: List["Task"] = Relationship(back_populates="operation")
 
     @field_serializer('start_date', 'end_date')
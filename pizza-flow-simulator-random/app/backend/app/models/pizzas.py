@@ -5,6 +5,7 @@ from enum import StrEnum
 from typing import List
 from pydantic import field_serializer, Field
 from sqlmodel import Field, SQLModel, Relationship
+from sqlalchemy import Index
 from pydantic import field_serializer
 
 class PizzaStatus(StrEnum):
@@ -30,6 +31,10 @@ class PizzaTier(StrEnum):
 class Pizza(SQLModel, table=True):
     ''' Represents a pizza order '''
     __tablename__: str = 'pizzas'
+    __table_args__ = (
+        Index('ix_pizzas_creation_id', 'creation', 'id'),
+        Index('ix_pizzas_status_creation_id', 'status', 'creation', 'id'),
+    )
     id: uuid.UUID = Field(primary_key=True, default_factory=uuid.uuid4, index=True)
     name: str
     status: PizzaStatus = Field(default=PizzaStatus.pending, index=True)
@@ -5,6 +5,7 @@ from uuid import uuid4
 from .operations import Operation
 from pydantic import Field, field_serializer
 from sqlmodel import Field, SQLModel, Relationship
+from sqlalchemy import Index
 from sqlalchemy.dialects.postgresql import JSONB
 
 class TaskStatus(StrEnum):
@@ -17,13 +18,55 @@ class TaskStatus(StrEnum):
     pending_wait = "pending_wait" # Task is pending wait in the server
     cancelled = 'cancelled'
 
+# Statuses of the tasks a worker can pull
+PENDING_TASK_STATUSES = (TaskStatus.pending, TaskStatus.pending_wait)
+# Statuses of the tasks held by a worker, they can be pulled again when its lease expires
+LEASED_TASK_STATUSES = (TaskStatus.running, TaskStatus.waiting)
+# Tasks being refreshed or reclaimed go before the ones not started yet
+PRIORITY_CLASSES = {TaskStatus.running: 0, TaskStatus.waiting: 0, TaskStatus.pending_wait: 0, TaskStatus.pending: 1}
+
+def task_priority(task: 'Task') -> tuple | None:
+    '''
+    Priority of a task a worker can pull, lower goes first: (status class, due time, started_at) as timestamps.
+    pending_wait tasks are due wait_time seconds after their last refresh, running and waiting ones when their lease expires.
+    None if the task can never be pulled
+    '''
+    started_at = task.started_at.timestamp() if task.started_at else 0
+    if task.status in LEASED_TASK_STATUSES:
+        if not task.lease_expires_at:
+            return None
+        return (PRIORITY_CLASSES[task.status], task.lease_expires_at.timestamp(), started_at)
+    if task.status not in PRIORITY_CLASSES:
+        return None
+    due = started_at
+    if task.last_refresh:
+        due = task.last_refresh.timestamp()
+        if task.status is TaskStatus.pending_wait:
+            due += task.wait_time or 30
+    return (PRIORITY_CLASSES[task.status], due, started_at)
+
+def reclaimable(task: 'Task') -> 'Task':
+    '''
+    A task pulled after the lease of its worker expired goes out as pending, to be claimed again,
+    or as pending_wait if it was waiting, to be checked again
+    '''
+    if task.status is TaskStatus.running:
+        task.status = TaskStatus.pending
+    elif task.status is TaskStatus.waiting:
+        task.status = TaskStatus.pending_wait
+    return task
+
 class Task(SQLModel, table=True):
     ''' Task Execution model '''
     __tablename__: str = 'tasks'
+    __table_args__ = (
+        Index('ix_tasks_region_status', 'region', 'status'),
+    )
     uuid: str = Field(primary_key=True, default_factory=lambda: str(uuid4()))
     task_id: str
+    task: str | None = None # Identifier of the task handler, ie make_dough
     region: str
-    operation_id: str | None = Field(foreign_key="operations.uuid")
+    operation_id: str | None = Field(foreign_key="operations.uuid", index=True)
     operation: Operation = Relationship(back_populates="tasks")
     parameters: dict = Field(sa_type=JSONB, default_factory=dict)
     retries: int = 0
@@ -36,8 +79,11 @@ class Task(SQLModel, table=True):
     result: dict | None = Field(sa_type=JSONB, default_factory=dict)
     wait_time: int | None = 30 # Time to wait before refreshing the task
     max_wait_time: int | None = None  # How many iterations to wait before cancelling the task
+    lease_token: int = 0 # Fencing token, incremented every time a worker claims the task
+    lease_expires_at: datetime.datetime | None = None # A running task can be claimed again after it
+    version: int = 0 # Incremented on every change, sent as the ETag
 
-    @field_serializer('started_at', 'completed_at', 'last_refresh')
+    @field_serializer('started_at', 'completed_at', 'last_refresh', 'lease_expires_at')
     def serialize_time(self, value):
         ''' Serialize the time fields '''
         if value is None:
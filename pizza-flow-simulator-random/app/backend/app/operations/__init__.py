@@ -1,3 +1,6 @@
+from .registry import OperationRegister
+registry = OperationRegister()
+
 from .create_pizza import OperationCreatePizza
 from models.operations import Operation
 
@@ -10,9 +13,7 @@ async def start_operation(operation: str, parameters: dict, rfa_id:str=None):
 
 def get_operation_controller(operation: str):
     ''' Get the operation controller '''
-    if operation == 'create_pizza':
-        return OperationCreatePizza()
-    return None
+    return registry.get_controller(operation)
 
 async def cancel_operation(operation: Operation):
     ''' Cancel the operation '''
@@ -26,7 +27,7 @@ async def delete_operation(operation: Operation):
     controller = get_operation_controller(operation.operation)
     if not controller:
         raise Exception(f'Operation {operation.uuid} not found')
-    controller.delete_operation(operation)
+    await controller.delete_operation(operation)
 
 async def schedule_next_tasks_operation(operation: Operation):
     ''' Refresh the schedule '''
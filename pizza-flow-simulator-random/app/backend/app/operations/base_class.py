@@ -1,96 +1,155 @@
 from models.operations import Operation, OperationStatus
 from models.tasks import Task, TaskStatus
 from persistance.tasks import persist_task, load_tasks_for_operation, delete_persisted_task
-from persistance.operations import load_persisted_operation, persist_operation, delete_persisted_operation
+from persistance.operations import (
+    load_persisted_operation,
+    persist_operation,
+    delete_persisted_operation,
+    init_operation_graph,
+    complete_operation_task,
+    operation_lock
+)
+from .graph import TaskGraph
 from typing import Any
 from uuid import uuid4
+import asyncio
 import datetime
 import requests
 from logs import logger
-from ws import ws
+from ws import ws, updates, region_room, operation_room, OPERATIONS_ROOM
 
 class OperationBase:
     ''' Base class for operations '''
     identifier: str
     all_tasks: list[str]
 
-    def __init__(self, op_uuid: str):
+    def __init__(self, op_uuid: str = None):
         ''' Initialize the operation '''
         self.uuid = op_uuid
 
+    def precompute(self) -> None:
+        ''' Build the lookup structures of the controller, called once when registered '''
+        self.graph
+
+    @property
+    def graph(self) -> TaskGraph:
+        ''' Dependency graph of the tasks, compiled once per operation class '''
+        cls = type(self)
+        if '_graph' not in cls.__dict__:
+            cls._graph = TaskGraph(self.all_tasks, self.dependencies_for)
+        return cls._graph
+
     async def start(self, parameters: dict, rfa_id: str = None) -> Operation:
         ''' Start the operation '''
         raise NotImplementedError('Start method not implemented')
     
     async def cancel(self, operation: Operation):
         ''' Cancel the operation '''
-        if operation.status not in [OperationStatus.pending, OperationStatus.paused, OperationStatus.errored]:
-            raise Exception(f'Operation {operation.uuid} is not pending')
-        operation.status = OperationStatus.cancelled
-        self.save_operation(operation)
+        async with operation_lock(operation.uuid):
+            operation = await self.get_operation(operation.uuid)
+            if operation.status not in [OperationStatus.pending, OperationStatus.paused, OperationStatus.errored]:
+                raise Exception(f'Operation {operation.uuid} is not pending')
+            operation.status = OperationStatus.cancelled
+            await self.save_operation(operation)
         await self.cancel_tasks(operation.parameters, operation.uuid)
 
     async def pause(self, operation: Operation):
         ''' Cancel the operation '''
-        if operation.status not in [OperationStatus.running]:
-            raise Exception(f'Operation {operation.uuid} is not running')
-        operation.status = OperationStatus.paused
-        self.save_operation(operation)
+        async with operation_lock(operation.uuid):
+            operation = await self.get_operation(operation.uuid)
+            if operation.status not in [OperationStatus.running]:
+                raise Exception(f'Operation {operation.uuid} is not running')
+            operation.status = OperationStatus.paused
+            await self.save_operation(operation)
         await self.pause_tasks(operation.parameters, operation.uuid)
 
-    def delete_operation(self, operation: Operation, force: bool = False):
+    async def delete_operation(self, operation: Operation, force: bool = False):
         ''' Delete the operation '''
         if operation.status not in [OperationStatus.cancelled, OperationStatus.completed, OperationStatus.errored] and not force:
             raise Exception(f'Operation {operation.uuid} is not cancelled')
-        self.delete_tasks(operation.uuid)
-        delete_persisted_operation(operation.uuid)
+        await self.delete_tasks(operation.uuid)
+        await delete_persisted_operation(operation.uuid)
     
+    async def start_tasks(self, operation: Operation, region: str) -> None:
+        ''' Initialize the dependencies counters and schedule the tasks without dependencies '''
+        await init_operation_graph(operation.uuid, self.graph.in_degree)
+        await self.schedule_tasks(operation, self.graph.roots, region)
+
     async def on_task_complete(self, task: Task):
         ''' Task completed, schedule next task '''
-        operation = self.get_operation(task.operation_id)
-        
-        # Update self status
-        if operation.status is OperationStatus.pending:
-            operation.status = OperationStatus.running
-        logger.info(f'Operation {operation.uuid} running')
-        # Get information to schedule next tasks
-        db_tasks = self.get_operation_tasks(task.operation_id)
-        completed_tasks_ids = [t.task for t in db_tasks if t.status == 'completed']
-        pending_tasks = [t for t in self.all_tasks if t not in [t.task for t in db_tasks]]
+        # Sibling tasks complete concurrently, each one updates the operation in turn
+        async with operation_lock(task.operation_id):
+            operation = await self.get_operation(task.operation_id)
         
-        # Schedule the next tasks
-        for task_id in pending_tasks:
-            dependencies = self.dependencies_for(task_id)
-            if all([dependency_name in completed_tasks_ids for dependency_name in dependencies]): # All dependencies are completed
-                next_task = Task(
-                    task_id=len(db_tasks) + 1,  # Increment task ID
-                    operation_id=task.operation_id,
-                    region=task.region,  # Use the same region as the completed task
-                    status=TaskStatus.pending,
-                    task=task_id,
-                    parameters=operation.parameters
-                )
-                await self.save_task(next_task)
-        # Check if all tasks are completed
-        db_tasks = self.get_operation_tasks(task.operation_id) # Refresh the tasks with the new generated ones
-        if all([t.status == 'completed' for t in db_tasks]):
-            operation.status = OperationStatus.completed
-            operation.end_date = datetime.datetime.now()
-            logger.info(f'Operation {operation.operation} completed')
-            await self.on_all_task_completed(operation)
-        self.save_operation(operation)
-        await self.send_ws_update(operation)
+            # Update self status
+            if operation.status is OperationStatus.pending:
+                operation.status = OperationStatus.running
+            logger.info(f'Operation {operation.uuid} running')
+            # Release the successors whose dependencies are all completed
+            progress = None
+            name = self.task_name(task)
+            if name in self.graph.position:
+                progress = await complete_operation_task(operation.uuid, name, self.graph.successors[name])
+            if progress is None:
+                # No dependencies counters for the operation, compute them from the tasks
+                all_completed = await self.schedule_next_tasks(operation, task.region)
+            else:
+                completed_count, ready = progress
+                await self.schedule_tasks(operation, ready, task.region)
+                all_completed = completed_count == len(self.graph)
+            # Check if all tasks are completed
+            if all_completed:
+                operation.status = OperationStatus.completed
+                operation.end_date = datetime.datetime.now()
+                logger.info(f'Operation {operation.operation} completed')
+                await self.on_all_task_completed(operation)
+            await self.save_operation(operation)
+            await self.send_ws_update(operation)
 
     async def on_all_task_completed(self, operation: Operation) -> None:
         ''' All tasks completed '''
         return
+
+    async def schedule_next_tasks(self, operation: Operation, region: str = None) -> bool:
+        ''' Schedule the ready tasks not created yet, from the tasks status. Returns if all the tasks are completed '''
+        tasks = {self.task_name(t): t for t in await self.get_operation_tasks(operation.uuid)}
+        completed = {name for name, t in tasks.items() if t.status == TaskStatus.completed}
+        ready = [name for name in self.graph.ready(completed) if name not in tasks]
+        if not region:
+            region = next((t.region for t in tasks.values()), None) or operation.parameters.get('region')
+        await self.schedule_tasks(operation, ready, region)
+        return len(completed.intersection(self.graph.tasks)) == len(self.graph)
+
+    def task_name(self, task: Task) -> str | None:
+        ''' Name of a task in the graph, from its task_id for the tasks created before the name was stored '''
+        return task.task or self.graph.handler_for(task.task_id)
+
+    async def schedule_tasks(self, operation: Operation, task_names: list[str], region: str) -> list[Task]:
+        ''' Create the given tasks as pending, independent tasks are dispatched concurrently '''
+        tasks = [
+            Task(
+                task_id=str(self.graph.position[name] + 1),
+                task=name,
+                operation_id=operation.uuid,
+                region=region,
+                status=TaskStatus.pending,
+                parameters=self.parameters_for(name, operation.parameters)
+            )
+            for name in task_names
+        ]
+        return await asyncio.gather(*[self.save_task(t) for t in tasks])
+
+    def parameters_for(self, task_name: str, parameters: dict) -> dict:
+        ''' Get the parameters of a task from the operation parameters '''
+        return parameters
     
     async def on_task_error(self, task: Task):
         ''' Task errored '''
-        operation = self.get_operation(task.operation_id)
-        operation.status = OperationStatus.errored
-        print(f'Operation {operation.operation} errored')
-        self.save_operation(operation)
+        async with operation_lock(task.operation_id):
+            operation = await self.get_operation(task.operation_id)
+            operation.status = OperationStatus.errored
+            print(f'Operation {operation.operation} errored')
+            await self.save_operation(operation)
         return task
 
     def dependencies_for(self, task_id: str):
@@ -104,7 +163,7 @@ class OperationBase:
     
     async def cancel_tasks(self, parameters: Any, operation_uuid: str):
         ''' Cancel the tasks '''
-        tasks = self.get_operation_tasks(operation_uuid)
+        tasks = await self.get_operation_tasks(operation_uuid)
         for task in tasks:
             if task.status == 'pending':
                 task.status = 'cancelled'
@@ -112,36 +171,36 @@ class OperationBase:
 
     async def pause_tasks(self, parameters: Any, operation_uuid: str):
         ''' Cancel the tasks '''
-        tasks = self.get_operation_tasks(operation_uuid)
+        tasks = await self.get_operation_tasks(operation_uuid)
         for task in tasks:
             if task.status == 'pending':
                 task.status = 'paused'
                 await self.save_task(task)
     
-    def delete_tasks(self, operation_uuid: str):
+    async def delete_tasks(self, operation_uuid: str):
         ''' Delete the tasks '''
-        tasks = self.get_operation_tasks(operation_uuid)
+        tasks = await self.get_operation_tasks(operation_uuid)
         for task in tasks:
-            delete_persisted_task(task.uuid)
+            await delete_persisted_task(task.uuid)
     
-    def save_operation(self, operation: Operation) -> Operation:
+    async def save_operation(self, operation: Operation) -> Operation:
         ''' Save the operation '''
-        return persist_operation(operation)
+        return await persist_operation(operation)
 
-    def get_operation(self, uuid: str) -> Operation:
-        ''' Get the operation '''
-        return load_persisted_operation(uuid)
+    async def get_operation(self, uuid: str) -> Operation:
+        ''' Get the operation to update it '''
+        return await load_persisted_operation(uuid, cached=False)
 
-    def get_operation_tasks(self, operation_uuid: str) -> list[Task]:
+    async def get_operation_tasks(self, operation_uuid: str) -> list[Task]:
         ''' Get the operation tasks '''
-        return load_tasks_for_operation(operation_uuid)
+        return await load_tasks_for_operation(operation_uuid)
 
     async def save_task(self, task: Task) -> Task:
         ''' Save the task '''
-        persisted_task = persist_task(task)
+        persisted_task = await persist_task(task)
         if persisted_task.status == TaskStatus.pending:
-           await ws.emit('task', persisted_task.model_dump(), namespace='/worker')
-        await ws.emit('task_update', persisted_task.model_dump())
+           await ws.emit('task', persisted_task.model_dump(), to=region_room(persisted_task.region), namespace='/worker')
+        await updates.publish('task_update', persisted_task.uuid, persisted_task.model_dump(mode='json'), to=operation_room(persisted_task.operation_id))
         return persisted_task
     
     def gen_operation_uuid(self):
@@ -153,8 +212,7 @@ class OperationBase:
         try:
             if not operation:
                 return
-            payload = {"operation": operation.model_dump()}
-            await ws.emit('operation_update', payload)
+            await updates.publish('operation_update', operation.uuid, operation.model_dump(mode='json'), to=[operation_room(operation.uuid), OPERATIONS_ROOM])
 
         except Exception as e:
             logger.error(f'Could not send ws update for Operation: {e}')
@@ -1,10 +1,12 @@
 from .base_class import OperationBase
+from operations import registry
 from models.operations import Operation, OperationStatus
-from models.tasks import Task
+from models.pizzas import PizzaTier
 from controllers.events import EventsController
 from logs import logger
-from ws import ws
+from ws import updates, operation_room, rfa_room
 
+@registry.register()
 class OperationCreatePizza(OperationBase):
     ''' Controller for the create of a pizza '''
     identifier = 'create_pizza'
@@ -13,6 +15,13 @@ class OperationCreatePizza(OperationBase):
     def __init__(self, op_uuid: str = None):
         super().__init__(op_uuid)
 
+    def precompute(self) -> None:
+        ''' Build the ingredients and toppings of every tier '''
+        super().precompute()
+        tiers = [*PizzaTier, 'standard']
+        self.ingredients_by_tier = {tier: self.build_ingredients_for_tier(tier) for tier in tiers}
+        self.toppings_by_tier = {tier: self.build_toppings_for_tier(tier) for tier in tiers}
+
     async def start(self, parameters: dict, rfa_id: str = None) -> Operation:
         ''' Start the operation '''
         logger.info(f"Starting create pizza operation with parameters: {parameters}")
@@ -24,79 +33,69 @@ class OperationCreatePizza(OperationBase):
             status=OperationStatus.pending,
             rfa_id=str(rfa_id) if rfa_id else None
         )
-        self.save_operation(operation)
+        await self.save_operation(operation)
         await EventsController.create_event('system', "started_pizza_creation", {'region': parameters['region'], 'status': OperationStatus.pending, 'tier': parameters['tier'], 'operation_id': operation.uuid})
         
         # Get the region from parameters
         region = parameters.get('region', 'eu-west-3')  # Default to eu-west-3 if not specified
         
-        # Create tasks for the pizza making process
-        # 1. Make dough task
-        dough_task = Task(
-            operation_id=operation.uuid,
-            task_id=1,
-            region=region,
-            status=OperationStatus.pending,
-            task='make_dough',
-            parameters={
+        # Create the tasks for the pizza making process without dependencies,
+        # the rest are created as their dependencies complete
+        await self.start_tasks(operation, region)
+
+        # Notify the customer via WebSocket
+        try:
+            await updates.publish('pizza_update', operation.uuid, {'operation_id': operation.uuid, 'status': 'order_accepted'}, to=self.pizza_rooms(operation))
+        except Exception as e:
+            logger.error(f"Error sending WebSocket update: {e}")
+        return operation
+    
+    def pizza_rooms(self, operation: Operation) -> list[str]:
+        ''' Rooms of the clients following the pizza, by operation or by the RFA that requested it '''
+        rooms = [operation_room(operation.uuid)]
+        if operation.rfa_id:
+            rooms.append(rfa_room(operation.rfa_id))
+        return rooms
+
+    def parameters_for(self, task_name: str, parameters: dict) -> dict:
+        """Get the parameters of each step of the pizza making process"""
+        if task_name == 'make_dough':
+            return {
                 'name': parameters['name'],
                 'ingredients': self.get_ingredients_for_tier(parameters['tier'])
             }
-        )
-        await self.save_task(dough_task)
-        
-        # 2. Add toppings task
-        toppings_task = Task(
-            operation_id=operation.uuid,
-            task_id=2,
-            region=region,
-            status=OperationStatus.pending,
-            task='add_toppings',
-            parameters={
+        if task_name == 'add_toppings':
+            return {
                 'name': parameters['name'],
                 'toppings': self.get_toppings_for_tier(parameters['tier'])
             }
-        )
-        await self.save_task(toppings_task)
-        
-        # 3. Bake pizza task
-        bake_task = Task(
-            operation_id=operation.uuid,
-            task_id=3,
-            region=region,
-            status=OperationStatus.pending,
-            task='bake_pizza',
-            parameters={
+        if task_name == 'bake_pizza':
+            return {
                 'name': parameters['name'],
                 'temperature': 350,  # Temperature in Celsius
                 'time': 12  # Time in minutes
             }
-        )
-        await self.save_task(bake_task)
-        
-        # 4. Deliver pizza task
-        deliver_task = Task(
-            operation_id=operation.uuid,
-            task_id=4,
-            region=region,
-            status=OperationStatus.pending,
-            task='deliver_pizza',
-            parameters={
+        if task_name == 'deliver_pizza':
+            return {
                 'name': parameters['name'],
                 'delivery_address': parameters.get('delivery_address', 'Customer Address')
             }
-        )
-        await self.save_task(deliver_task)
+        return parameters
 
-        # Notify the customer via WebSocket
-        try:
-            await ws.emit('pizza_update', {'operation_id': operation.uuid, 'status': 'order_accepted'})
-        except Exception as e:
-            logger.error(f"Error sending WebSocket update: {e}")
-        return operation
-    
     def get_ingredients_for_tier(self, tier: str) -> dict:
         """Get ingredients based on the pizza tier"""
+        if tier in self.ingredients_by_tier:
+            return dict(self.ingredients_by_tier[tier])
+        return self.build_ingredients_for_tier(tier)
+
+    def get_toppings_for_tier(self, tier: str) -> list:
+        """Get toppings based on the pizza tier"""
+        if tier in self.toppings_by_tier:
+            return list(self.toppings_by_tier[tier])
+        return self.build_toppings_for_tier(tier)
+
+    def build_ingredients_for_tier(self, tier: str) -> dict:
+        """Build the ingredients of a pizza tier"""
         ingredients = {
             'flour': 500,  # grams
             'water': 300,  # ml
@@ -111,8 +110,8 @@ class OperationCreatePizza(OperationBase):
         
         return ingredients
     
-    def get_toppings_for_tier(self, tier: str) -> list:
-        """Get toppings based on the pizza tier"""
+    def build_toppings_for_tier(self, tier: str) -> list:
+        """Build the toppings of a pizza tier"""
         # Base toppings for all pizzas
         toppings = ['tomato_sauce', 'mozzarella']
         
@@ -142,11 +141,11 @@ class OperationCreatePizza(OperationBase):
         logger.info(f'All tasks completed for pizza operation {operation.uuid}')
         # Send a final notification that the pizza has been delivered
         try:
-            await ws.emit('pizza_update', {
+            await updates.publish('pizza_update', operation.uuid, {
                 'operation_id': operation.uuid, 
                 'status': 'completed',
                 'message': f"Your {operation.parameters.get('name', 'pizza')} pizza has been delivered!"
-            })
+            }, to=self.pizza_rooms(operation))
         except Exception as e:
             logger.error(f"Error sending WebSocket update: {e}")
         return
\ No newline at end of file
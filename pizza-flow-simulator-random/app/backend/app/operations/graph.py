@@ -0,0 +1,55 @@
+''' Dependency graph of the tasks of an operation '''
+from typing import Callable, Iterable, List
+
+class TaskGraph():
+    '''
+    Precompiled DAG of the tasks of an operation.
+    Built once per operation class from all_tasks and dependencies_for
+    '''
+    def __init__(self, tasks: Iterable[str], dependencies_for: Callable[[str], List[str]]):
+        self.tasks = tuple(tasks)
+        self.position = {name: i for i, name in enumerate(self.tasks)}
+        self.handlers = {str(i + 1): name for i, name in enumerate(self.tasks)} # task_id -> task name
+        self.predecessors = {name: tuple(dependencies_for(name)) for name in self.tasks}
+        self.successors = {name: [] for name in self.tasks}
+        for name, dependencies in self.predecessors.items():
+            for dependency in dependencies:
+                if dependency not in self.successors:
+                    raise ValueError(f'Task {name} depends on unknown task {dependency}')
+                self.successors[dependency].append(name)
+        self.successors = {name: tuple(successors) for name, successors in self.successors.items()}
+        self.in_degree = {name: len(dependencies) for name, dependencies in self.predecessors.items()}
+        self.levels = self.compute_levels()
+        self.roots = self.levels[0] if self.levels else ()
+
+    def compute_levels(self) -> List[tuple]:
+        ''' Topological levels, tasks in the same level are independent of each other '''
+        remaining = dict(self.in_degree)
+        level = [name for name in self.tasks if not remaining[name]]
+        levels = []
+        while level:
+            levels.append(tuple(level))
+            next_level = []
+            for name in level:
+                for successor in self.successors[name]:
+                    remaining[successor] -= 1
+                    if not remaining[successor]:
+                        next_level.append(successor)
+            level = next_level
+        if sum(len(x) for x in levels) != len(self.tasks):
+            raise ValueError(f'Circular dependencies between tasks {[x for x, v in remaining.items() if v]}')
+        return levels
+
+    def ready(self, completed: set) -> List[str]:
+        ''' Tasks not completed whose dependencies are all completed '''
+        return [
+            name for name in self.tasks
+            if name not in completed and all(x in completed for x in self.predecessors[name])
+        ]
+
+    def handler_for(self, task_id: str) -> str | None:
+        ''' Name of the task with a task_id, None if the graph does not have it '''
+        return self.handlers.get(str(task_id))
+
+    def __len__(self) -> int:
+        return len(self.tasks)
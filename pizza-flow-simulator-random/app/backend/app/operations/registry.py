@@ -0,0 +1,24 @@
+''' Registry for operations '''
+
+class OperationRegister():
+    ''' A class to register operations, keeping a single controller per operation '''
+    registry = {}
+    controllers = {}
+
+    def register(self):
+        ''' Adds an operation and builds its controller '''
+        def deco(a_class):
+            controller = a_class()
+            controller.precompute()
+            self.registry[a_class.identifier] = a_class
+            self.controllers[a_class.identifier] = controller
+            return a_class
+        return deco
+
+    def get_controller(self, identifier: str):
+        ''' Returns the controller of the operation, None if not registered '''
+        return self.controllers.get(identifier)
+
+    def get_operations(self):
+        ''' Returns all the registered operations '''
+        return list(self.registry.keys())
@@ -0,0 +1,239 @@
+''' Read-through cache of the entities polled by the clients: RFAs, pizzas and operations, and their changes '''
+import os
+import json
+import time
+import asyncio
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Generic, Iterable, Iterator, Tuple, Type, TypeVar
+from sqlmodel import SQLModel
+from .redis import redis_client
+from logs import logger
+
+CACHE_SIZE = int(os.getenv('CACHE_SIZE', '10000'))          # Entities kept in the memory of each replica, per kind
+CACHE_TTL = float(os.getenv('CACHE_TTL', '30'))             # Seconds an entity is kept in memory
+CACHE_REDIS_TTL = int(os.getenv('CACHE_REDIS_TTL', '300'))  # Seconds an entity is kept in redis, 0 disables it
+# Channel where the replicas announce the entities they changed
+INVALIDATIONS_CHANNEL = 'cache.invalidations'
+REPLICA = f'{os.getenv("HOSTNAME", "backend")}.{os.getpid()}'
+
+Model = TypeVar('Model', bound=SQLModel)
+
+class ReadThroughCache(Generic[Model]):
+    '''
+    TTL LRU cache in the memory of the replica over a shared copy in redis, in front of the DB.
+    Entities are kept serialized, so every get returns a new instance the caller can modify.
+    Writes refresh the entity and announce it to the other replicas, which drop their copy
+    '''
+    caches = {} # name -> cache, to apply the invalidations
+
+    def __init__(self, name: str, model: Type[Model], shared: bool = True, size: int = CACHE_SIZE, ttl: float = CACHE_TTL, redis_ttl: int = CACHE_REDIS_TTL):
+        self.name = name
+        self.model = model
+        self.shared = shared and bool(redis_ttl) # False if the entities already live in redis, ie operations
+        self.size = size
+        self.ttl = ttl
+        self.redis_ttl = redis_ttl
+        self.entries = OrderedDict() # id -> (expiration, serialized entity)
+        self.generations = {} # id -> [generation, loads in flight], only for the entities being loaded
+        ReadThroughCache.caches[name] = self
+
+    def key(self, id) -> str:
+        ''' Key of the entity in redis '''
+        return f'cache.{self.name}.{id}'
+
+    async def get(self, id, loader: Callable[[str], Awaitable[Model | None]]) -> Model | None:
+        ''' Entity from memory, redis or the loader, in this order. Missing entities are not cached '''
+        id = str(id)
+        entry = self.entries.get(id)
+        if entry:
+            expiration, data = entry
+            if expiration >= time.monotonic():
+                self.entries.move_to_end(id)
+                return self.model.model_validate(data)
+            del self.entries[id]
+        slot = self.generations.setdefault(id, [0, 0])
+        generation = slot[0]
+        slot[1] += 1
+        try:
+            data = await self.load_shared(id)
+            if data is None:
+                item = await loader(id)
+                if item is None:
+                    return None
+                data = item.model_dump(mode='json')
+                # Never overwrite the copy of a concurrent write, it is newer than what we read
+                if not await self.store_shared(id, data, only_new=True):
+                    data = await self.load_shared(id) or data
+        finally:
+            slot[1] -= 1
+            if not slot[1]:
+                del self.generations[id]
+        # Written, deleted or changed by another replica while loading: what we read may be older
+        if slot[0] == generation:
+            self.remember(id, data)
+        return self.model.model_validate(data)
+
+    async def put(self, id, item: Model) -> None:
+        ''' The entity was written: refresh the cached copies and invalidate the other replicas '''
+        id = str(id)
+        data = item.model_dump(mode='json')
+        self.changed(id)
+        self.remember(id, data)
+        await self.store_shared(id, data)
+        await self.announce(id)
+
+    async def invalidate(self, id) -> None:
+        ''' The entity was deleted '''
+        id = str(id)
+        self.changed(id)
+        self.entries.pop(id, None)
+        if self.shared and redis_client:
+            try:
+                await redis_client.delete(self.key(id))
+            except Exception as e:
+                logger.error(f'Could not delete {self.key(id)} from redis: {e}')
+        await self.announce(id)
+
+    def remember(self, id: str, data: dict) -> None:
+        ''' Keep the serialized entity in memory '''
+        self.entries[id] = (time.monotonic() + self.ttl, data)
+        self.entries.move_to_end(id)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def forget(self, id: str) -> None:
+        ''' Drop the copy in memory, changed by another replica '''
+        self.changed(id)
+        self.entries.pop(id, None)
+
+    def changed(self, id: str) -> None:
+        ''' Bump the generation of an entity being loaded, so the loads in flight do not keep what they read '''
+        slot = self.generations.get(id)
+        if slot:
+            slot[0] += 1
+
+    async def load_shared(self, id: str) -> dict | None:
+        ''' Serialized entity from redis '''
+        if not self.shared or not redis_client:
+            return None
+        try:
+            data = await redis_client.get(self.key(id))
+        except Exception as e:
+            logger.error(f'Could not read {self.key(id)} from redis: {e}')
+            return None
+        return json.loads(data) if data else None
+
+    async def store_shared(self, id: str, data: dict, only_new: bool = False) -> bool:
+        ''' Keep the serialized entity in redis, False if only_new and redis already had it '''
+        if not self.shared or not redis_client:
+            return True
+        try:
+            return bool(await redis_client.set(self.key(id), json.dumps(data), ex=self.redis_ttl, nx=only_new))
+        except Exception as e:
+            logger.error(f'Could not write {self.key(id)} to redis: {e}')
+            return True
+
+    async def announce(self, id: str) -> None:
+        ''' Tell the other replicas to drop their copy '''
+        await announce_changes([(self.name, id)])
+
+async def announce_changes(changes: Iterable[Tuple[str, str]]) -> None:
+    ''' Wake the clients waiting for the changed (kind, id) entities, and tell the other replicas '''
+    changes = [(kind, str(id)) for kind, id in changes]
+    if not changes:
+        return
+    invalidations.wake(changes)
+    if not redis_client:
+        return
+    try:
+        await redis_client.publish(INVALIDATIONS_CHANNEL, json.dumps({'changes': changes, 'replica': REPLICA}))
+    except Exception as e:
+        logger.error(f'Could not announce the change of {changes}: {e}')
+
+class InvalidationsListener():
+    '''
+    Background task applying the changes announced by the other replicas:
+    drops the entities from the memory of this one and wakes the clients waiting for them
+    '''
+
+    def __init__(self):
+        self.runner = None
+        self.waiters = {} # (kind, id) -> events of the waiting clients
+
+    async def start(self) -> None:
+        ''' Subscribe to the invalidations, nothing to do with a single replica without redis '''
+        if not redis_client:
+            return
+        self.pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        await self.pubsub.subscribe(INVALIDATIONS_CHANNEL)
+        self.runner = asyncio.create_task(self.run())
+        logger.info(f'Listening to cache invalidations as {REPLICA}')
+
+    async def stop(self) -> None:
+        ''' Stop listening '''
+        if not self.runner:
+            return
+        self.runner.cancel()
+        try:
+            await self.runner
+        except asyncio.CancelledError:
+            pass
+        self.runner = None
+        await self.pubsub.aclose()
+
+    async def run(self) -> None:
+        ''' Apply the invalidations as they come '''
+        while True:
+            try:
+                async for message in self.pubsub.listen():
+                    self.apply(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Messages lost while reconnecting are covered by the TTL of the entries
+                logger.error(f'Error listening to cache invalidations: {e}')
+                await asyncio.sleep(1)
+
+    def apply(self, message: dict) -> None:
+        ''' Drop the entities of an invalidation sent by another replica '''
+        if message.get('type') != 'message':
+            return
+        invalidation = json.loads(message['data'])
+        if invalidation.get('replica') == REPLICA:
+            return
+        changes = [tuple(x) for x in invalidation.get('changes', [])]
+        for kind, id in changes:
+            cache = ReadThroughCache.caches.get(kind)
+            if cache:
+                cache.forget(id)
+        # After forgetting them, woken clients load the new version
+        self.wake(changes)
+
+    @contextmanager
+    def watch(self, keys: Iterable[Tuple[str, str]]) -> Iterator[asyncio.Event]:
+        '''
+        Event set when any of the (kind, id) entities changes, clear it before reading them again.
+        Watch before reading the entities, so no change is missed in between
+        '''
+        event = asyncio.Event()
+        keys = [(kind, str(id)) for kind, id in keys]
+        for key in keys:
+            self.waiters.setdefault(key, set()).add(event)
+        try:
+            yield event
+        finally:
+            for key in keys:
+                events = self.waiters.get(key)
+                if events is not None:
+                    events.discard(event)
+                    if not events:
+                        del self.waiters[key]
+
+    def wake(self, changes: Iterable[Tuple[str, str]]) -> None:
+        ''' Wake the clients waiting for the changed entities '''
+        for key in changes:
+            for event in self.waiters.get(key, ()):
+                event.set()
+
+invalidations = InvalidationsListener()
@@ -1,13 +1,42 @@
 import os
-from sqlmodel import create_engine
-from sqlmodel.ext.asyncio.session import Session
-from contextlib import contextmanager
+import asyncio
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlmodel.ext.asyncio.session import AsyncSession
+from contextlib import asynccontextmanager
 
 
 db_url = os.getenv("DATABASE_URL") or f'postgresql://{os.getenv("DB_USER")}:{os.getenv("DB_PASSWORD")}@{os.getenv("DB_HOST")}/{os.getenv("DB_NAME")}'
-engine = create_engine(db_url, connect_args={})
+# The application runs on asyncpg, migrations keep using the sync driver with db_url
+async_db_url = db_url.replace('postgresql://', 'postgresql+asyncpg://', 1).replace('postgres://', 'postgresql+asyncpg://', 1)
 
-@contextmanager
-def get_db():
-    with Session(engine) as session:
+engine = create_async_engine(
+    async_db_url,
+    pool_size=int(os.getenv("DB_POOL_SIZE", "20")),
+    max_overflow=int(os.getenv("DB_POOL_MAX_OVERFLOW", "30")),
+    pool_timeout=int(os.getenv("DB_POOL_TIMEOUT", "10")),
+    pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    pool_pre_ping=True,
+)
+async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+@asynccontextmanager
+async def get_db():
+    ''' Async session as a context manager '''
+    async with async_session() as session:
+        yield session
+
+async def get_session():
+    ''' Async session dependency for FastAPI endpoints '''
+    async with async_session() as session:
         yield session
+
+def is_transient(e: Exception) -> bool:
+    ''' Errors reaching the DB, the write is retried until it is available again '''
+    if isinstance(e, (OSError, asyncio.TimeoutError, PoolTimeoutError, InterfaceError, OperationalError)):
+        return True
+    return isinstance(e, DBAPIError) and e.connection_invalidated
+
+async def dispose_engine():
+    ''' Close all the pooled connections '''
+    await engine.dispose()
@@ -1,14 +1,22 @@
 from typing import List
 import datetime
 from sqlmodel import Field, SQLModel, select, Relationship
+from sqlalchemy import Index
+from sqlalchemy.dialects.postgresql import insert
 from models.pizzas import Pizza
 from .database import get_db
+from .pagination import keyset_page
+from .redis import redis_client
+from logs import logger
 from pydantic import field_serializer
 import uuid
 
 class Event(SQLModel, table=True):
     ''' Event model. Represents an event in the application '''
     __tablename__: str = 'events'
+    __table_args__ = (
+        Index('ix_events_time_id', 'time', 'id'),
+    )
     id: uuid.UUID = Field(primary_key=True, default_factory=uuid.uuid4, index=True)
     actor_email: str | None = Field(default=None)
     pizza_id: uuid.UUID | None = Field(default=None, foreign_key="pizzas.id")
@@ -31,20 +39,43 @@ class Event(SQLModel, table=True):
             return None
         return value.isoformat()
 
-def load_persisted_event(id: str) -> Event:
+async def load_persisted_event(id: str) -> Event:
     ''' Load a persisted event '''
-    with get_db() as db:
-        return db.get(Event, id)
+    async with get_db() as db:
+        return await db.get(Event, id)
 
-def persist_event(event: Event) -> Event:
+async def persist_event(event: Event) -> Event:
     ''' Persist a event '''
-    with get_db() as db:
+    async with get_db() as db:
         db.add(event)
-        db.commit()
-        db.refresh(event)
+        await db.commit()
+        await db.refresh(event)
     return event
 
-async def list_persisted_events(limit: int = None, offset: int = 0, status: List[str] = None) -> List[Event]:
-    ''' List persisted pizzas '''
-    with get_db() as db:
-        return db.exec(select(Event).order_by(Event.time.desc()).offset(offset).limit(limit)).all()
+# Stream with the events that could not be inserted
+EVENTS_DEAD_LETTER_STREAM = 'events.dead_letter'
+
+async def persist_events(events: List[Event]) -> None:
+    ''' Persist several events with a single multi-row insert, the ones already inserted are skipped '''
+    if not events:
+        return
+    statement = insert(Event).values([{c.name: getattr(x, c.name) for c in Event.__table__.columns} for x in events])
+    async with get_db() as db:
+        await db.exec(statement.on_conflict_do_nothing(index_elements=['id']))
+        await db.commit()
+
+async def dead_letter_events(events: List[Event], error: str) -> None:
+    ''' Keep the events that can not be inserted in the dead letter stream, or in the logs without redis '''
+    for event in events:
+        if redis_client:
+            await redis_client.xadd(EVENTS_DEAD_LETTER_STREAM, {'event': event.model_dump_json(), 'error': error})
+        else:
+            logger.error(f'Dead letter event: {event.model_dump_json()}')
+
+async def list_persisted_events(limit: int = None, cursor: str = None, event_type: List[str] = None) -> List[Event]:
+    ''' List persisted events, newest first, starting after the cursor '''
+    query = select(Event)
+    if event_type:
+        query = query.where(Event.event_type.in_(event_type))
+    async with get_db() as db:
+        return (await db.exec(keyset_page(query, Event.time, Event.id, limit, cursor))).all()
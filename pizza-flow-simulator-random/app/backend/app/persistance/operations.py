@@ -1,52 +1,105 @@
-from typing import List
-from .redis import OperationPersistorRedis
+import os
+import asyncio
+from contextlib import asynccontextmanager
+from typing import List, Dict, Tuple
+from sqlmodel import select
+from .redis import OperationPersistorRedis, redis_client
 from models.operations import Operation
 from .database import get_db
+from .write_behind import WRITE_BEHIND
+from .cache import ReadThroughCache
+from logs import logger
 
 redis = OperationPersistorRedis()
+# Operations already live in redis, only the memory of the replica is added
+operations_cache = ReadThroughCache('operations', Operation, shared=False)
+OPERATION_LOCK_TIMEOUT = float(os.getenv('OPERATION_LOCK_TIMEOUT', '30')) # Seconds an update can hold the lock of an operation
+OPERATION_LOCK_WAIT = float(os.getenv('OPERATION_LOCK_WAIT', '60'))       # Seconds an update waits for the lock
+local_locks = {} # operation id -> [lock, updates using it], without redis
 
-def load_persisted_operation(operation_id: str) -> Operation:
-    ''' Load a persisted operation '''
-    operation = redis.load(operation_id)
+@asynccontextmanager
+async def operation_lock(operation_id: str):
+    '''
+    Serialises the updates of an operation: load it, modify it and persist it while holding the lock,
+    so concurrent completions of its tasks do not overwrite each other. Shared by the replicas through redis
+    '''
+    if redis_client:
+        async with redis_client.lock(f'operations.{operation_id}.lock', timeout=OPERATION_LOCK_TIMEOUT, blocking_timeout=OPERATION_LOCK_WAIT):
+            yield
+        return
+    entry = local_locks.setdefault(operation_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del local_locks[operation_id]
+
+async def load_persisted_operation(operation_id: str, cached: bool = True) -> Operation:
+    '''
+    Load a persisted operation, through the cache unless cached is False.
+    Operations read to be modified skip the cache, other replicas may have changed them a moment ago
+    '''
+    if cached:
+        return await operations_cache.get(operation_id, lambda id: load_persisted_operation(id, cached=False))
+    operation = await redis.load(operation_id)
     if not operation:
-        with get_db() as db:
-            operation = db.query(Operation).filter(Operation.uuid == operation_id).first()
+        async with get_db() as db:
+            operation = await db.get(Operation, operation_id)
     return operation
 
-def persist_operation(operation: Operation) -> Operation:
+async def persist_operation(operation: Operation) -> Operation:
     ''' Persist an operation '''
-    redis.save(operation)
-    with get_db() as db:
-        existing_operation = db.get(Operation, operation.uuid)
-        if not existing_operation:
-            db.add(operation)
-            db.commit()
-            db.refresh(operation)
-            return operation
-        existing_operation.sqlmodel_update(operation.model_dump())
-        db.add(existing_operation)
-        db.commit()
-        db.refresh(existing_operation)
-    return existing_operation
+    operation.version += 1
+    if WRITE_BEHIND:
+        await redis.save(operation, enqueue=True)
+        await operations_cache.put(operation.uuid, operation)
+        return operation
+    await redis.save(operation)
+    async with get_db() as db:
+        persisted = await db.merge(operation)
+        await db.commit()
+        await db.refresh(persisted)
+    await operations_cache.put(persisted.uuid, persisted)
+    return persisted
 
-def load_persisted_operations_filtering(**params) -> List[Operation]:
-    ''' Load operations with filters '''
-    try:
-        return redis.get(**params)
-    except Exception as e:
-        with get_db() as db:
-            base_query = db.query(Operation)
-            if params.get('status'):
-                base_query = base_query.filter(Operation.status.in_(params.get('status')))
-            if params.get('limit'):
-                base_query = base_query.limit(params.get('limit'))
-            return base_query.all()
+async def init_operation_graph(operation_id: str, in_degree: Dict[str, int]) -> None:
+    ''' Initialize the dependencies counters of an operation '''
+    await redis.init_graph(operation_id, in_degree)
+
+async def complete_operation_task(operation_id: str, task: str, successors: List[str]) -> Tuple[int | None, List[str]] | None:
+    '''
+    Mark a task of the operation completed and release its successors.
+    Returns (completed count, ready tasks), completed count is None if the task was already completed.
+    Returns None if there is no graph state for the operation
+    '''
+    return await redis.complete_task(operation_id, task, successors)
+
+async def load_persisted_operations_filtering(limit: int = 100, status: List[str] = None, operation: List[str] = None, region: List[str] = None) -> List[Operation]:
+    ''' Load the newest operations with filters, from the redis search index or from the DB if it is not available '''
+    if redis_client:
+        try:
+            return await redis.load_filtering(limit, status or [], operation or [], region or [])
+        except Exception as e:
+            logger.error(f'Could not search operations in redis, loading them from the DB: {e}')
+    base_query = select(Operation)
+    if status:
+        base_query = base_query.where(Operation.status.in_(status))
+    if operation:
+        base_query = base_query.where(Operation.operation.in_(operation))
+    if region:
+        base_query = base_query.where(Operation.parameters['region'].astext.in_(region))
+    async with get_db() as db:
+        return (await db.exec(base_query.order_by(Operation.start_date.desc()).limit(limit))).all()
     
-def delete_persisted_operation(operation_id: str):
+async def delete_persisted_operation(operation_id: str):
     ''' Delete a persisted operation '''
-    redis.delete(operation_id)
-    with get_db() as db:
-        operation = db.query(Operation).filter(Operation.uuid == operation_id).first()
+    await redis.delete(operation_id)
+    async with get_db() as db:
+        operation = await db.get(Operation, operation_id)
         if operation:
-            db.delete(operation)
-            db.commit()
+            await db.delete(operation)
+            await db.commit()
+    await operations_cache.invalidate(operation_id)
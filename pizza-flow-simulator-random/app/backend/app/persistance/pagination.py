@@ -0,0 +1,33 @@
+''' Keyset pagination: pages start after the (time, id) of the last item of the previous one '''
+import json
+import uuid
+import base64
+import datetime
+from typing import List
+from sqlalchemy import tuple_
+
+def encode_cursor(sort_value: datetime.datetime, item_id: uuid.UUID) -> str:
+    ''' Opaque cursor pointing after an item '''
+    raw = json.dumps([sort_value.isoformat(), str(item_id)])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> tuple:
+    ''' (sort value, id) of a cursor, raises ValueError if the cursor is not valid '''
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort_value, item_id = json.loads(raw)
+        return datetime.datetime.fromisoformat(sort_value), uuid.UUID(item_id)
+    except Exception as e:
+        raise ValueError(f'Invalid cursor {cursor}') from e
+
+def keyset_page(query, sort_column, id_column, limit: int | None, cursor: str | None = None):
+    ''' Newest first page of a query, starting after the cursor '''
+    if cursor:
+        query = query.where(tuple_(sort_column, id_column) < tuple_(*decode_cursor(cursor)))
+    return query.order_by(sort_column.desc(), id_column.desc()).limit(limit)
+
+def next_cursor(items: List, sort_field: str, limit: int | None) -> str | None:
+    ''' Cursor of the next page, None on the last one '''
+    if not items or not limit or len(items) < limit:
+        return None
+    return encode_cursor(getattr(items[-1], sort_field), items[-1].id)
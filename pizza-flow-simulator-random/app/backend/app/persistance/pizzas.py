@@ -2,21 +2,31 @@ from typing import List
 from sqlmodel import select
 from models.pizzas import Pizza, PizzaStatus
 from .database import get_db
+from .pagination import keyset_page
+from .cache import ReadThroughCache
 
-def load_persisted_pizza(pizza_id: str) -> Pizza:
-    ''' Load a persisted pizza '''
-    with get_db() as db:
-        return db.get(Pizza, pizza_id)
+pizzas_cache = ReadThroughCache('pizzas', Pizza)
 
-def persist_pizza(pizza: Pizza) -> Pizza:
-    ''' Persist a pizza '''
-    with get_db() as db:
-        db.add(pizza)
-        db.commit()
-        db.refresh(pizza)
-    return pizza
+async def load_persisted_pizza(pizza_id: str, cached: bool = True) -> Pizza:
+    ''' Load a persisted pizza, through the cache unless cached is False '''
+    if cached:
+        return await pizzas_cache.get(pizza_id, lambda id: load_persisted_pizza(id, cached=False))
+    async with get_db() as db:
+        return await db.get(Pizza, pizza_id)
 
-async def list_persisted_pizzas(limit: int = None, offset: int = 0, status: List[PizzaStatus] = None) -> List[Pizza]:
-    ''' List persisted pizzas '''
-    with get_db() as db:
-        return db.exec(select(Pizza).offset(offset).limit(limit)).all()
+async def persist_pizza(pizza: Pizza) -> Pizza:
+    ''' Persist a pizza, merged as the cached pizzas are not attached to a session '''
+    async with get_db() as db:
+        persisted = await db.merge(pizza)
+        await db.commit()
+        await db.refresh(persisted)
+    await pizzas_cache.put(persisted.id, persisted)
+    return persisted
+
+async def list_persisted_pizzas(limit: int = None, cursor: str = None, status: List[PizzaStatus] = None) -> List[Pizza]:
+    ''' List persisted pizzas, newest first, starting after the cursor '''
+    query = select(Pizza)
+    if status:
+        query = query.where(Pizza.status.in_(status))
+    async with get_db() as db:
+        return (await db.exec(keyset_page(query, Pizza.creation, Pizza.id, limit, cursor))).all()
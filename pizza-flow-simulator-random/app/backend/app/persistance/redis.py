@@ -1,150 +1,453 @@
-import redis
+import redis.asyncio as redis
 import os
 from models.operations import Operation
-from models.tasks import Task
-from typing import List
+from models.tasks import Task, TaskStatus, PRIORITY_CLASSES, task_priority
+from typing import List, Dict, Tuple
 import json
+import time
+import datetime
 from redis.commands.search.query import Query
+from redis.commands.search.field import TagField, TextField
+from redis.commands.search.indexDefinition import IndexDefinition, IndexType
+from logs import logger
 
 redis_client = None
 if os.getenv('REDIS_HOST'):
     redis_client = redis.Redis(host=os.getenv('REDIS_HOST'), port=6379, db=0)
 
+# Stream with the entities pending to be flushed to the DB in write-behind mode
+WRITE_BEHIND_STREAM = 'persistance.write_behind'
+WRITE_BEHIND_DEAD_LETTER_STREAM = 'persistance.write_behind.dead_letter' # Entries the DB rejected on their own
+# Member of the tasks set of an operation when the set has all of them. A set created again by the saves
+# of single tasks, ie after an eviction, misses it and is completed from the DB
+TASKS_SET_COMPLETE = '__complete__'
+
+# Marks a task of an operation as completed and decrements the pending dependencies of its successors.
+# KEYS: completed set, dependencies hash. ARGV: task, successors...
+# Returns nil without graph state, {-1} if already completed, else {completed count, ready tasks...}
+COMPLETE_TASK_SCRIPT = '''
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    return false
+end
+if redis.call('SADD', KEYS[1], ARGV[1]) == 0 then
+    return {-1}
+end
+local result = {redis.call('SCARD', KEYS[1])}
+for i = 2, #ARGV do
+    if redis.call('HINCRBY', KEYS[2], ARGV[i], -1) == 0 then
+        table.insert(result, ARGV[i])
+    end
+end
+return result
+'''
+complete_task_script = redis_client.register_script(COMPLETE_TASK_SCRIPT) if redis_client else None
+
+# Claims a task for a worker: a pending or pending_wait task, or a running or waiting one whose lease expired, moves to running
+# with a new lease token. Claiming again with the same started_at returns the current lease.
+# The task stays in the pending index, due when the lease expires.
+# KEYS: task document, write-behind stream, pending index. ARGV: now, started_at, lease expiration, enqueue, uuid,
+# pending index score of the lease expiration
+# Returns nil if the task is not in redis, {0} if another worker holds it, else {1, lease token, task document}
+CLAIM_TASK_SCRIPT = '''
+local doc = redis.call('JSON.GET', KEYS[1], '.')
+if not doc then
+    return false
+end
+local task = cjson.decode(doc)
+if task['status'] == 'running' and task['started_at'] == ARGV[2] then
+    return {1, tonumber(task['lease_token']) or 0, doc}
+end
+local expires = task['lease_expires_at']
+local leased = task['status'] == 'running' or task['status'] == 'waiting'
+local expired = leased and type(expires) == 'string' and expires < ARGV[1]
+if task['status'] ~= 'pending' and task['status'] ~= 'pending_wait' and not expired then
+    return {0}
+end
+local token = (tonumber(task['lease_token']) or 0) + 1
+redis.call('JSON.SET', KEYS[1], '$.status', '"running"')
+redis.call('JSON.SET', KEYS[1], '$.started_at', cjson.encode(ARGV[2]))
+redis.call('JSON.SET', KEYS[1], '$.lease_token', token)
+redis.call('JSON.SET', KEYS[1], '$.version', (tonumber(task['version']) or 0) + 1)
+redis.call('JSON.SET', KEYS[1], '$.lease_expires_at', cjson.encode(ARGV[3]))
+redis.call('ZADD', KEYS[3], ARGV[6], ARGV[5])
+if ARGV[4] == '1' then
+    redis.call('XADD', KEYS[2], '*', 'entity', 'task', 'id', ARGV[5])
+end
+return {1, token, redis.call('JSON.GET', KEYS[1], '.')}
+'''
+claim_task_script = redis_client.register_script(CLAIM_TASK_SCRIPT) if redis_client else None
+
+# Scores of the pending index are status class * PRIORITY_CLASS_SPAN + due time, see task_priority.
+# Tasks held by a worker are in it too, due when their lease expires
+PRIORITY_CLASS_SPAN = 10 ** 10 # Above any timestamp in seconds
+PENDING_CLASS_SCORE = PRIORITY_CLASS_SPAN * PRIORITY_CLASSES[TaskStatus.pending]
+
+# Adds a task to the pending index. A task already queued as pending keeps its score, the time it arrived.
+# KEYS: pending index. ARGV: uuid, score, keep the score if at least this one ('' to overwrite)
+INDEX_PENDING_SCRIPT = '''
+if ARGV[3] ~= '' then
+    local current = redis.call('ZSCORE', KEYS[1], ARGV[1])
+    if current and tonumber(current) >= tonumber(ARGV[3]) then
+        return 0
+    end
+end
+return redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+'''
+index_pending_script = redis_client.register_script(INDEX_PENDING_SCRIPT) if redis_client else None
+
+# Pops the top priority tasks of a region: the due ones, then the pending ones by arrival.
+# Popped tasks are hidden until ARGV[3], so concurrent pulls get different tasks. A task claimed or updated
+# meanwhile gets its own score, a task refused by the worker comes back when it is visible again.
+# KEYS: pending index. ARGV: now, limit, visible again at, pending class score
+# Returns {uuid, score before the pop, ...}
+POP_PENDING_SCRIPT = '''
+local limit = tonumber(ARGV[2])
+local popped = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'WITHSCORES', 'LIMIT', 0, limit)
+if #popped < limit * 2 then
+    local more = redis.call('ZRANGEBYSCORE', KEYS[1], ARGV[4], '+inf', 'WITHSCORES', 'LIMIT', 0, limit - math.floor(#popped / 2))
+    for _, x in ipairs(more) do
+        table.insert(popped, x)
+    end
+end
+for i = 1, #popped, 2 do
+    redis.call('ZADD', KEYS[1], ARGV[3], popped[i])
+end
+return popped
+'''
+pop_pending_script = redis_client.register_script(POP_PENDING_SCRIPT) if redis_client else None
+
+# Gives back popped tasks with their score before the pop, unless they changed meanwhile.
+# KEYS: pending index. ARGV: hidden score, uuid, score, uuid, score...
+RETURN_PENDING_SCRIPT = '''
+for i = 2, #ARGV, 2 do
+    if tonumber(redis.call('ZSCORE', KEYS[1], ARGV[i])) == tonumber(ARGV[1]) then
+        redis.call('ZADD', KEYS[1], ARGV[i + 1], ARGV[i])
+    end
+end
+return 0
+'''
+return_pending_script = redis_client.register_script(RETURN_PENDING_SCRIPT) if redis_client else None
+
 class OAuthPersistorRedis():
     ''' Redis DB to persist OAuth '''
     
-    def persist_oauth_start(self, key: str, value: str, ttl: int) -> bool:
+    async def persist_oauth_start(self, key: str, value: str, ttl: int) -> bool:
         ''' Save OAuth to redis '''
-        redis_client.setex(f'oauth.{key}', ttl, value)
+        await redis_client.setex(f'oauth.{key}', ttl, value)
         return True
     
-    def get_oauth_start(self, key: str) -> str:
+    async def get_oauth_start(self, key: str) -> str:
         ''' Load RFA from redis '''
-        return redis_client.get(f'oauth.{key}')
+        return await redis_client.get(f'oauth.{key}')
     
-    def delete_oauth_start(self, uuid: str) -> None:
+    async def delete_oauth_start(self, uuid: str) -> None:
         ''' Delete RFA from dynamodb '''
-        redis_client.delete(f'oauth.{uuid}')
+        await redis_client.delete(f'oauth.{uuid}')
+# RediSearch indexes over the JSON documents: name -> (version, key prefix, fields).
+# Bump the version when the fields change, the index is created again at startup
+SEARCH_INDEXES = {
+    'ops_status': (1, 'operations.', [
+        TagField('$.status', as_name='status'),
+        TagField('$.operation', as_name='operation'),
+        TagField('$.parameters.region', as_name='region'),
+        TextField('$.start_date', as_name='start_date', sortable=True, no_index=True), # ISO dates sort as strings
+    ]),
+    'task_status': (1, 'tasks.', [
+        TagField('$.status', as_name='status'),
+        TagField('$.region', as_name='region'),
+        TagField('$.task', as_name='task'),
+        TagField('$.operation_id', as_name='operation_id'),
+        TextField('$.started_at', as_name='start_date', sortable=True, no_index=True),
+    ]),
+}
+SEARCH_INDEXES_VERSIONS = 'search_indexes.versions'
+
+async def create_search_indexes() -> None:
+    ''' Create the search indexes missing or with an older version, the documents are indexed again by redis '''
+    if not redis_client:
+        return
+    versions = await redis_client.hgetall(SEARCH_INDEXES_VERSIONS)
+    for name, (version, prefix, fields) in SEARCH_INDEXES.items():
+        current = versions.get(name.encode())
+        if current is not None and int(current) == version:
+            continue
+        if current is not None:
+            try:
+                await redis_client.ft(name).dropindex(delete_documents=False)
+            except Exception as e:
+                logger.debug(f'Search index {name} not dropped: {e}')
+        try:
+            await redis_client.ft(name).create_index(fields, definition=IndexDefinition(prefix=[prefix], index_type=IndexType.JSON))
+        except Exception as e:
+            if 'already exists' not in str(e):
+                raise
+        await redis_client.hset(SEARCH_INDEXES_VERSIONS, name, version)
+        logger.info(f'Search index {name} created with version {version}')
+
+def tag_query(**filters: List[str] | None) -> str:
+    ''' Query matching any of the values of every tag filter, values are escaped '''
+    clauses = []
+    for tag, values in filters.items():
+        if values:
+            escaped = '|'.join(''.join(c if c.isalnum() or c == '_' else f'\\{c}' for c in str(x)) for x in values)
+            clauses.append(f'@{tag}:{{{escaped}}}')
+    return ' '.join(clauses) or '*'
 
 class OperationPersistorRedis():
     ''' Redis to persist operations '''
-    def save(self, operation: Operation) -> None:
-        ''' Save operation to redis '''
+    async def save(self, operation: Operation, enqueue: bool = False) -> None:
+        ''' Save operation to redis, optionally queueing it to be flushed to the DB '''
         if not redis_client:
             return
-        redis_client.json().set(f'operations.{str(operation.uuid)}', '.', operation.model_dump())
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.json().set(f'operations.{str(operation.uuid)}', '.', operation.model_dump())
+        if enqueue:
+            pipe.xadd(WRITE_BEHIND_STREAM, {'entity': 'operation', 'id': str(operation.uuid)})
+        await pipe.execute()
     
-    def load(self, uuid: str) -> Operation:
+    async def load(self, uuid: str) -> Operation:
         ''' Load operation from redis '''
         if not redis_client:
             return None
         #operation = redis_client.get(f'operations.{uuid}')
-        operation = redis_client.json().get(f'operations.{uuid}')
+        operation = await redis_client.json().get(f'operations.{uuid}')
         if not operation:
             return None
-        return Operation(**operation)
+        return Operation.model_validate(operation)
+
+    async def load_many(self, uuids: List[str]) -> List[Operation | None]:
+        ''' Load several operations from redis in a single round trip '''
+        if not redis_client or not uuids:
+            return []
+        docs = await redis_client.json().mget([f'operations.{uuid}' for uuid in uuids], '.')
+        return [Operation.model_validate(doc) if doc else None for doc in docs]
     
-    def load_filtering(self, limit: int = 10, status: List[str] = []) -> List[Operation]:
-        ''' Load operations with filters '''
+    async def load_filtering(self, limit: int = 10, status: List[str] = [], operation: List[str] = [], region: List[str] = []) -> List[Operation]:
+        ''' Load the newest operations with filters '''
         if not redis_client:
             return []
-        qs = ''
-        if status:
-            status_vals = '|'.join(status)
-            qs += f'@status:{{{status_vals}}} '
-        if not qs:
-            qs = '*'
-        query = Query(qs).paging(0, limit).sort_by('start_date', asc=False)
-        result = redis_client.ft('ops_status').search(query)
-        return [Operation(**json.loads(doc.json)) for doc in result.docs]
+        query = Query(tag_query(status=status, operation=operation, region=region)).paging(0, limit).sort_by('start_date', asc=False)
+        result = await redis_client.ft('ops_status').search(query)
+        return [Operation.model_validate(json.loads(doc.json)) for doc in result.docs]
     
-    def delete(self, uuid: str) -> None:
+    async def init_graph(self, uuid: str, in_degree: Dict[str, int]) -> None:
+        ''' Store the pending dependencies of every task of the operation '''
+        if not redis_client:
+            return
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.delete(f'operations.{uuid}.completed')
+        pipe.sadd(f'operations.{uuid}.tasks', TASKS_SET_COMPLETE) # No tasks yet
+        # The sentinel keeps the hash alive for graphs without dependencies
+        pipe.hset(f'operations.{uuid}.dependencies', mapping={'__tasks__': len(in_degree), **in_degree})
+        await pipe.execute()
+
+    async def complete_task(self, uuid: str, task: str, successors: List[str]) -> Tuple[int | None, List[str]] | None:
+        ''' Mark a task completed, returns the completed count and the successors ready to run '''
+        if not redis_client:
+            return None
+        result = await complete_task_script(
+            keys=[f'operations.{uuid}.completed', f'operations.{uuid}.dependencies'],
+            args=[task, *successors])
+        if result is None:
+            return None
+        if result[0] == -1:
+            return (None, [])
+        return (int(result[0]), [x.decode() for x in result[1:]])
+
+    async def delete(self, uuid: str) -> None:
         ''' Delete operation from redis '''
         if not redis_client:
             return
-        redis_client.delete(f'operations.{uuid}')
-        redis_client.delete(f'operations.{uuid}.tasks')
+        await redis_client.delete(
+            f'operations.{uuid}', f'operations.{uuid}.tasks',
+            f'operations.{uuid}.completed', f'operations.{uuid}.dependencies')
+
+def pending_index_key(region: str) -> str:
+    ''' Sorted set with the tasks of a region a worker can pull, scored by priority '''
+    return f'tasks_pending.{region}'
+
+def pending_score(task: Task) -> float | None:
+    ''' Score of a task in the pending index, pending tasks are ordered by arrival. None if it can not be pulled '''
+    priority = task_priority(task)
+    if priority is None:
+        return None
+    status_class, due, _ = priority
+    if task.status is TaskStatus.pending:
+        due = time.time()
+    return status_class * PRIORITY_CLASS_SPAN + due
 
 class TaskPersistorRedis():
     ''' Redis to persist tasks '''
-    def save(self, task: Task) -> None:
-        ''' Save task to redis '''
+    def index_pending(self, pipe, task: Task) -> None:
+        ''' Add the task to the pending index with its current priority, or remove it '''
+        key = pending_index_key(task.region)
+        score = pending_score(task)
+        if score is not None:
+            keep_from = PENDING_CLASS_SCORE if task.status is TaskStatus.pending else ''
+            pipe.scripts.add(index_pending_script) # Loaded by the pipeline if redis does not have it
+            pipe.evalsha(index_pending_script.sha, 1, key, task.uuid, score, keep_from)
+        else:
+            pipe.zrem(key, task.uuid)
+
+    async def save(self, task: Task, enqueue: bool = False) -> None:
+        ''' Save task to redis, optionally queueing it to be flushed to the DB '''
         if not redis_client:
             return
-        redis_client.json().set(f'tasks.{task.uuid}', '.', task.model_dump())
-        redis_client.sadd(f'operations.{task.operation_id}.tasks', task.uuid)
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.json().set(f'tasks.{task.uuid}', '.', task.model_dump())
+        pipe.sadd(f'operations.{task.operation_id}.tasks', task.uuid)
+        self.index_pending(pipe, task)
+        if enqueue:
+            pipe.xadd(WRITE_BEHIND_STREAM, {'entity': 'task', 'id': task.uuid})
+        await pipe.execute()
 
-    def load(self, uuid: str) -> Task:
+    async def load(self, uuid: str) -> Task:
         ''' Load task from redis '''
         if not redis_client:
             return None
-        task = redis_client.json().get(f'tasks.{uuid}')
+        task = await redis_client.json().get(f'tasks.{uuid}')
         if not task:
             return None
-        return Task(**task)
+        return Task.model_validate(task)
+
+    async def load_many(self, uuids: List[str]) -> List[Task | None]:
+        ''' Load several tasks from redis in a single round trip '''
+        if not redis_client or not uuids:
+            return []
+        docs = await redis_client.json().mget([f'tasks.{uuid}' for uuid in uuids], '.')
+        return [Task.model_validate(doc) if doc else None for doc in docs]
     
-    def load_by_operation(self, operation_id: str) -> List[Task]:
-        ''' Load tasks by operation from redis '''
+    async def save_many(self, tasks: List[Task], enqueue: bool = False) -> None:
+        ''' Save several tasks to redis in a single round trip, optionally queueing them to be flushed to the DB '''
+        if not redis_client or not tasks:
+            return
+        pipe = redis_client.pipeline(transaction=False)
+        for task in tasks:
+            pipe.json().set(f'tasks.{task.uuid}', '.', task.model_dump())
+            pipe.sadd(f'operations.{task.operation_id}.tasks', task.uuid)
+            self.index_pending(pipe, task)
+            if enqueue:
+                pipe.xadd(WRITE_BEHIND_STREAM, {'entity': 'task', 'id': task.uuid})
+        await pipe.execute()
+
+    async def load_by_operation(self, operation_id: str) -> Tuple[List[Task | None], bool]:
+        '''
+        Load tasks by operation from redis, None for the ids without document.
+        Returns the tasks and whether redis has all of them, see TASKS_SET_COMPLETE
+        '''
         if not redis_client:
-            return []
-        task_ids = redis_client.smembers(f'operations.{operation_id}.tasks')
-        tasks = [self.load(task_id.decode()) for task_id in task_ids]
-        return tasks
+            return [], False
+        task_ids = {task_id.decode() for task_id in await redis_client.smembers(f'operations.{operation_id}.tasks')}
+        complete = TASKS_SET_COMPLETE in task_ids
+        task_ids.discard(TASKS_SET_COMPLETE)
+        return await self.load_many(list(task_ids)), complete
+
+    async def complete_operation_tasks(self, operation_id: str, tasks: List[Task]) -> None:
+        ''' Store the tasks of an operation loaded from the DB, keeping the documents redis already has '''
+        if not redis_client:
+            return
+        pipe = redis_client.pipeline(transaction=True)
+        for task in tasks:
+            pipe.json().set(f'tasks.{task.uuid}', '.', task.model_dump(), nx=True)
+            pipe.sadd(f'operations.{operation_id}.tasks', task.uuid)
+        pipe.sadd(f'operations.{operation_id}.tasks', TASKS_SET_COMPLETE)
+        await pipe.execute()
     
-    def delete(self, uuid: str) -> None:
-        ''' Delete task from redis '''
+    async def load_pending_for_region(self, region: str, limit: int = 100, hide_for: float = 10) -> Tuple[List[Task], dict]:
+        '''
+        Pop the top priority tasks of a region from the pending index, skipping the ones not due yet.
+        They are hidden from other pulls for hide_for seconds, see POP_PENDING_SCRIPT.
+        Returns the tasks and the handout to give back the ones not sent with return_pending
+        '''
         if not redis_client:
+            raise Exception('Redis not configured')
+        key = pending_index_key(region)
+        now = time.time()
+        hidden = repr(now + hide_for)
+        popped = await pop_pending_script(keys=[key], args=[now, limit, hidden, PENDING_CLASS_SCORE])
+        scores = {popped[i].decode(): popped[i + 1].decode() for i in range(0, len(popped), 2)}
+        task_ids = list(scores)
+        tasks = await self.load_many(task_ids)
+        stale = [task_id for task_id, task in zip(task_ids, tasks) if not task]
+        if stale:
+            # Documents removed without going through delete
+            await redis_client.zrem(key, *stale)
+        return [task for task in tasks if task], {'region': region, 'hidden': hidden, 'scores': scores}
+
+    async def return_pending(self, tasks: List[Task], handout: dict) -> None:
+        ''' Make visible again tasks popped by load_pending_for_region and not sent to the worker '''
+        scores = handout.get('scores', {})
+        args = [x for task in tasks if task.uuid in scores for x in (task.uuid, scores[task.uuid])]
+        if not redis_client or not args:
             return
-        task = self.load(uuid)
-        redis_client.srem(f'operations.{task.operation_uuid}.tasks', uuid)
-        redis_client.delete(f'tasks.{uuid}')
+        await return_pending_script(keys=[pending_index_key(handout['region'])], args=[handout['hidden'], *args])
 
-    def load_pending_for_worker(self, region: str) -> list:
-        ''' Load tasks for a worker '''
+    async def index_pending_tasks(self, tasks: List[Task]) -> None:
+        ''' Add tasks to the pending index, storing the document if missing '''
+        if not redis_client or not tasks:
+            return
+        cached = await self.load_many([task.uuid for task in tasks])
+        pipe = redis_client.pipeline(transaction=False)
+        for task, cached_task in zip(tasks, cached):
+            if not cached_task:
+                pipe.json().set(f'tasks.{task.uuid}', '.', task.model_dump())
+                pipe.sadd(f'operations.{task.operation_id}.tasks', task.uuid)
+            self.index_pending(pipe, cached_task or task)
+        await pipe.execute()
+
+    async def claim(self, uuid: str, region: str, started_at: str, expires_at: datetime.datetime, now: str, enqueue: bool = False) -> Tuple[int, Task | None] | None:
+        '''
+        Atomically claim a task, see CLAIM_TASK_SCRIPT.
+        Returns None if the task is not in redis, (0, None) if another worker holds it, else (lease token, task)
+        '''
         if not redis_client:
-            raise Exception('Redis not configured')
-        region_sanitized = region.replace('-', '\\-')
-        pending = redis_client.ft('task_status').search(f'@region:{{{region_sanitized}}} @status:{{pending|waiting}}')
-        return [Task(**json.loads(doc.json)) for doc in pending.docs]
+            return None
+        keys = [f'tasks.{uuid}', WRITE_BEHIND_STREAM, pending_index_key(region)]
+        args = [now, started_at, expires_at.isoformat(), '1' if enqueue else '0', uuid, expires_at.timestamp()]
+        result = await claim_task_script(keys=keys, args=args)
+        if not result:
+            return None
+        if not result[0]:
+            return 0, None
+        return int(result[1]), Task.model_validate(json.loads(result[2]))
 
-    def load_filtering(self, status: List[str] = [], limit: int = 10) -> List[Task]:
-        ''' Load Tasks with filters '''
+    async def load_filtering(self, status: List[str] = [], limit: int = 10, region: List[str] = [], task: List[str] = []) -> List[Task]:
+        ''' Load the last started tasks with filters '''
         if not redis_client:
             return []
-        qs = ''
-        if status:
-            status_vals = '|'.join(status)
-            qs += f'@status:{{{status_vals}}} '
-        if not qs:
-            qs = '*'
-        query = Query(qs).paging(0, limit).sort_by('start_date', asc=False)
-        result = redis_client.ft('task_status').search(query)
-        return [Task(**json.loads(doc.json)) for doc in result.docs]
+        query = Query(tag_query(status=status, region=region, task=task)).paging(0, limit).sort_by('start_date', asc=False)
+        result = await redis_client.ft('task_status').search(query)
+        return [Task.model_validate(json.loads(doc.json)) for doc in result.docs]
     
-    def delete(self, uuid: str) -> None:
+    async def delete(self, uuid: str) -> None:
         ''' Delete task from redis '''
         if not redis_client:
             return
         try:
-            task = self.load(uuid)
+            task = await self.load(uuid)
+            if not task:
+                return
+            pipe = redis_client.pipeline(transaction=True)
             if task.operation_id:
-                redis_client.srem(f'operations.{task.operation_id}.tasks', uuid)
-            redis_client.delete(f'tasks.{uuid}')
+                pipe.srem(f'operations.{task.operation_id}.tasks', uuid)
+            pipe.zrem(pending_index_key(task.region), uuid)
+            pipe.delete(f'tasks.{uuid}')
+            await pipe.execute()
         except Exception as e:
-            pass
+            logger.error(f'Could not delete task {uuid} from redis: {e}')
 
 class WSAuthPersistorRedis():
     ''' Redis DB to persist OAuth '''
     
-    def persist(self, sid: str, user_id: str) -> bool:
+    async def persist(self, sid: str, user_id: str) -> bool:
         ''' Save OAuth to redis '''
-        redis_client.set(f'ws_user.{sid}', user_id)
+        await redis_client.set(f'ws_user.{sid}', user_id)
         return True
     
-    def get(self, key: str) -> str:
+    async def get(self, key: str) -> str:
         ''' Load RFA from redis '''
-        return redis_client.get(f'ws_user.{key}').decode()
+        return (await redis_client.get(f'ws_user.{key}')).decode()
     
-    def delete(self, uuid: str) -> None:
+    async def delete(self, uuid: str) -> None:
         ''' Delete RFA from dynamodb '''
-        redis_client.delete(f'ws_user.{uuid}')
+        await redis_client.delete(f'ws_user.{uuid}')
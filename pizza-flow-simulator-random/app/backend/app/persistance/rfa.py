@@ -1,14 +1,21 @@
 from typing import List
 import datetime
-from sqlmodel import Field, SQLModel, select
+from sqlmodel import Field, SQLModel, select, update
 from models.rfa import RFAStatus
 from .database import get_db
 from logs import logger
 from pydantic import field_serializer
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import JSONB, insert
+from sqlalchemy import Index
+from .pagination import keyset_page
+from .cache import ReadThroughCache
 import uuid
 
 class RFA(SQLModel, table=True):
+    __table_args__ = (
+        Index('ix_rfa_creation_id', 'creation', 'id'),
+        Index('ix_rfa_status_creation_id', 'status', 'creation', 'id'),
+    )
     id: uuid.UUID = Field(primary_key=True, default_factory=uuid.uuid4, index=True)
     requester: str
     operation: str
@@ -19,8 +26,9 @@ class RFA(SQLModel, table=True):
     approval_channel: str | None = None
     request_channel: str | None = None
     expiration: datetime.datetime | None = None
-    creation: datetime.datetime | None = Field(default_factory=datetime.datetime.now)
+    creation: datetime.datetime = Field(default_factory=datetime.datetime.now) # NOT NULL, the pages are sorted by it
     approval_time: datetime.datetime | None = None
+    version: int = 0 # Incremented on every change, sent as the ETag
 
     @field_serializer("id")
     def serialize_uuid(self, value):
@@ -36,25 +44,50 @@ class RFA(SQLModel, table=True):
             return None
         return value.isoformat()
 
-def load_persisted_rfa(id: str) -> RFA:
-    ''' Load a persisted RFA '''
-    with get_db() as db:
-        return db.get(RFA, id)
+rfa_cache = ReadThroughCache('rfa', RFA)
 
-def persist_rfa(item: RFA) -> RFA:
-    ''' Persist a item '''
-    with get_db() as db:
-        db.add(item)
-        db.commit()
-        db.refresh(item)
-    return item
+class StaleRFAException(Exception):
+    ''' The RFA changed since it was loaded '''
+
+async def load_persisted_rfa(id: str, cached: bool = True) -> RFA:
+    ''' Load a persisted RFA, through the cache unless cached is False '''
+    if cached:
+        return await rfa_cache.get(id, lambda id: load_persisted_rfa(id, cached=False))
+    async with get_db() as db:
+        return await db.get(RFA, id)
+
+async def persist_rfa(item: RFA) -> RFA:
+    '''
+    Persist an RFA, returns the persisted copy with its new version. The update only applies to the version
+    that was loaded and the version is bumped by the DB, raises StaleRFAException if another writer changed it
+    '''
+    values = {c.name: getattr(item, c.name) for c in RFA.__table__.columns if c.name not in ('id', 'version')}
+    updated = update(RFA).where(RFA.id == item.id, RFA.version == item.version).values(**values, version=RFA.version + 1).returning(RFA)
+    inserted = insert(RFA).values(id=item.id, version=item.version + 1, **values).on_conflict_do_nothing(index_elements=['id']).returning(RFA)
+    async with get_db() as db:
+        persisted = (await db.exec(updated)).scalars().first()
+        if not persisted:
+            # A new RFA, or one changed since it was loaded
+            persisted = (await db.exec(inserted)).scalars().first()
+        if not persisted:
+            raise StaleRFAException(f'RFA {item.id} changed since it was loaded')
+        await db.commit()
+    await rfa_cache.put(persisted.id, persisted)
+    return persisted
 
 async def delete_persisted_rfa(id: str) -> None:
     ''' Delete a persisted RFA '''
-    with get_db() as db:
-        db.delete(RFA, id)
+    async with get_db() as db:
+        item = await db.get(RFA, id)
+        if item:
+            await db.delete(item)
+            await db.commit()
+    await rfa_cache.invalidate(id)
 
-async def list_persisted_rfas(limit: int = None, offset: int = 0, status: List[str] = None) -> List[RFA]:
-    ''' List persisted rfas '''
-    with get_db() as db:
-        return db.exec(select(RFA).offset(offset).limit(limit)).all()
+async def list_persisted_rfas(limit: int = None, cursor: str = None, status: List[str] = None) -> List[RFA]:
+    ''' List persisted rfas, newest first, starting after the cursor '''
+    query = select(RFA)
+    if status:
+        query = query.where(RFA.status.in_(status))
+    async with get_db() as db:
+        return (await db.exec(keyset_page(query, RFA.creation, RFA.id, limit, cursor))).all()
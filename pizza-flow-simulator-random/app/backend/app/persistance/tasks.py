@@ -1,56 +1,201 @@
-from typing import List
-from .redis import TaskPersistorRedis
-from models.tasks import Task, TaskStatus
+import os
+import heapq
+import datetime
+from typing import List, Tuple
+from sqlmodel import select, update, or_, and_, case
+from .redis import TaskPersistorRedis, redis_client
+from models.tasks import Task, TaskStatus, PENDING_TASK_STATUSES, LEASED_TASK_STATUSES, task_priority
 from .database import get_db
+from .write_behind import WRITE_BEHIND, upsert_statement, as_row
+from .cache import announce_changes
 from logs import logger
 
 cache = TaskPersistorRedis()
+LEASE_SECONDS = int(os.getenv('TASK_LEASE_SECONDS', '300')) # Running tasks not updated for longer can be claimed again
+HANDOUT_SECONDS = int(os.getenv('TASK_HANDOUT_SECONDS', '10')) # Tasks sent to a worker are not sent to others meanwhile
 
-def load_persisted_task(uuid: str) -> Task:
+def lease_expiration() -> datetime.datetime:
+    ''' Expiration of a lease taken or renewed now '''
+    return datetime.datetime.now() + datetime.timedelta(seconds=LEASE_SECONDS)
+
+async def announce_tasks(tasks: List[Task]) -> None:
+    ''' Wake the clients waiting for the tasks, or for the tasks of their operation '''
+    await announce_changes(
+        [('tasks', task.uuid) for task in tasks] +
+        [('operation_tasks', x) for x in {task.operation_id for task in tasks if task.operation_id}]
+    )
+
+async def load_persisted_task(uuid: str) -> Task:
     ''' Load a persisted task '''
-    task = cache.load(uuid)
+    task = await cache.load(uuid)
     if not task:
-        with get_db() as db:
-            task = db.query(Task).filter(Task.uuid == uuid).first()
+        async with get_db() as db:
+            task = await db.get(Task, uuid)
     return task
 
-def persist_task(task: Task):
+async def persist_task(task: Task):
     ''' Persist a task '''
-    cache.save(task)
-    with get_db() as db:
-        existing_task = db.get(Task, task.uuid)
-        if not existing_task:
-            db.add(task)
-            db.commit()
-            db.refresh(task)
-            return task
-        existing_task.sqlmodel_update(task.model_dump())
-        db.add(existing_task)
-        db.commit()
-        db.refresh(existing_task)
-        return existing_task
-
-def load_tasks_for_operation(operation_id: str) -> List[Task]:
+    task.version += 1
+    if WRITE_BEHIND:
+        await cache.save(task, enqueue=True)
+        await announce_tasks([task])
+        return task
+    await cache.save(task)
+    async with get_db() as db:
+        persisted = await db.merge(task)
+        await db.commit()
+        await db.refresh(persisted)
+    await announce_tasks([persisted])
+    return persisted
+
+async def load_persisted_tasks(uuids: List[str]) -> List[Task | None]:
+    ''' Load several persisted tasks, the ones missing in redis from the DB '''
+    tasks = await cache.load_many(uuids) or [None] * len(uuids)
+    missing = [uuid for uuid, task in zip(uuids, tasks) if not task]
+    if missing:
+        async with get_db() as db:
+            found = {x.uuid: x for x in (await db.exec(select(Task).where(Task.uuid.in_(missing)))).all()}
+        tasks = [task or found.get(uuid) for uuid, task in zip(uuids, tasks)]
+    return tasks
+
+async def persist_tasks(tasks: List[Task]) -> None:
+    ''' Persist several tasks with a single redis pipeline and a single DB statement '''
+    if not tasks:
+        return
+    for task in tasks:
+        task.version += 1
+    await cache.save_many(tasks, enqueue=WRITE_BEHIND)
+    if not WRITE_BEHIND:
+        async with get_db() as db:
+            await db.exec(upsert_statement(Task, [as_row(x) for x in tasks]))
+            await db.commit()
+    await announce_tasks(tasks)
+
+async def claim_persisted_task(uuid: str, region: str, started_at: datetime.datetime | None) -> Task | None:
+    '''
+    Claim a task for a worker in a single atomic step: a pending or pending_wait task, or a running or waiting one
+    whose lease expired, moves to running with a new lease token. Returns None if the task is held by another worker or does not exist
+    '''
+    now = datetime.datetime.now()
+    started_at = started_at or now
+    expires_at = lease_expiration()
+    claimed = await cache.claim(uuid, region, started_at.isoformat(), expires_at, now.isoformat(), enqueue=WRITE_BEHIND)
+    if claimed is not None:
+        _, task = claimed
+        if task and not WRITE_BEHIND:
+            async with get_db() as db:
+                await db.merge(task)
+                await db.commit()
+        if task:
+            await announce_tasks([task])
+        return task
+    # Not in redis, the row is claimed with a conditional update
+    is_claimed = and_(Task.status == TaskStatus.running, Task.started_at == started_at)
+    statement = update(Task).where(
+        Task.uuid == uuid,
+        or_(
+            Task.status.in_(PENDING_TASK_STATUSES),
+            is_claimed,
+            and_(Task.status.in_(LEASED_TASK_STATUSES), Task.lease_expires_at < now),
+        )
+    ).values(
+        status=TaskStatus.running,
+        started_at=started_at,
+        lease_token=case((is_claimed, Task.lease_token), else_=Task.lease_token + 1),
+        version=case((is_claimed, Task.version), else_=Task.version + 1),
+        lease_expires_at=expires_at,
+    ).returning(Task)
+    async with get_db() as db:
+        task = (await db.exec(statement)).scalars().first()
+        await db.commit()
+    if task:
+        await cache.save(task)
+        await announce_tasks([task])
+    return task
+
+async def load_tasks_for_operation(operation_id: str) -> List[Task]:
     ''' Load tasks for an operation '''
-    #try:
-    #    return cache.load_by_operation(operation_id)
-    #except Exception as e:
-    with get_db() as db:
-        return db.query(Task).filter(Task.operation_id == operation_id).all()
-
-def load_pending_tasks_for_region(region_id: str) -> List[Task]:
-    ''' Load pending tasks for a region '''
-    try:
-        return cache.load_pending_for_region(region_id)
-    except Exception as e:
-        with get_db() as db:
-            return db.query(Task).filter(Task.region == region_id, Task.status.in_([TaskStatus.pending, TaskStatus.waiting])).all()
-
-def delete_persisted_task(task_id: str):
+    cached, complete = await cache.load_by_operation(operation_id)
+    if complete and all(cached):
+        return cached
+    # Tasks or documents missing in redis, ie evicted, the DB has all the tasks
+    async with get_db() as db:
+        tasks = {x.uuid: x for x in (await db.exec(select(Task).where(Task.operation_id == operation_id))).all()}
+    in_redis = {t.uuid: t for t in cached if t}
+    missing = [x for uuid, x in tasks.items() if uuid not in in_redis]
+    # In write-behind mode the DB lags behind redis until the next flush, the documents in redis are newer
+    tasks.update(in_redis)
+    await cache.complete_operation_tasks(operation_id, missing)
+    await cache.index_pending_tasks(missing)
+    return list(tasks.values())
+
+async def load_persisted_tasks_filtering(limit: int = 100, status: List[str] = None, region: List[str] = None, task: List[str] = None) -> List[Task]:
+    ''' Load the last started tasks with filters, from the redis search index or from the DB if it is not available '''
+    if redis_client:
+        try:
+            return await cache.load_filtering(status or [], limit, region or [], task or [])
+        except Exception as e:
+            logger.error(f'Could not search tasks in redis, loading them from the DB: {e}')
+    query = select(Task)
+    if status:
+        query = query.where(Task.status.in_(status))
+    if region:
+        query = query.where(Task.region.in_(region))
+    if task:
+        query = query.where(Task.task.in_(task))
+    async with get_db() as db:
+        return (await db.exec(query.order_by(Task.started_at.desc().nulls_last()).limit(limit))).all()
+
+async def load_pending_tasks_for_region(region_id: str, limit: int = 100) -> Tuple[List[Task], dict]:
+    '''
+    Load the top priority tasks a worker of a region can pull, see task_priority.
+    Running and waiting tasks are only pulled when the lease of their worker expired.
+    Returns the tasks and the handout to give back with return_pending_tasks the ones not sent to the worker
+    '''
+    if redis_client:
+        try:
+            return await cache.load_pending_for_region(region_id, limit, HANDOUT_SECONDS)
+        except Exception as e:
+            # Never fall back to the tasks table on the pull path, the worker pulls again later
+            logger.error(f'Could not pull the pending tasks of region {region_id}: {e}')
+            return [], {}
+    # Without redis the pulls are served by the region and status index of the tasks table
+    now = datetime.datetime.now()
+    async with get_db() as db:
+        query = select(Task).where(Task.region == region_id, or_(
+            Task.status.in_(PENDING_TASK_STATUSES),
+            and_(Task.status.in_(LEASED_TASK_STATUSES), Task.lease_expires_at < now),
+        ))
+        tasks = (await db.exec(query)).all()
+    ready = (
+        (task_priority(task), task) for task in tasks
+        if task.status is TaskStatus.pending or task_priority(task)[1] <= now.timestamp()
+    )
+    return [task for _, task in heapq.nsmallest(limit, ready, key=lambda x: x[0])], {}
+
+async def return_pending_tasks(tasks: List[Task], handout: dict) -> None:
+    ''' Tasks pulled but not sent to the worker, visible again for the next pulls '''
+    await cache.return_pending(tasks, handout)
+
+async def rebuild_pending_index() -> None:
+    ''' Index the pending tasks and the leased ones stored in the DB, ie after a deploy or a redis flush '''
+    if not redis_client:
+        return
+    async with get_db() as db:
+        query = select(Task).where(or_(
+            Task.status.in_(PENDING_TASK_STATUSES),
+            and_(Task.status.in_(LEASED_TASK_STATUSES), Task.lease_expires_at.is_not(None)),
+        ))
+        tasks = (await db.exec(query)).all()
+    await cache.index_pending_tasks(tasks)
+    logger.info(f'Pending tasks index rebuilt with {len(tasks)} tasks')
+
+async def delete_persisted_task(task_id: str):
     ''' Delete a persisted task '''
-    cache.delete(task_id)
-    with get_db() as db:
-        task = db.query(Task).filter(Task.uuid == task_id).first()
+    await cache.delete(task_id)
+    async with get_db() as db:
+        task = await db.get(Task, task_id)
         if task:
-            db.delete(task)
-            db.commit()
+            await db.delete(task)
+            await db.commit()
+    await announce_changes([('tasks', task_id)] + ([('operation_tasks', task.operation_id)] if task and task.operation_id else []))
@@ -0,0 +1,180 @@
+''' Write-behind persistence: Redis takes the writes, Postgres is updated in batches '''
+import os
+import time
+import socket
+import asyncio
+from typing import List, Tuple
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import SQLModel
+from models.operations import Operation
+from models.tasks import Task
+from .redis import redis_client, WRITE_BEHIND_STREAM, WRITE_BEHIND_DEAD_LETTER_STREAM, TaskPersistorRedis, OperationPersistorRedis
+from .database import get_db, is_transient
+from logs import logger
+
+WRITE_BEHIND = os.getenv('PERSISTENCE_MODE', 'write_through') == 'write_behind' and redis_client is not None
+FLUSH_INTERVAL = float(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL', '0.5')) # Seconds between flushes
+FLUSH_SIZE = int(os.getenv('WRITE_BEHIND_FLUSH_SIZE', '500'))            # Max entries per flush
+RECOVERY_IDLE = int(os.getenv('WRITE_BEHIND_RECOVERY_IDLE', '30'))       # Seconds before claiming entries of a dead replica
+MAX_ATTEMPTS = int(os.getenv('WRITE_BEHIND_MAX_ATTEMPTS', '5'))          # Deliveries of an entry before flushing its batch row by row
+CONSUMER_GROUP = 'flushers'
+CONSUMER_NAME = os.getenv('WRITE_BEHIND_CONSUMER', socket.gethostname())
+
+def upsert_statement(model: type[SQLModel], rows: List[dict]):
+    ''' Multi-row INSERT ... ON CONFLICT DO UPDATE for a table model '''
+    statement = insert(model).values(rows)
+    primary_key = [c.name for c in model.__table__.primary_key.columns]
+    return statement.on_conflict_do_update(
+        index_elements=primary_key,
+        set_={c.name: statement.excluded[c.name] for c in model.__table__.columns if c.name not in primary_key}
+    )
+
+def as_row(item: SQLModel) -> dict:
+    ''' Column values of a table model, without serializing them '''
+    return {c.name: getattr(item, c.name) for c in type(item).__table__.columns}
+
+class WriteBehindFlusher():
+    '''
+    Background task flushing the write-behind stream to the DB.
+    A batch with entries delivered max_attempts times is flushed row by row,
+    the rows the DB rejects go to the dead letter stream so they do not block the others
+    '''
+
+    def __init__(self, interval: float = FLUSH_INTERVAL, size: int = FLUSH_SIZE, max_attempts: int = MAX_ATTEMPTS):
+        self.interval = interval
+        self.size = size
+        self.max_attempts = max_attempts
+        self.tasks_cache = TaskPersistorRedis()
+        self.operations_cache = OperationPersistorRedis()
+        self.stopping = None
+        self.runner = None
+        self.last_recovery = 0
+
+    async def start(self) -> None:
+        ''' Create the consumer group, replay unflushed entries and start flushing '''
+        if not WRITE_BEHIND:
+            return
+        try:
+            await redis_client.xgroup_create(WRITE_BEHIND_STREAM, CONSUMER_GROUP, id='0', mkstream=True)
+        except Exception as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+        self.stopping = asyncio.Event()
+        self.runner = asyncio.create_task(self.run())
+        logger.info(f'Write-behind flusher started as {CONSUMER_NAME}')
+
+    async def stop(self) -> None:
+        ''' Stop the flusher, flushing everything still queued '''
+        if not self.runner:
+            return
+        self.stopping.set()
+        await self.runner
+        self.runner = None
+
+    async def run(self) -> None:
+        ''' Flush loop '''
+        while not self.stopping.is_set():
+            try:
+                if time.monotonic() - self.last_recovery > RECOVERY_IDLE:
+                    await self.recover()
+                flushed = await self.flush()
+            except Exception as e:
+                logger.error(f'Write-behind flush failed, will retry: {e}')
+                flushed = 0
+            if flushed >= self.size:
+                continue # There is a backlog, flush again right away
+            try:
+                await asyncio.wait_for(self.stopping.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+        try:
+            while await self.flush():
+                pass
+        except Exception as e:
+            logger.error(f'Write-behind final flush failed, entries will be replayed on restart: {e}')
+
+    async def recover(self) -> None:
+        ''' Claim the entries delivered to replicas that died before acknowledging them '''
+        self.last_recovery = time.monotonic()
+        start_id = '0-0'
+        while True:
+            response = await redis_client.xautoclaim(
+                WRITE_BEHIND_STREAM, CONSUMER_GROUP, CONSUMER_NAME,
+                min_idle_time=RECOVERY_IDLE * 1000, start_id=start_id, count=self.size, justid=True)
+            start_id, claimed = response[0], response[1]
+            if claimed:
+                logger.info(f'Write-behind claimed {len(claimed)} unflushed entries')
+            if start_id in (b'0-0', '0-0'):
+                return
+
+    async def read(self) -> Tuple[list, bool]:
+        ''' Read the entries to flush, retrying our own unacknowledged ones first. Returns whether they are retries '''
+        for last_id in ('0', '>'):
+            response = await redis_client.xreadgroup(
+                CONSUMER_GROUP, CONSUMER_NAME, {WRITE_BEHIND_STREAM: last_id}, count=self.size)
+            entries = response[0][1] if response else []
+            if entries:
+                return entries, last_id == '0'
+        return [], False
+
+    async def exhausted(self, entries: list) -> bool:
+        ''' Whether any of the entries was delivered max_attempts times '''
+        pending = await redis_client.xpending_range(
+            WRITE_BEHIND_STREAM, CONSUMER_GROUP, min=entries[0][0], max=entries[-1][0], count=len(entries), consumername=CONSUMER_NAME)
+        return any(x['times_delivered'] >= self.max_attempts for x in pending)
+
+    async def flush(self) -> int:
+        ''' Upsert a batch of queued entities in a single transaction '''
+        entries, retried = await self.read()
+        if not entries:
+            return 0
+        if retried and await self.exhausted(entries):
+            logger.error(f'Write-behind batch of {len(entries)} entries failed {self.max_attempts} times, flushing them one by one')
+            for entry in entries:
+                await self.flush_entry(entry)
+            return len(entries)
+        await self.upsert(entries)
+        await self.acknowledge([entry_id for entry_id, _ in entries])
+        return len(entries)
+
+    async def flush_entry(self, entry: tuple) -> None:
+        ''' Upsert a single entry, to the dead letter stream if the DB rejects it '''
+        entry_id, fields = entry
+        try:
+            await self.upsert([entry])
+        except Exception as e:
+            if is_transient(e):
+                raise
+            logger.error(f'Write-behind entry {entry_id} rejected, moved to {WRITE_BEHIND_DEAD_LETTER_STREAM}: {e}')
+            await redis_client.xadd(WRITE_BEHIND_DEAD_LETTER_STREAM, {**fields, b'error': str(e)})
+        await self.acknowledge([entry_id])
+
+    async def acknowledge(self, entry_ids: list) -> None:
+        ''' Remove the flushed entries from the stream '''
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.xack(WRITE_BEHIND_STREAM, CONSUMER_GROUP, *entry_ids)
+        pipe.xdel(WRITE_BEHIND_STREAM, *entry_ids)
+        await pipe.execute()
+
+    async def upsert(self, entries: list) -> None:
+        ''' Upsert the current version of the entities of the entries '''
+        task_ids, operation_ids = {}, {}
+        for _, fields in entries:
+            uuid = fields[b'id'].decode()
+            if fields[b'entity'] == b'operation':
+                operation_ids[uuid] = True
+            else:
+                task_ids[uuid] = True
+        # Deleted entities are no longer in redis and are skipped
+        operations = [x for x in await self.operations_cache.load_many(list(operation_ids)) if x]
+        tasks = [x for x in await self.tasks_cache.load_many(list(task_ids)) if x]
+        async with get_db() as db:
+            # Operations first, tasks reference them
+            if operations:
+                await db.exec(upsert_statement(Operation, [as_row(x) for x in operations]))
+            if tasks:
+                await db.exec(upsert_statement(Task, [as_row(x) for x in tasks]))
+            await db.commit()
+        logger.debug(f'Write-behind flushed {len(operations)} operations and {len(tasks)} tasks')
+
+flusher = WriteBehindFlusher()
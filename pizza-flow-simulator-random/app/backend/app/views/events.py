@@ -4,14 +4,18 @@ from models.users import User
 from access_control.auth import active_user
 from pydantic import BaseModel
 from persistance.events import list_persisted_events
+from persistance.pagination import next_cursor
 from controllers.events import EventsController
 
 api_app = APIRouter()
 @api_app.get("/events", tags=["events"])
 async def api_list_events(
     current_user: User = Depends(active_user),
-    limit: int = 10, offset: int = 0
+    limit: int = 10, cursor: str = None, event_type: str = None
     ):
-    ''' Returns a list of events for the current user '''
-    event_list = [x.model_dump() for x in await list_persisted_events(limit, offset)]
-    return {"events": event_list}
+    ''' Returns a page of events for the current user, next is the cursor of the following page '''
+    try:
+        events = await list_persisted_events(limit, cursor, event_type.split(',') if event_type else None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"events": [x.model_dump() for x in events], "next": next_cursor(events, 'time', limit)}
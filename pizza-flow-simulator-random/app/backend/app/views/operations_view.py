@@ -1,6 +1,6 @@
 ''' Endpoints for access control '''
 import traceback
-from fastapi import Depends, HTTPException, APIRouter
+from fastapi import Depends, HTTPException, APIRouter, Request
 from models.users import User
 from models.tasks import TaskStatus
 from persistance.rfa import RFA, persist_rfa
@@ -16,33 +16,60 @@ from operations import (
 from controllers.rfa import RFAController
 from controllers.events import EventsController
 
-from persistance.tasks import (load_persisted_task, persist_task, load_tasks_for_operation, delete_persisted_task)
+from persistance.tasks import (load_persisted_task, persist_task, load_tasks_for_operation, delete_persisted_task, load_persisted_tasks_filtering)
 from persistance.operations import load_persisted_operation, load_persisted_operations_filtering
-from ws import ws
+from ws import ws, region_room, operation_room
+from .polling import conditional_get, etag
 
 api_app = APIRouter()
 @api_app.get('/ops', tags=["operations"])
-async def list_ops(limit: int=None, status: str=None, req_user: User = Depends(active_user)):
-    ''' Returns the list of Operations '''
+async def list_ops(limit: int=None, status: str=None, operation: str=None, region: str=None, req_user: User = Depends(active_user)):
+    ''' Returns the list of Operations, newest first '''
     try:
         params = {}
         if limit:
             params['limit'] = limit
         if status:
             params['status'] = status.split(',')
-        ops_list =[x.model_dump() for x in load_persisted_operations_filtering(**params)]
+        if operation:
+            params['operation'] = operation.split(',')
+        if region:
+            params['region'] = region.split(',')
+        ops_list =[x.model_dump() for x in await load_persisted_operations_filtering(**params)]
         return {"operations": ops_list}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_app.get('/tasks', tags=["operations"])
+async def list_tasks(limit: int=None, status: str=None, region: str=None, task: str=None, req_user: User = Depends(active_user)):
+    ''' Returns the list of Tasks, last started first '''
+    try:
+        params = {}
+        if limit:
+            params['limit'] = limit
+        if status:
+            params['status'] = status.split(',')
+        if region:
+            params['region'] = region.split(',')
+        if task:
+            params['task'] = task.split(',')
+        tasks_list = [x.model_dump(exclude={'result'}) for x in await load_persisted_tasks_filtering(**params)]
+        return {"tasks": tasks_list}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @api_app.get('/ops/{op_id}', tags=["operations"])
-async def get_op(op_id: str, req_user: User = Depends(active_user)):
-    ''' Returns the details of a specific Operation '''
-    op = load_persisted_operation(op_id)
-    if not op:
-        raise HTTPException(status_code=404, detail="Operation not found")
-    tasks = load_tasks_for_operation(op_id)
-    return {"operation": op.model_dump(), "tasks": [x.model_dump(exclude={'result'}) for x in tasks]}
+async def get_op(op_id: str, request: Request, wait: int = 0, req_user: User = Depends(active_user)):
+    ''' Returns the details of a specific Operation and its tasks, see conditional_get for If-None-Match and wait '''
+    async def load():
+        op = await load_persisted_operation(op_id)
+        if not op:
+            return None
+        tasks = await load_tasks_for_operation(op_id)
+        body = {"operation": op.model_dump(), "tasks": [x.model_dump(exclude={'result'}) for x in tasks]}
+        # Tasks only go up in version, the count covers the deleted ones
+        return body, etag(op.version, len(tasks), sum(x.version for x in tasks))
+    return await conditional_get(request, [('operations', op_id), ('operation_tasks', op_id)], load, wait, detail="Operation not found")
 
 class OperationUpdateRequest(BaseModel):
     action: str
@@ -50,7 +77,7 @@ class OperationUpdateRequest(BaseModel):
 @api_app.post("/ops/{op_id}", tags=["operations"])
 async def act_on_op(op_id: str, req: OperationUpdateRequest, req_user: User = Depends(active_user)):
     ''' Cancel an Operation '''
-    op = load_persisted_operation(op_id)
+    op = await load_persisted_operation(op_id, cached=False)
     if not op:
         raise HTTPException(status_code=404, detail="Operation not found")
     try:
@@ -73,23 +100,24 @@ async def act_on_op(op_id: str, req: OperationUpdateRequest, req_user: User = De
 @api_app.post("/task/{task_id}", tags=["operations"])
 async def act_on_task(task_id: str, req: OperationUpdateRequest, req_user: User = Depends(active_user)):
     ''' Cancel an Operation '''
-    task = load_persisted_task(task_id)
+    task = await load_persisted_task(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
     try:
         if req.action == 'cancel':
             task.status = TaskStatus.cancelled
-            persist_task(task)
+            await persist_task(task)
         elif req.action == 'delete':
-            delete_persisted_task(task_id)
+            await delete_persisted_task(task_id)
         elif req.action == 'rerun':
             task.status = TaskStatus.pending
             if not task.max_retries:
                 task.max_retries = 0
             task.max_retries += 1
+            task.retries += 1 # A new run, workers do not send again the result of the previous one
             task.error = None
-            persist_task(task)
-            await ws.emit('task', task.model_dump(), namespace='/worker')
+            await persist_task(task)
+            await ws.emit('task', task.model_dump(), to=region_room(task.region), namespace='/worker')
         else:
             raise HTTPException(status_code=400, detail="Invalid action")
         return task.model_dump()
@@ -97,12 +125,12 @@ async def act_on_task(task_id: str, req: OperationUpdateRequest, req_user: User
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_app.get('/task/{task_id}', tags=["operations"])
-async def http_get_task(task_id: str, req_user: User = Depends(active_user)):
-    ''' Returns the details of a specific Task '''
-    task = load_persisted_task(task_id)
-    if not task:
-        raise HTTPException(status_code=404, detail="Task not found")
-    return task.model_dump()
+async def http_get_task(task_id: str, request: Request, wait: int = 0, req_user: User = Depends(active_user)):
+    ''' Returns the details of a specific Task, see conditional_get for If-None-Match and wait '''
+    async def load():
+        task = await load_persisted_task(task_id)
+        return (task.model_dump(), etag(task.version)) if task else None
+    return await conditional_get(request, [('tasks', task_id)], load, wait, detail="Task not found")
 
 ## Specific operations
 class PerformOperationRequest(BaseModel):
@@ -115,7 +143,7 @@ async def http_perform_operation(op_name: str, req: PerformOperationRequest, use
     ''' Perform an operation '''
     try:
         rfa = RFA(requester=user.email, operation=op_name, parameters=req.parameters, request_channel=req.channel)
-        rfa_db = persist_rfa(rfa)
+        rfa_db = await persist_rfa(rfa)
         await EventsController.create_event(user, "rfa_created", {'rfa_id': str(rfa.id), 'operation': rfa.operation})
         await RFAController.ws_notify(rfa)
         return {"status": "waiting_for_approval", 'rfa': rfa_db.model_dump()}
@@ -4,6 +4,7 @@ from models.users import User
 from access_control.auth import active_user
 from pydantic import BaseModel
 from persistance.pizzas import list_persisted_pizzas, load_persisted_pizza
+from persistance.pagination import next_cursor
 from persistance.rfa import RFA, persist_rfa
 from controllers.rfa import RFAController
 from controllers.events import EventsController
@@ -15,12 +16,15 @@ api_app = APIRouter()
 @api_app.get("/pizzas", tags=["pizzas"])
 async def api_list_pizzas(
     current_user: User = Depends(active_user),
-    limit: int = 100, offset: int = 0, status: str = None
+    limit: int = 100, cursor: str = None, status: str = None
     ):
-    ''' Returns the list of pizzas '''
+    ''' Returns a page of pizzas, next is the cursor of the following page '''
     statuses = status.split(',') if status else []
-    pizzas_list = [x.model_dump() for x in await list_persisted_pizzas(limit, offset, statuses)]
-    return {"pizzas": pizzas_list}
+    try:
+        pizzas = await list_persisted_pizzas(limit, cursor, statuses)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"pizzas": [x.model_dump() for x in pizzas], "next": next_cursor(pizzas, 'creation', limit)}
 
 class CreatePizzaRequest(BaseModel):
     name: str
@@ -44,7 +48,7 @@ def create_pizza_rfa(user: User, request: CreatePizzaRequest) -> RFA:
 async def api_create_pizza(request: CreatePizzaRequest, current_user: User = Depends(active_user)):
     try:
         rfa_model = create_pizza_rfa(current_user, request)
-        rfa = persist_rfa(rfa_model)
+        rfa = await persist_rfa(rfa_model)
         await EventsController.create_event(current_user, "rfa_created", {'rfa_id': str(rfa.id), 'operation': rfa.operation})
         await RFAController.ws_notify(rfa)
         return {"status": "waiting_for_approval", 'rfa_id': str(rfa.id)}
@@ -55,6 +59,6 @@ async def api_create_pizza(request: CreatePizzaRequest, current_user: User = Dep
 
 @api_app.get('/pizza/{pizza_id}', tags=["pizzas"])
 async def api_get_pizza(pizza_id: str, current_user: User = Depends(active_user)):
-    pizza = load_persisted_pizza(pizza_id)
+    pizza = await load_persisted_pizza(pizza_id)
     return {"pizza": pizza.model_dump()}
 
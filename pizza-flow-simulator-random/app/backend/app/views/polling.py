@@ -0,0 +1,46 @@
+''' Conditional GET and long-poll of the entities polled by the clients '''
+import time
+import asyncio
+from typing import Awaitable, Callable, List, Tuple
+from fastapi import HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+from persistance.cache import invalidations
+
+MAX_WAIT = 60 # Seconds a long-poll request can be parked
+
+def etag(*versions: int) -> str:
+    ''' ETag of an entity from its version, or the versions of the entities in the response '''
+    return '"' + '-'.join(str(x) for x in versions) + '"'
+
+def matches(request: Request, tag: str) -> bool:
+    ''' Whether the If-None-Match header of the request has the ETag '''
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    tags = [x.strip().removeprefix('W/') for x in header.split(',')]
+    return '*' in tags or tag in tags
+
+async def conditional_get(request: Request, watch: List[Tuple[str, str]], load: Callable[[], Awaitable[Tuple[dict, str] | None]], wait: int = 0, detail: str = 'Not found') -> Response:
+    '''
+    Response of a GET of an entity, load returns its body and ETag or None if it does not exist.
+    304 if the client already has the current ETag in If-None-Match. With wait, the request is parked until
+    any of the watched (kind, id) entities changes, for up to wait seconds, and answers 304 if nothing changed
+    '''
+    deadline = time.monotonic() + min(max(wait, 0), MAX_WAIT)
+    with invalidations.watch(watch) as changed:
+        loaded = await load()
+        while loaded and matches(request, loaded[1]) and time.monotonic() < deadline:
+            try:
+                await asyncio.wait_for(changed.wait(), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                break
+            changed.clear()
+            loaded = await load()
+    if not loaded:
+        raise HTTPException(status_code=404, detail=detail)
+    body, tag = loaded
+    headers = {'ETag': tag, 'Cache-Control': 'no-cache'}
+    if matches(request, tag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(jsonable_encoder(body), headers=headers)
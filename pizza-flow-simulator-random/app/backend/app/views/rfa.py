@@ -1,33 +1,39 @@
 ''' Endpoints for access control '''
-from fastapi import Depends, HTTPException, APIRouter
+from fastapi import Depends, HTTPException, APIRouter, Request
 from models.users import User
 from models.rfa import RFAStatus
 from access_control.auth import active_user
 from pydantic import BaseModel
 from controllers.rfa import RFAController
-from persistance.rfa import list_persisted_rfas, load_persisted_rfa
+from persistance.rfa import list_persisted_rfas, load_persisted_rfa, StaleRFAException
+from persistance.pagination import next_cursor
 from logs import logger
+from .polling import conditional_get, etag
 
 api_app = APIRouter()
 @api_app.get("/admin/rfas", tags=["rfa"])
 async def api_list_rfas(current_user: User = Depends(active_user),
-    limit: int = 100, offset: int = 0, status: str = None):
-    ''' Returns the list of RFAs for the current user '''
+    limit: int = 100, cursor: str = None, status: str = None):
+    ''' Returns a page of RFAs for the current user, next is the cursor of the following page '''
     try:
-        args = {'limit': limit, 'offset': offset}
+        args = {'limit': limit, 'cursor': cursor}
         if status:
             args['status'] = status.split(',')
-        rfa_list = [x.model_dump() for x in await list_persisted_rfas(**args)]
+        rfas = await list_persisted_rfas(**args)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Could not list RFAs because of {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
-    return {"rfas": rfa_list}
+    return {"rfas": [x.model_dump() for x in rfas], "next": next_cursor(rfas, 'creation', limit)}
 
 @api_app.get("/rfa/{rfa_id}", tags=["rfa"])
-async def api_get_single_rfa(rfa_id: str, current_user: User = Depends(active_user)):
-    ''' Returns the details of a specific RFA '''
-    rfa = load_persisted_rfa(rfa_id)
-    return rfa.model_dump()
+async def api_get_single_rfa(rfa_id: str, request: Request, wait: int = 0, current_user: User = Depends(active_user)):
+    ''' Returns the details of a specific RFA, see conditional_get for If-None-Match and wait '''
+    async def load():
+        rfa = await load_persisted_rfa(rfa_id)
+        return (rfa.model_dump(), etag(rfa.version)) if rfa else None
+    return await conditional_get(request, [('rfa', rfa_id)], load, wait, detail="RFA not found")
 
 class RFAResponseRequest(BaseModel):
     status: RFAStatus
@@ -44,6 +50,8 @@ async def api_resolve_rfa(rfa_id: str, req: RFAResponseRequest, current_user: Us
             channel=req.channel)
         await RFAController.ws_notify(rfa)
         return {"rfa": rfa.model_dump()}
+    except StaleRFAException as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         logger.error(f"Could not resolve RFA because of {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
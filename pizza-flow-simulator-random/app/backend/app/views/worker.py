@@ -1,8 +1,10 @@
 ''' Endpoints for workers '''
+from typing import List
+from pydantic import ValidationError
 from fastapi import Depends, HTTPException, Request, APIRouter
 from models.tasks import Task
 from access_control.worker import authenticate_worker
-from controllers.worker import AlreadyRunningException, OperationNotFoundException, on_task_notify, get_tasks_for_region
+from controllers.worker import AlreadyRunningException, OperationNotFoundException, LeaseLostException, on_task_notify, on_tasks_notify, get_tasks_for_region
 from logs import logger
 
 api_app = APIRouter()
@@ -15,9 +17,9 @@ async def worker_identify(body: Request, worker_pop = Depends(authenticate_worke
     return {"status": "ok"}
 
 @api_app.get("/worker/tasks", tags=["worker"])
-async def list_worker_tasks(worker_pop = Depends(authenticate_worker)):
-    ''' Returns the list of tasks for the worker '''
-    tasks_list = await get_tasks_for_region(worker_pop)
+async def list_worker_tasks(credits: int | None = None, worker_pop = Depends(authenticate_worker)):
+    ''' Returns the list of tasks for the worker, at most credits of them '''
+    tasks_list, _ = await get_tasks_for_region(worker_pop, credits)
     return {"tasks": tasks_list}
 
 @api_app.post("/worker/task/{task_id}", tags=["worker"])
@@ -27,30 +29,66 @@ async def worker_task_feedback(task_id: str, execution: Task, worker = Depends(a
         response = await on_task_notify(execution)
     except AlreadyRunningException:
         raise HTTPException(status_code=409, detail="Task already running")
+    except LeaseLostException:
+        raise HTTPException(status_code=409, detail="Task lease lost")
     except OperationNotFoundException:
         raise HTTPException(status_code=400, detail="Operation not found")
     return response
 
+@api_app.post("/worker/tasks/results", tags=["worker"])
+async def worker_tasks_results(executions: List[dict], worker = Depends(authenticate_worker)):
+    ''' Batch of task feedbacks from worker, with an ack per task '''
+    return {"results": await tasks_feedback(executions)}
+
+async def tasks_feedback(data: List[dict]) -> List[dict]:
+    ''' Ack per task of a batch of task feedbacks, malformed ones get an error ack '''
+    acks = [None] * len(data)
+    valid, executions = [], []
+    for i, item in enumerate(data):
+        try:
+            executions.append(Task.model_validate(item))
+            valid.append(i)
+        except ValidationError as e:
+            logger.error(f'Invalid task feedback: {e}')
+            uuid = item.get('uuid') if isinstance(item, dict) else None
+            acks[i] = {"uuid": uuid, "status": "error", "error": "Invalid task"}
+    for i, ack in zip(valid, await on_tasks_notify(executions)):
+        acks[i] = ack
+    return acks
+
 from ws import ws, ws_sessions
 async def ws_worker_task_feedback(session_id, data: dict):
     ''' Callback for websocket '''
     logger.debug(f'WS Callback: {data}')
     try:
-        execution = Task(**data)
+        execution = Task.model_validate(data)
         response = await on_task_notify(execution)
     except AlreadyRunningException:
         return {"status": "error", "error": "Task already running"}
+    except LeaseLostException:
+        return {"status": "error", "error": "Task lease lost"}
     except OperationNotFoundException:
         return {"status": "error", "error": "Operation not found"}
     return response
 
-async def ws_worker_task_pull(sid):
-    ''' Callback for websocket to pull pending tasks '''
-    worker_id = ws_sessions.get(sid)
-    logger.debug(f'[WS] Worker {worker_id} asking for new jobs')
-    tasks = await get_tasks_for_region(worker_id)
+async def ws_worker_tasks_feedback(session_id, data: list):
+    ''' Callback for websocket, batch of task feedbacks '''
+    logger.debug(f'WS Callback: {len(data)} task updates')
+    return {"results": await tasks_feedback(data)}
+
+async def ws_worker_task_pull(sid, data: dict | None = None):
+    ''' Callback for websocket to pull pending tasks, the worker sends its free capacity as credits '''
+    worker_id = await ws_sessions.get(sid)
+    credits = (data or {}).get('credits')
+    # Tasks of each handler the worker can take, ie bake_pizza up to its free ovens
+    limits = {str(k): int(v) for k, v in ((data or {}).get('limits') or {}).items()}
+    logger.debug(f'[WS] Worker {worker_id} asking for {credits} new jobs, limits {limits}')
+    tasks, more = await get_tasks_for_region(worker_id, credits, limits)
     for task in tasks:
         await ws.emit('task', task.model_dump(), room=sid, namespace='/worker')
+    # Credits used or tasks left for lack of resources, the worker may pull again when it has capacity
+    return {"sent": len(tasks), "more": more}
     
 ws.on('task_result', ws_worker_task_feedback, namespace='/worker')
+ws.on('task_results', ws_worker_tasks_feedback, namespace='/worker')
 ws.on('get_tasks', ws_worker_task_pull, namespace='/worker')
\ No newline at end of file
@@ -1,11 +1,14 @@
 ''' Websockets management '''
 import os
+import json
+import asyncio
+from collections import OrderedDict
 from logs import logger
 import socketio
 
 from access_control import auth
 from access_control.worker import validate_worker_token
-from persistance.redis import WSAuthPersistorRedis
+from persistance.redis import WSAuthPersistorRedis, redis_client
 
 # Websockets
 ws_client_manager = None
@@ -16,6 +19,214 @@ if os.getenv("REDIS_HOST", ""):
 ws = socketio.AsyncServer(async_mode='asgi', client_manager=ws_client_manager)
 ws_sessions = WSAuthPersistorRedis()
 
+# Rooms, updates are only sent to the clients that joined them
+OPERATIONS_ROOM = 'operations' # Updates of every operation, for dashboards
+
+def region_room(region: str) -> str:
+    ''' Workers of a region, in the /worker namespace '''
+    return f'region.{region}'
+
+def operation_room(operation_id: str) -> str:
+    ''' Clients following an operation and its tasks '''
+    return f'operation.{operation_id}'
+
+def rfa_room(rfa_id: str) -> str:
+    ''' Clients following an RFA and the pizza it creates '''
+    return f'rfa.{rfa_id}'
+
+# Batched updates
+UPDATES_WINDOW = float(os.getenv('WS_UPDATES_WINDOW_MS', '50')) / 1000  # 0 sends every update right away
+UPDATES_SNAPSHOTS = int(os.getenv('WS_UPDATES_SNAPSHOTS', '10000'))     # Entities remembered to compute deltas, per room with redis
+UPDATES_TTL = int(os.getenv('WS_UPDATES_TTL', '86400'))                 # Seconds the state of an idle room is kept in redis
+BROADCAST = '*' # Room of the updates sent to every client
+
+# Applies a frame to the state of a room shared by the replicas, and numbers it.
+# The state keeps the JSON of every field last sent per entity, the order the entities by last frame to trim it.
+# KEYS: sequence, state hash, order zset. ARGV: max entities, ttl, entities, then per entity:
+# entity key, number of fields, name, JSON value, name, JSON value...
+# Returns {sequence or 0 if nothing changed, then per entity: full, number of changed fields, names...}
+APPLY_UPDATES_SCRIPT = '''
+local result = {}
+local entities = {}
+local changed = false
+local i = 4
+for e = 1, tonumber(ARGV[3]) do
+    local key, fields = ARGV[i], tonumber(ARGV[i + 1])
+    i = i + 2
+    local raw = redis.call('HGET', KEYS[2], key)
+    local previous = raw and cjson.decode(raw) or {}
+    local names = {}
+    for f = 1, fields do
+        local name, value = ARGV[i], ARGV[i + 1]
+        i = i + 2
+        if previous[name] ~= value then
+            previous[name] = value
+            table.insert(names, name)
+        end
+    end
+    redis.call('HSET', KEYS[2], key, cjson.encode(previous))
+    table.insert(entities, key)
+    table.insert(result, raw and 0 or 1)
+    table.insert(result, #names)
+    for _, name in ipairs(names) do
+        table.insert(result, name)
+    end
+    changed = changed or not raw or #names > 0
+end
+local seq = 0
+if changed then
+    seq = redis.call('INCR', KEYS[1])
+end
+if changed then
+    for _, key in ipairs(entities) do
+        redis.call('ZADD', KEYS[3], seq, key)
+    end
+end
+local extra = redis.call('ZCARD', KEYS[3]) - tonumber(ARGV[1])
+if extra > 0 then
+    local old = redis.call('ZRANGE', KEYS[3], 0, extra - 1)
+    redis.call('ZREMRANGEBYRANK', KEYS[3], 0, extra - 1)
+    redis.call('HDEL', KEYS[2], unpack(old))
+end
+for _, key in ipairs(KEYS) do
+    redis.call('EXPIRE', key, ARGV[2])
+end
+table.insert(result, 1, seq)
+return result
+'''
+apply_updates_script = redis_client.register_script(APPLY_UPDATES_SCRIPT) if redis_client else None
+ENTITY_SEPARATOR = '\x1f' # Between the event and the entity id in the state of a room
+
+class UpdatesAggregator():
+    '''
+    Coalesces the updates of each room per entity during a short window and sends them
+    as a single 'updates' frame with the changed fields only and a sequence number per room.
+    Clients seeing a gap in the sequence ask for the full state with 'resync'.
+    With redis the state of the rooms is shared by the replicas, so deltas and resyncs cover the frames of all of them
+    '''
+
+    def __init__(self, server: socketio.AsyncServer, window: float = UPDATES_WINDOW, max_snapshots: int = UPDATES_SNAPSHOTS):
+        self.server = server
+        self.window = window
+        self.max_snapshots = max_snapshots
+        self.pending = {}             # room -> {(event, entity id): fields}
+        self.snapshots = OrderedDict() # (room, event, entity id) -> fields last sent, without redis
+        self.sequences = {}           # room -> last sequence sent, without redis
+        self.flushers = {}            # room -> task flushing it at the end of the window
+
+    async def publish(self, event: str, entity_id, data: dict, to=None) -> None:
+        ''' Queue the update of an entity for the given room(s), everyone if none '''
+        rooms = to if isinstance(to, list) else [to or BROADCAST]
+        for room in rooms:
+            updates = self.pending.setdefault(room, {})
+            key = (event, str(entity_id))
+            if key in updates:
+                updates[key].update(data)
+            else:
+                updates[key] = dict(data)
+            if not self.window:
+                await self.flush(room)
+            elif room not in self.flushers:
+                self.flushers[room] = asyncio.create_task(self.flush_later(room))
+
+    async def flush_later(self, room: str) -> None:
+        ''' Flush a room at the end of its window '''
+        await asyncio.sleep(self.window)
+        try:
+            await self.flush(room)
+        except Exception as e:
+            logger.error(f'[WS] Could not send updates to room {room}: {e}')
+
+    async def flush(self, room: str) -> None:
+        ''' Send the updates queued for a room as a single frame '''
+        self.flushers.pop(room, None)
+        updates = self.pending.pop(room, None)
+        if not updates:
+            return
+        if redis_client is not None:
+            seq, frame = await self.apply_shared(room, updates)
+        else:
+            seq, frame = self.apply_local(room, updates)
+        if not frame:
+            return
+        payload = {'room': room, 'seq': seq, 'updates': frame}
+        await self.server.emit('updates', payload, to=None if room == BROADCAST else room)
+
+    def keys(self, room: str) -> list:
+        ''' Redis keys of the sequence, state and order of a room '''
+        return [f'ws_updates.{room}.seq', f'ws_updates.{room}.state', f'ws_updates.{room}.order']
+
+    async def apply_shared(self, room: str, updates: dict) -> tuple:
+        ''' Sequence and frame of the updates, against the state of the room in redis '''
+        args = [self.max_snapshots, UPDATES_TTL, len(updates)]
+        for (event, entity_id), data in updates.items():
+            args += [f'{event}{ENTITY_SEPARATOR}{entity_id}', len(data)]
+            for name, value in data.items():
+                args += [name, json.dumps(value, sort_keys=True, default=str)]
+        result = await apply_updates_script(keys=self.keys(room), args=args)
+        seq, i, frame = int(result[0]), 1, []
+        for (event, entity_id), data in updates.items():
+            full, count = int(result[i]), int(result[i + 1])
+            names = [x.decode() if isinstance(x, bytes) else x for x in result[i + 2:i + 2 + count]]
+            i += 2 + count
+            if full or names:
+                frame.append({'event': event, 'id': entity_id, 'full': bool(full), 'data': data if full else {k: data[k] for k in names}})
+        return seq, frame
+
+    def apply_local(self, room: str, updates: dict) -> tuple:
+        ''' Sequence and frame of the updates, against the snapshots of this replica '''
+        frame = []
+        for (event, entity_id), data in updates.items():
+            key = (room, event, entity_id)
+            previous = self.snapshots.pop(key, None)
+            if previous is None:
+                changes = data
+                self.snapshots[key] = data
+            else:
+                changes = {k: v for k, v in data.items() if k not in previous or previous[k] != v}
+                self.snapshots[key] = {**previous, **data}
+            if changes or previous is None:
+                frame.append({'event': event, 'id': entity_id, 'full': previous is None, 'data': changes})
+        while len(self.snapshots) > self.max_snapshots:
+            self.snapshots.popitem(last=False)
+        if not frame:
+            return 0, frame
+        self.sequences[room] = self.sequences.get(room, 0) + 1
+        return self.sequences[room], frame
+
+    async def close(self) -> None:
+        ''' Send everything still queued '''
+        for room in list(self.pending):
+            await self.flush(room)
+        for flusher in list(self.flushers.values()):
+            flusher.cancel()
+        self.flushers = {}
+
+    async def snapshot(self, room: str) -> dict:
+        ''' Full state of the entities sent to a room, by any replica when using redis '''
+        room = room or BROADCAST
+        if redis_client is None:
+            frame = [
+                {'event': event, 'id': entity_id, 'full': True, 'data': data}
+                for (snapshot_room, event, entity_id), data in self.snapshots.items() if snapshot_room == room
+            ]
+            return {'room': room, 'seq': self.sequences.get(room, 0), 'updates': frame}
+        seq_key, state_key, _ = self.keys(room)
+        # Sequence and state read at once, the state has every frame up to the sequence
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.get(seq_key)
+        pipe.hgetall(state_key)
+        seq, state = await pipe.execute()
+        frame = []
+        for key, fields in state.items():
+            key = key.decode() if isinstance(key, bytes) else key
+            event, entity_id = key.split(ENTITY_SEPARATOR, 1)
+            data = {name: json.loads(value) for name, value in json.loads(fields).items()}
+            frame.append({'event': event, 'id': entity_id, 'full': True, 'data': data})
+        return {'room': room, 'seq': int(seq or 0), 'updates': frame}
+
+updates = UpdatesAggregator(ws)
+
 @ws.event
 async def connect(sid, environ, authorization):
     token = authorization.get('token')
@@ -34,11 +245,21 @@ async def join(sid, room):
     logger.info(f'[WS] Joining room {room}')
     await ws.enter_room(sid, room)
 
+@ws.on('leave')
+async def leave(sid, room):
+    logger.info(f'[WS] Leaving room {room}')
+    await ws.leave_room(sid, room)
+
+@ws.on('resync')
+async def resync(sid, room):
+    ''' Full state of a room, for clients that missed frames '''
+    return await updates.snapshot(room)
+
 @ws.event
-def disconnect(sid):
+async def disconnect(sid):
     logger.info(f'[WS] Disconnect {sid}')
     try:
-        ws_sessions.delete(sid)
+        await ws_sessions.delete(sid)
     except Exception as e:
         logger.error(f'[WS] Error deleting session {sid}: {e}')
 
@@ -48,7 +269,8 @@ async def connect_worker(sid, environ, authorization):
     try:
         worker = validate_worker_token(token)
         print(f'[WS] Connected worker {worker} with sid {sid}')
-        ws_sessions.persist(sid, worker)
+        await ws_sessions.persist(sid, worker)
+        await ws.enter_room(sid, region_room(worker), namespace='/worker')
         return True
     except Exception as e:
         print(f'[WS] Error connecting worker with token {token}: {e}')
@@ -0,0 +1,7 @@
+''' Retry delays '''
+import random
+
+def backoff(attempt: int, base: float = 1, cap: float = 60) -> float:
+    ''' Seconds to wait before retrying, exponential with jitter so the workers do not retry all at once '''
+    delay = min(cap, base * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
@@ -0,0 +1,48 @@
+''' Durable journal of the task updates to send to the server '''
+import sqlite3
+from threading import Lock
+from typing import List, Tuple
+from models.task_execution import TaskExecution
+from config import RESULTS_JOURNAL
+
+class ResultJournal():
+    '''
+    SQLite journal of the task updates not acknowledged by the server yet, kept across restarts.
+    A task has at most one update per status queued, a newer one replaces it
+    '''
+    def __init__(self, path: str = RESULTS_JOURNAL):
+        self.lock = Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS results (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                uuid TEXT NOT NULL,
+                status TEXT NOT NULL,
+                execution TEXT NOT NULL,
+                UNIQUE (uuid, status)
+            )''')
+
+    def append(self, execution: TaskExecution) -> None:
+        ''' Queue a task update '''
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO results (uuid, status, execution) VALUES (?, ?, ?)',
+                (execution.uuid, execution.status.value, execution.model_dump_json()))
+
+    def pending(self, limit: int) -> List[Tuple[int, TaskExecution]]:
+        ''' Oldest queued updates, with their ids '''
+        with self.lock:
+            rows = self.db.execute('SELECT id, execution FROM results ORDER BY id LIMIT ?', (limit,)).fetchall()
+        return [(row_id, TaskExecution.model_validate_json(execution)) for row_id, execution in rows]
+
+    def remove(self, ids: List[int]) -> None:
+        ''' Remove the updates acknowledged by the server '''
+        with self.lock:
+            self.db.executemany('DELETE FROM results WHERE id = ?', [(x,) for x in ids])
+
+    def count(self) -> int:
+        ''' Number of queued updates '''
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
@@ -1,9 +1,18 @@
 ''' Abstract class to send tasks status to serverr '''
 from abc import ABC
+from typing import List
 from models.task_execution import TaskExecution
 
 class TaskStatusNotifierProvider(ABC):
     ''' Abstract class to notify task status '''
-    def notify_status(self, execution: TaskExecution) -> None:
-        ''' Get tasks from the provider '''
+    def notify_status(self, execution: TaskExecution) -> bool:
+        ''' Send a task status once, False if the server was not reached and the update has to be sent again '''
+        raise NotImplemented()
+
+    def claim(self, execution: TaskExecution) -> dict | None:
+        ''' Claim a task, returns the response of the server '''
+        raise NotImplemented()
+
+    def notify_batch(self, executions: List[TaskExecution]) -> List[dict] | None:
+        ''' Notify several task status at once, returns an ack per task or None if the server was not reached '''
         raise NotImplemented()
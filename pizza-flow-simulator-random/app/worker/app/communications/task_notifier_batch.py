@@ -0,0 +1,184 @@
+''' Batching notification providers '''
+import asyncio
+from threading import Thread, Condition
+from typing import List, Tuple
+from .task_notifier_abs import TaskStatusNotifierProvider
+from .result_journal import ResultJournal
+from .backoff import backoff
+from models.task_execution import TaskExecution
+from config import NOTIFY_BATCH_SIZE, NOTIFY_BATCH_INTERVAL
+from logs import logger
+
+def acknowledge(journal: ResultJournal, batch: List[Tuple[int, TaskExecution]], acks: List[dict] | None) -> bool:
+    ''' Remove a sent batch from the journal, False if the server could not get it '''
+    if acks is None:
+        return False
+    for ack in acks:
+        if ack.get('status') != 'ok':
+            # Not retried: the lease of the task was lost or the task no longer exists
+            logger.error(f"Task {ack.get('uuid')} rejected by server: {ack.get('error')}")
+    journal.remove([row_id for row_id, _ in batch])
+    logger.debug(f"{len(batch)} task updates acknowledged by server")
+    return True
+
+class TaskStatusNotifierBatch(TaskStatusNotifierProvider):
+    '''
+    Journals the task updates and sends them with the batch method of another notifier,
+    when batch_size updates are queued or interval seconds after the first one. Claims are not batched.
+    Updates stay in the journal until the server acknowledges them, failed batches are retried with backoff
+    '''
+    def __init__(self, notifier: TaskStatusNotifierProvider, journal: ResultJournal | None = None,
+                 batch_size: int = NOTIFY_BATCH_SIZE, interval: float = NOTIFY_BATCH_INTERVAL):
+        self.notifier = notifier
+        self.journal = journal or ResultJournal()
+        self.batch_size = batch_size
+        self.interval = interval
+        self.condition = Condition()
+        self.stopping = False
+        self.replaying = False
+        self.failures = 0
+        queued = self.journal.count()
+        if queued:
+            logger.info(f"{queued} task updates of a previous run will be sent")
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def notify_status(self, execution: TaskExecution) -> bool:
+        ''' Journal the task status, never waits for the server '''
+        self.journal.append(execution)
+        with self.condition:
+            self.condition.notify()
+        return True
+
+    def claim(self, execution: TaskExecution) -> dict | None:
+        ''' Claim a task, the server has to answer right away '''
+        return self.notifier.claim(execution)
+
+    def replay(self) -> None:
+        ''' Send the journal right away, ie when the connection to the server is back '''
+        with self.condition:
+            self.replaying = True
+            self.condition.notify()
+
+    def run(self) -> None:
+        ''' Flush loop '''
+        while True:
+            with self.condition:
+                if not self.journal.count() and not self.stopping:
+                    self.condition.wait()
+                # Give the batch some time to fill
+                self.condition.wait_for(lambda: self.stopping or self.journal.count() >= self.batch_size, timeout=self.interval)
+                batch = self.journal.pending(self.batch_size)
+                if not batch and self.stopping:
+                    return
+            if not batch:
+                continue
+            if self.send(batch):
+                self.failures = 0
+                continue
+            if self.stopping:
+                logger.error(f"Server not reachable on shutdown, {self.journal.count()} task updates kept for the next run")
+                return
+            self.failures += 1
+            delay = backoff(self.failures)
+            logger.error(f"Error notifying {len(batch)} tasks. Will retry in {delay:.1f}s")
+            with self.condition:
+                self.replaying = False
+                self.condition.wait_for(lambda: self.replaying or self.stopping, timeout=delay)
+
+    def send(self, batch: List[Tuple[int, TaskExecution]]) -> bool:
+        ''' Send a batch of updates, False if the server could not get it '''
+        return acknowledge(self.journal, batch, self.notifier.notify_batch([execution for _, execution in batch]))
+
+    def stop(self, timeout: float = 10) -> None:
+        ''' Send the journaled updates and stop '''
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        self.thread.join(timeout)
+
+class TaskStatusNotifierBatchAsync(TaskStatusNotifierProvider):
+    '''
+    TaskStatusNotifierBatch of the asyncio runtime, over the coroutines of another notifier.
+    The flush loop runs as an asyncio task, start it from the event loop
+    '''
+    def __init__(self, notifier: TaskStatusNotifierProvider, journal: ResultJournal | None = None,
+                 batch_size: int = NOTIFY_BATCH_SIZE, interval: float = NOTIFY_BATCH_INTERVAL):
+        self.notifier = notifier
+        self.journal = journal or ResultJournal()
+        self.batch_size = batch_size
+        self.interval = interval
+        self.condition = asyncio.Condition()
+        self.stopping = False
+        self.replaying = False
+        self.failures = 0
+        self.runner = None
+        queued = self.journal.count()
+        if queued:
+            logger.info(f"{queued} task updates of a previous run will be sent")
+
+    def start(self) -> None:
+        ''' Start the flush loop '''
+        self.runner = asyncio.get_running_loop().create_task(self.run())
+
+    async def notify_status(self, execution: TaskExecution) -> bool:
+        ''' Journal the task status, never waits for the server '''
+        self.journal.append(execution)
+        async with self.condition:
+            self.condition.notify()
+        return True
+
+    async def claim(self, execution: TaskExecution) -> dict | None:
+        ''' Claim a task, the server has to answer right away '''
+        return await self.notifier.claim(execution)
+
+    async def replay(self) -> None:
+        ''' Send the journal right away, ie when the connection to the server is back '''
+        async with self.condition:
+            self.replaying = True
+            self.condition.notify()
+
+    async def wait_for(self, predicate, timeout: float) -> None:
+        ''' Wait until predicate is true, for up to timeout seconds '''
+        try:
+            await asyncio.wait_for(self.condition.wait_for(predicate), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self) -> None:
+        ''' Flush loop '''
+        while True:
+            async with self.condition:
+                if not self.journal.count() and not self.stopping:
+                    await self.condition.wait()
+                # Give the batch some time to fill
+                await self.wait_for(lambda: self.stopping or self.journal.count() >= self.batch_size, self.interval)
+                batch = self.journal.pending(self.batch_size)
+                if not batch and self.stopping:
+                    return
+            if not batch:
+                continue
+            if acknowledge(self.journal, batch, await self.notifier.notify_batch([execution for _, execution in batch])):
+                self.failures = 0
+                continue
+            if self.stopping:
+                logger.error(f"Server not reachable on shutdown, {self.journal.count()} task updates kept for the next run")
+                return
+            self.failures += 1
+            delay = backoff(self.failures)
+            logger.error(f"Error notifying {len(batch)} tasks. Will retry in {delay:.1f}s")
+            async with self.condition:
+                self.replaying = False
+                await self.wait_for(lambda: self.replaying or self.stopping, delay)
+
+    async def stop(self, timeout: float = 10) -> None:
+        ''' Send the journaled updates and stop '''
+        if not self.runner:
+            return
+        async with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        try:
+            await asyncio.wait_for(self.runner, timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Timeout sending the task updates on shutdown, {self.journal.count()} kept for the next run")
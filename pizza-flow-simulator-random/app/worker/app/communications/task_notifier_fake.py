@@ -3,11 +3,23 @@ from communications.task_notifier_abs import TaskStatusNotifierProvider
 from models.task_execution import TaskExecution
 from logs import logger
 import json
+from typing import List
 
 class TaskStatusNotifierFake(TaskStatusNotifierProvider):
     ''' Fake task notififcation provider '''
-    def notify_status(self, execution: TaskExecution) -> None:
+    def notify_status(self, execution: TaskExecution) -> bool:
         ''' Notify the task status '''
         logger.info(f'Notifying task {execution.task_id} with status {execution.status}')
         logger.debug(f'Execution details: {json.dumps(execution.model_dump(), indent=4)}')
-        
\ No newline at end of file
+        return True
+
+    def claim(self, execution: TaskExecution) -> dict | None:
+        ''' Claim a task, always granted '''
+        logger.info(f'Claiming task {execution.task_id}')
+        return {"status": "ok", "lease_token": (execution.lease_token or 0) + 1}
+
+    def notify_batch(self, executions: List[TaskExecution]) -> List[dict] | None:
+        ''' Notify several task status at once '''
+        for execution in executions:
+            self.notify_status(execution)
+        return [{"uuid": x.uuid, "status": "ok"} for x in executions]
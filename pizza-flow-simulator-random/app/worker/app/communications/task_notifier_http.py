@@ -3,16 +3,16 @@ from communications.task_notifier_abs import TaskStatusNotifierProvider
 from models.task_execution import TaskExecution
 from logs import logger
 import json
-import requests
-import time
-from config import SERVER_URL, WORKER_TOKEN
+from typing import List
+from interfaces.http import session
+from config import SERVER_URL, WORKER_TOKEN, REQUEST_TIMEOUT
 
 def send_task_result_http(task: TaskExecution) -> None:
     ''' Send task result to the server '''
     logger.debug(f"Sending task result to {SERVER_URL}")
     try:
         auth_headers = {'Authorization': f'Bearer {WORKER_TOKEN}'}
-        sr = requests.post(f"{SERVER_URL}/api/worker/task/{task.uuid}", json=task.model_dump(), headers=auth_headers)
+        sr = session.post(f"{SERVER_URL}/api/worker/task/{task.uuid}", json=task.model_dump(), headers=auth_headers, timeout=REQUEST_TIMEOUT)
         if sr.status_code != 200:
             logger.error(f"Error sending task result: {sr.status_code}")
         return sr.json()
@@ -27,18 +27,58 @@ class TaskStatusNotifierHTTP(TaskStatusNotifierProvider):
         self.server_url = server_url
         self.auth_token = auth_token
 
-    def notify_status(self, execution: TaskExecution) -> None:
-        ''' Notify the task status '''
+    def notify_status(self, execution: TaskExecution) -> bool:
+        ''' Notify the task status once, retries are left to the journal of TaskStatusNotifierBatch '''
         logger.info(f'Notifying task {execution.task_id}')
         logger.debug(f'Execution details: {json.dumps(execution.model_dump(), indent=4)}')
         auth_headers = {'Authorization': f'Bearer {self.auth_token}'}
-        sr = requests.post(
-            f"{self.server_url}/api/worker/task/{execution.uuid}",
-            headers=auth_headers,
-            json=execution.model_dump())
+        try:
+            sr = session.post(
+                f"{self.server_url}/api/worker/task/{execution.uuid}",
+                headers=auth_headers,
+                json=execution.model_dump(),
+                timeout=REQUEST_TIMEOUT)
+        except Exception as e:
+            logger.error(f"Error notifying task: {execution.task_id} {e}")
+            return False
+        if sr.status_code == 409:
+            # Another worker claimed the task after our lease expired
+            logger.error(f"Task {execution.task_id} rejected by server: {sr.text}")
+            return True
         if sr.status_code != 200:
-            logger.error(f"Error notifying task: {sr.status_code} {sr.text}. Will retry in 30s")
-            time.sleep(30)
-            self.notify_status(execution)
-        else:
-            logger.debug(f"Task {execution.task_id} acknowledged by server")
+            logger.error(f"Error notifying task: {execution.task_id} {sr.status_code} {sr.text}")
+            return False
+        logger.debug(f"Task {execution.task_id} acknowledged by server")
+        return True
+
+    def claim(self, execution: TaskExecution) -> dict | None:
+        ''' Claim a task, returns the response of the server '''
+        auth_headers = {'Authorization': f'Bearer {self.auth_token}'}
+        try:
+            sr = session.post(
+                f"{self.server_url}/api/worker/task/{execution.uuid}",
+                headers=auth_headers,
+                json=execution.model_dump(),
+                timeout=REQUEST_TIMEOUT)
+            return sr.json()
+        except Exception as e:
+            logger.error(f"Error claiming task: {execution.task_id} {e}")
+            return None
+
+    def notify_batch(self, executions: List[TaskExecution]) -> List[dict] | None:
+        ''' Notify several task status with a single request '''
+        logger.info(f'Notifying {len(executions)} tasks')
+        auth_headers = {'Authorization': f'Bearer {self.auth_token}'}
+        try:
+            sr = session.post(
+                f"{self.server_url}/api/worker/tasks/results",
+                headers=auth_headers,
+                json=[x.model_dump() for x in executions],
+                timeout=REQUEST_TIMEOUT)
+            if sr.status_code != 200:
+                logger.error(f"Error notifying tasks: {sr.status_code} {sr.text}")
+                return None
+            return sr.json()['results']
+        except Exception as e:
+            logger.error(f"Error notifying tasks: {e}")
+            return None
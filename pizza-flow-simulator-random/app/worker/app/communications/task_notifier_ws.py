@@ -1,10 +1,21 @@
 ''' Websockets notififcation provider '''
 from .task_notifier_abs import TaskStatusNotifierProvider
 from models.task_execution import TaskExecution
-from typing import Any
+from typing import Any, List
 import json
 from logs import logger
-import time
+from config import REQUEST_TIMEOUT
+
+def acknowledged(execution: TaskExecution, ack: dict | None) -> bool:
+    ''' Whether the server got the update, rejected updates are not sent again '''
+    if not isinstance(ack, dict):
+        return False
+    if ack.get('status') != 'ok':
+        # The lease of the task was lost or the task no longer exists
+        logger.error(f"Task {execution.task_id} rejected by server: {ack.get('error')}")
+    else:
+        logger.debug(f"Task {execution.task_id} acknowledged by server")
+    return True
 
 class TaskStatusNotifierWS(TaskStatusNotifierProvider):
     ''' Websockets notififcation provider '''
@@ -12,15 +23,63 @@ class TaskStatusNotifierWS(TaskStatusNotifierProvider):
     def __init__(self, ws: Any):
         self.ws = ws
 
-    def notify_status(self, execution: TaskExecution) -> None:
-        ''' Notify the task status '''
+    def notify_status(self, execution: TaskExecution) -> bool:
+        ''' Notify the task status once, retries are left to the journal of TaskStatusNotifierBatch '''
         logger.info(f'Notifying task {execution.task_id}')
         logger.debug(f'Execution details: {json.dumps(execution.model_dump(), indent=4)}')
-        def callback(*args):
-            logger.debug(f"Task {execution.task_id} acknowledged by server with {args}")
         try:
-            self.ws.emit('task_result', data=execution.model_dump(), namespace='/worker', callback=callback)
+            ack = self.ws.call('task_result', data=execution.model_dump(), namespace='/worker', timeout=REQUEST_TIMEOUT)
+        except Exception as e:
+            logger.error(f"Error notifying task: {execution.task_id} {e}")
+            return False
+        return acknowledged(execution, ack)
+
+    def claim(self, execution: TaskExecution) -> dict | None:
+        ''' Claim a task, returns the ack of the server '''
+        try:
+            return self.ws.call('task_result', data=execution.model_dump(), namespace='/worker', timeout=REQUEST_TIMEOUT)
+        except Exception as e:
+            logger.error(f"Error claiming task: {execution.task_id} {e}")
+            return None
+
+    def notify_batch(self, executions: List[TaskExecution]) -> List[dict] | None:
+        ''' Notify several task status with a single acknowledged message '''
+        logger.info(f'Notifying {len(executions)} tasks')
+        try:
+            return self.ws.call('task_results', data=[x.model_dump() for x in executions], namespace='/worker', timeout=REQUEST_TIMEOUT)['results']
+        except Exception as e:
+            logger.error(f"Error notifying tasks: {e}")
+            return None
+
+
+class TaskStatusNotifierWSAsync(TaskStatusNotifierProvider):
+    ''' Websockets notififcation provider of the asyncio runtime '''
+    def __init__(self, ws: Any):
+        self.ws = ws
+
+    async def notify_status(self, execution: TaskExecution) -> bool:
+        ''' Notify the task status once, retries are left to the journal of TaskStatusNotifierBatchAsync '''
+        logger.info(f'Notifying task {execution.task_id}')
+        try:
+            ack = await self.ws.call('task_result', data=execution.model_dump(), namespace='/worker', timeout=REQUEST_TIMEOUT)
+        except Exception as e:
+            logger.error(f"Error notifying task: {execution.task_id} {e}")
+            return False
+        return acknowledged(execution, ack)
+
+    async def claim(self, execution: TaskExecution) -> dict | None:
+        ''' Claim a task, returns the response of the server '''
+        try:
+            return await self.ws.call('task_result', data=execution.model_dump(), namespace='/worker', timeout=REQUEST_TIMEOUT)
+        except Exception as e:
+            logger.error(f"Error claiming task: {execution.task_id} {e}")
+            return None
+
+    async def notify_batch(self, executions: List[TaskExecution]) -> List[dict] | None:
+        ''' Notify several task status with a single acknowledged message '''
+        logger.info(f'Notifying {len(executions)} tasks')
+        try:
+            return (await self.ws.call('task_results', data=[x.model_dump() for x in executions], namespace='/worker', timeout=REQUEST_TIMEOUT))['results']
         except Exception as e:
-            logger.error(f"Error notifying task: {execution.task_id} {e}. Will retry in 30s")
-            time.sleep(30)
-            self.notify_status(execution)
+            logger.error(f"Error notifying tasks: {e}")
+            return None
@@ -5,6 +5,6 @@ from typing import List
 
 class TaskRetrieverProvider(ABC):
     ''' Abstract class to retrieve tasks '''
-    def get_tasks(self) -> List[Task]:
-        ''' Get tasks from the provider '''
+    def get_tasks(self, credits: int | None = None) -> List[Task]:
+        ''' Get tasks from the provider, at most credits of them '''
         raise NotImplemented()
@@ -86,7 +86,7 @@ class TaskRetrieverFake(TaskRetrieverProvider):
     def __init__(self, registry: Any) -> None:
         self.registry = registry
     
-    def get_tasks(self) -> List[Task]:
+    def get_tasks(self, credits: int | None = None) -> List[Task]:
         ''' Get tasks from the provider '''
         tasks = []
         fns = [gen_create_ns, gen_db_service, gen_db_disk, gen_db_secret, gen_db_create_db, gen_db_wait_task, gen_db_user_task]
@@ -101,4 +101,4 @@ class TaskRetrieverFake(TaskRetrieverProvider):
             except NotImplementedError:
                 logger.error(f'No task found with id {task_id}')
                 continue
-        return tasks
+        return tasks[:credits]
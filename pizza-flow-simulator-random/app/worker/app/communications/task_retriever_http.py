@@ -1,9 +1,10 @@
 ''' Task Retriever HTTP module '''
 from typing import List, Any
-import requests
+from interfaces.http import session
+from config import REQUEST_TIMEOUT
 from .task_retriever_abs import TaskRetrieverProvider
 from models.tasks import Task
-from models.task_execution import TaskExecution
+from models.task_execution import TaskExecution, executions_adapter
 from logs import logger
 
 
@@ -17,32 +18,31 @@ class TaskRetrieverHTTP(TaskRetrieverProvider):
         self.registry = registry
         self.auth_token = auth_token
 
-    def pull_tasks(self) -> List[TaskExecution]:
+    def pull_tasks(self, credits: int | None = None) -> List[TaskExecution]:
         ''' Pull tasks from the provider '''
         logger.debug("Pulling remote tasks")
         try:
             auth_headers = {'Authorization': f'Bearer {self.auth_token}'}
-            sr = requests.get(f"{self.server_url}/api/worker/tasks", headers=auth_headers)
+            params = {'credits': credits} if credits is not None else None
+            sr = session.get(f"{self.server_url}/api/worker/tasks", headers=auth_headers, params=params, timeout=REQUEST_TIMEOUT)
             if sr.status_code != 200:
                 logger.error(f"Error pulling tasks: {sr.status_code}")
                 return []
             response = sr.json()
-            tasks = [TaskExecution(**task) for task in response['tasks']]
+            tasks = executions_adapter.validate_python(response['tasks'])
             return tasks
         except Exception as e:
             logger.error(f"Error pulling tasks: {e}")
             return []
 
-    def get_tasks(self) -> List[Task]:
-        ''' Get tasks from the provider '''
+    def get_tasks(self, credits: int | None = None) -> List[Task]:
+        ''' Get tasks from the provider, at most credits of them '''
         logger.debug("Getting remote tasks")
-        requests = self.pull_tasks()
+        requests = self.pull_tasks(credits)
         rd = []
         for request in requests:
             try:
-                task_class = self.registry.get_task_with_id(request.task_id)
-                task = task_class(request)
-                rd.append(task)
+                rd.append(self.registry.create_task(request))
             except NotImplementedError as e:
-                logger.error(f"No task handler found with id {request.task_id}")
+                logger.error(f"No task handler found: {e}")
         return rd
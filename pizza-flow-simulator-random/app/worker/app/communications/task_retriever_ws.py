@@ -18,42 +18,36 @@ class TaskRetrieverWS(TaskRetrieverProvider):
         sio.on('task', self.on_task, namespace='/worker')
         self.ws = sio
 
-    def get_tasks(self):
-        ''' Get tasks from the provider '''
-        self.ws.emit('get_tasks', namespace='/worker')
+    def get_tasks(self, credits: int | None = None, callback=None, limits: dict | None = None):
+        '''
+        Ask the server for tasks, at most credits of them and of each handler in limits (ie the free ovens for bake_pizza).
+        callback gets the acknowledgement
+        '''
+        self.ws.emit('get_tasks', data={'credits': credits, 'limits': limits}, namespace='/worker', callback=callback)
 
     def on_task(self, task):
         logger.debug(f"[WS] Received task from the server: {task}")
         try:
-            task_execution = TaskExecution(**task)
+            task_execution = TaskExecution.model_validate(task)
             if task_execution.region != AWS_DEFAULT_REGION:
                 logger.debug(f"Task {task_execution.task_id} is not for this region, discarded")
                 return
-                
-            # Map task_id values to task identifiers
-            task_id_to_name = {
-                '1': 'make_dough',
-                '2': 'add_toppings',
-                '3': 'bake_pizza',
-                '4': 'deliver_pizza'
-            }
-            
-            # Get the task name from the mapping
-            task_name = task_id_to_name.get(task_execution.task_id)
-            if not task_name:
-                logger.error(f"Unknown task_id: {task_execution.task_id}")
-                return
-            
-            # Get the task from registry using the name
-            task_class = self.registry.get_task_with_id(task_name)
-            rt = task_class(task_execution)
-            
+            rt = self.registry.create_task(task_execution)
             if self.task_callback:
                 self.task_callback(rt)
             else:
                 self.pending_tasks.append(rt)
+        except NotImplementedError as e:
+            logger.error(f"No task handler found: {e}, discarded")
         except Exception as e:
             logger.error(f"Error processing task: {e}, discarded")
 
     def set_callback(self, callback):
-        self.task_callback = callback
\ No newline at end of file
+        self.task_callback = callback
+
+class TaskRetrieverWSAsync(TaskRetrieverWS):
+    ''' Task Retriever of the asyncio runtime '''
+
+    async def get_tasks(self, credits: int | None = None, callback=None, limits: dict | None = None):
+        ''' Ask the server for tasks, at most credits of them and of each handler in limits. callback gets the acknowledgement '''
+        await self.ws.emit('get_tasks', data={'credits': credits, 'limits': limits}, namespace='/worker', callback=callback)
@@ -3,6 +3,22 @@ SERVER_URL = os.getenv("SERVER_URL", "http://localhost:8080")
 WORKER_TOKEN = os.getenv("AUTH_TOKEN")
 PUBLIC_IP = os.getenv("PUBLIC_IP")
 AWS_DEFAULT_REGION = os.getenv("AWS_DEFAULT_REGION", "us-east-2")
+WORKER_RUNTIME = os.getenv("WORKER_RUNTIME", "threads") # threads or asyncio
+ASYNC_CONCURRENCY = int(os.getenv("ASYNC_CONCURRENCY", "1000")) # Tasks executed at once by the asyncio runtime
+ASYNC_THREADS = int(os.getenv("ASYNC_THREADS", "32")) # Threads running the sync tasks in the asyncio runtime
+MIN_THREADS = int(os.getenv("MIN_THREADS", "2"))   # Size limits of the threads runtime pool
+MAX_THREADS = int(os.getenv("MAX_THREADS", "32"))
+QUEUE_LATENCY_TARGET = float(os.getenv("QUEUE_LATENCY_TARGET", "0.5")) # Seconds a task can wait for a thread before the pool grows
+CPU_LIMIT = float(os.getenv("CPU_LIMIT", "0.8"))   # The pool does not grow above this share of the CPUs
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "10")) # Seconds to wait for the server to answer a request or a claim
+NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", "50")) # Task updates sent at once, 1 sends them one by one
+NOTIFY_BATCH_INTERVAL = float(os.getenv("NOTIFY_BATCH_INTERVAL", "0.2")) # Seconds an update waits for the batch to fill
+RESULTS_JOURNAL = os.getenv("RESULTS_JOURNAL", "results_journal.db") # SQLite file keeping the task updates until the server gets them
+RESULTS_CACHE_SIZE = int(os.getenv("RESULTS_CACHE_SIZE", "10000")) # Results of finished tasks kept to answer the tasks sent again
+RESULTS_CACHE_TTL = float(os.getenv("RESULTS_CACHE_TTL", "600"))  # Seconds the results are kept
+OVEN_CAPACITY = int(os.getenv("OVEN_CAPACITY", "3")) # Pizzas the worker can bake at once
+PIZZAIOLO_CAPACITY = int(os.getenv("PIZZAIOLO_CAPACITY", os.getenv("MAX_THREADS", "32"))) # Pizzaiolos of the worker
+PROCESS_POOL_SIZE = int(os.getenv("PROCESS_POOL_SIZE", "0")) or None # Processes running the CPU bound tasks, one per CPU by default
 METAPILOT_TOKEN = os.getenv("METAPILOT_TOKEN")
 
 BACKUP_BUCKET = os.getenv("BACKUP_BUCKET", "collate-saas-provisioner-us-east-2")
@@ -0,0 +1,9 @@
+import requests
+from requests.adapters import HTTPAdapter
+from config import MAX_THREADS
+
+# Keep-alive connections to the server, shared by all the threads
+session = requests.Session()
+adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_THREADS)
+session.mount('http://', adapter)
+session.mount('https://', adapter)
@@ -1,40 +1,48 @@
 import time
+from threading import Lock
 from logs import logger
+from .resources import ovens
 
 _pizzas_baking = {}
+_lock = Lock()
 
 class AsyncOven():
-    ''' Represents an oven '''
+    ''' Represents the ovens of the worker, a baking pizza holds one of their slots '''
     def __init__(self):
         pass
 
-    def bake(self, pizza_name: str, temperature: int, time_to_bake: int) -> str:
-        ''' Bake the pizza '''
-        if pizza_name in _pizzas_baking:
-            raise Exception('Already baking')
-        if len(_pizzas_baking) >= 3:
+    def bake(self, pizza_name: str, temperature: int, time_to_bake: int, timeout: float | None = 0) -> str:
+        ''' Bake the pizza, in the slot reserved for it or waiting in turn up to timeout seconds for one '''
+        with _lock:
+            if pizza_name in _pizzas_baking:
+                raise Exception('Already baking')
+        if not ovens.acquire(pizza_name, timeout):
             raise Exception('Oven is full')
-        _pizzas_baking[pizza_name] = {
-            'temperature': temperature,
-            'time_to_bake': time_to_bake,
-            'start_time': time.time()
-        }
+        with _lock:
+            _pizzas_baking[pizza_name] = {
+                'temperature': temperature,
+                'time_to_bake': time_to_bake,
+                'start_time': time.time()
+            }
         logger.info(f'Baking pizza {pizza_name} at {temperature} degrees for {time_to_bake} seconds')
         return 'done'
     
     def check(self, pizza_name: str) -> str:
         ''' Check the pizza '''
-        if pizza_name not in _pizzas_baking:
-            raise Exception('Pizza not baking')
-        pizza = _pizzas_baking[pizza_name]
+        with _lock:
+            if pizza_name not in _pizzas_baking:
+                raise Exception('Pizza not baking')
+            pizza = _pizzas_baking[pizza_name]
         elapsed_time = time.time() - pizza['start_time']
         if elapsed_time < pizza['time_to_bake']:
             return 'baking'
         return 'done'
     
     def remove(self, pizza_name: str) -> str:
-        ''' Remove the pizza '''
-        if pizza_name not in _pizzas_baking:
-            raise Exception('Pizza not baking')
-        del _pizzas_baking[pizza_name]
-        return 'removed'
\ No newline at end of file
+        ''' Remove the pizza, its slot is free again '''
+        with _lock:
+            if pizza_name not in _pizzas_baking:
+                raise Exception('Pizza not baking')
+            del _pizzas_baking[pizza_name]
+        ovens.release(pizza_name)
+        return 'removed'
@@ -0,0 +1,103 @@
+''' Resources of the worker shared by the tasks: ovens and pizzaiolos '''
+from collections import deque
+from threading import Condition
+from typing import Dict
+from config import OVEN_CAPACITY, PIZZAIOLO_CAPACITY
+
+class ResourcePool():
+    '''
+    Slots of a resource, each held by a key (ie a task uuid). Thread safe.
+    Callers waiting for a slot are served in arrival order, and reserve never takes a slot ahead of them
+    '''
+    def __init__(self, name: str, capacity: int):
+        self.name = name
+        self.capacity = capacity
+        self.holders = set()
+        self.queue = deque() # Tickets of the callers waiting for a slot
+        self.condition = Condition()
+
+    def reserve(self, key: str) -> bool:
+        ''' Take a slot without waiting, False if none is free '''
+        with self.condition:
+            if key in self.holders:
+                return True
+            if self.queue or len(self.holders) >= self.capacity:
+                return False
+            self.holders.add(key)
+            return True
+
+    def acquire(self, key: str, timeout: float | None = None) -> bool:
+        ''' Wait in turn up to timeout seconds for a slot '''
+        with self.condition:
+            if key in self.holders:
+                return True
+            ticket = object()
+            self.queue.append(ticket)
+            try:
+                acquired = self.condition.wait_for(lambda: self.queue[0] is ticket and len(self.holders) < self.capacity, timeout)
+                if acquired:
+                    self.holders.add(key)
+                return acquired
+            finally:
+                self.queue.remove(ticket)
+                self.condition.notify_all()
+
+    def release(self, key: str) -> None:
+        ''' Free the slot of a key, if it holds one '''
+        with self.condition:
+            if key in self.holders:
+                self.holders.discard(key)
+                self.condition.notify_all()
+
+    def holds(self, key: str) -> bool:
+        ''' Whether the key holds a slot '''
+        with self.condition:
+            return key in self.holders
+
+    def free(self) -> int:
+        ''' Slots nobody holds or waits for '''
+        with self.condition:
+            return max(0, self.capacity - len(self.holders) - len(self.queue))
+
+    def utilization(self) -> dict:
+        ''' Usage of the resource '''
+        with self.condition:
+            in_use = len(self.holders)
+            return {
+                'capacity': self.capacity,
+                'in_use': in_use,
+                'queued': len(self.queue),
+                'utilization': in_use / self.capacity if self.capacity else 1.0,
+            }
+
+ovens = ResourcePool('oven', OVEN_CAPACITY)
+pizzaiolos = ResourcePool('pizzaiolo', PIZZAIOLO_CAPACITY)
+pools = {pool.name: pool for pool in (ovens, pizzaiolos)}
+
+def reserve(task) -> bool:
+    ''' Reserve all the resources a task needs, or none of them '''
+    key = task.execution.uuid
+    taken = []
+    for name in task.resources:
+        if not pools[name].reserve(key):
+            for pool in taken:
+                pool.release(key)
+            return False
+        taken.append(pools[name])
+    return True
+
+def release(task) -> None:
+    ''' Free the resources of a task '''
+    for name in task.resources:
+        pools[name].release(task.execution.uuid)
+
+def handler_limits(registry) -> Dict[str, int]:
+    ''' Tasks of each handler needing resources the worker can accept right now '''
+    return {
+        identifier: min(pools[name].free() for name in task_class.resources)
+        for identifier, task_class in registry.registry.items() if task_class.resources
+    }
+
+def utilization() -> Dict[str, dict]:
+    ''' Usage of all the resources '''
+    return {name: pool.utilization() for name, pool in pools.items()}
@@ -1,8 +1,14 @@
 import socketio
 
 sio = socketio.Client()
+async_sio = socketio.AsyncClient() # Client of the asyncio runtime
 
 def connect_ws(server_url: str, auth_token: str):
     ''' Connect to the server '''
     sio.connect(server_url, auth={'token': auth_token}, socketio_path='/ws/socket.io', namespaces=['/worker'])
     return sio
+
+async def connect_ws_async(server_url: str, auth_token: str):
+    ''' Connect to the server with the asyncio client '''
+    await async_sio.connect(server_url, auth={'token': auth_token}, socketio_path='/ws/socket.io', namespaces=['/worker'])
+    return async_sio
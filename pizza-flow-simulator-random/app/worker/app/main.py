@@ -1,5 +1,6 @@
 import schedule
 import time
+import asyncio
 import signal, sys
 from queue import Empty
 from models.task_execution import TaskExecution
@@ -7,46 +8,64 @@ from models.tasks import Task
 from logs import logger
 from tasks import registry
 import interfaces
-from threads import tasks_queue, results_queue, start_threads, stop_threads
+from threads import tasks_queue, results_queue, start_threads, stop_threads, submit, free_capacity, on_capacity, pulled
+from config import SERVER_URL, WORKER_TOKEN, WORKER_RUNTIME
+
+task_notifier = None
 
 def signal_handler(sig, frame):
     logger.error(f'Received {sig}, exiting.')
     stop_threads()
+    if task_notifier:
+        task_notifier.stop()
     sys.exit(0)
 
-signal.signal(signal.SIGTERM, signal_handler)
-signal.signal(signal.SIGINT, signal_handler)
-
-
-from communications.task_retriever_ws import TaskRetrieverWS
-from communications.task_notifier_ws import TaskStatusNotifierWS
-from interfaces.ws import connect_ws
-from config import SERVER_URL, WORKER_TOKEN
-ws = connect_ws(SERVER_URL, WORKER_TOKEN)
-task_notifier = TaskStatusNotifierWS(ws)
-task_retriever = TaskRetrieverWS(registry=registry, sio=ws)
-
 def on_new_ws_job(task: Task):
-    tasks_queue.put(task)
+    # Called from the socket thread, never blocks
+    if not submit(task):
+        logger.debug(f"Task {task.execution.uuid} refused, no free capacity")
+        return
     logger.debug(f"Task {task.execution.uuid} added to the queue. Queue size: {tasks_queue.qsize()}")
 
-task_retriever.set_callback(on_new_ws_job)
-
 def refresh_token():
     if interfaces.k8s_provider:
         logger.debug("Refreshing k8s session")
         interfaces.k8s_provider.refresh_session()
 
-if __name__ == '__main__':
-    logger.info("Starting the worker")
-    start_threads()
+def run_threads():
+    ''' Run the worker with a pool of threads '''
+    from communications.task_retriever_ws import TaskRetrieverWS
+    from communications.task_notifier_ws import TaskStatusNotifierWS
+    from communications.task_notifier_batch import TaskStatusNotifierBatch
+    from interfaces.ws import connect_ws
+    from interfaces.resources import handler_limits
+    signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGINT, signal_handler)
+    global task_notifier
+    ws = connect_ws(SERVER_URL, WORKER_TOKEN)
+    # Updates go through the journal, sent again when the connection is back
+    task_notifier = TaskStatusNotifierBatch(TaskStatusNotifierWS(ws))
+    ws.on('connect', task_notifier.replay, namespace='/worker')
+    task_retriever = TaskRetrieverWS(registry=registry, sio=ws)
+    task_retriever.set_callback(on_new_ws_job)
+    on_capacity(lambda credits: task_retriever.get_tasks(credits, callback=pulled, limits=handler_limits(registry)))
+    start_threads(claim_with=task_notifier.claim)
     logger.info(f"Task capabilities: {registry.get_tasks()}")
-    task_retriever.get_tasks()
+    task_retriever.get_tasks(free_capacity(), callback=pulled, limits=handler_limits(registry))
     while True:
         schedule.run_pending()
         try:
-            rq = results_queue.get(block=False)
+            # Results are journaled and sent in batches by the notifier
+            rq = results_queue.get(timeout=0.5)
             if isinstance(rq, TaskExecution):
                 task_notifier.notify_status(rq)
         except Empty:
-            time.sleep(0.5)
\ No newline at end of file
+            pass
+
+if __name__ == '__main__':
+    logger.info(f"Starting the worker with the {WORKER_RUNTIME} runtime")
+    if WORKER_RUNTIME == 'asyncio':
+        from runtime_async import run
+        asyncio.run(run())
+    else:
+        run_threads()
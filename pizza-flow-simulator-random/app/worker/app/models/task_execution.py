@@ -1,4 +1,5 @@
-from pydantic import BaseModel, field_serializer
+from pydantic import BaseModel, TypeAdapter, field_serializer
+from typing import List
 from enum import StrEnum
 import datetime
 
@@ -13,6 +14,7 @@ class TaskStatus(StrEnum):
 class TaskExecution(BaseModel):
     ''' Task Execution model '''
     task_id: str
+    task: str | None = None # Identifier of the task handler, ie make_dough
     uuid: str
     operation_id: str | None = None
     region: str
@@ -27,10 +29,14 @@ class TaskExecution(BaseModel):
     last_refresh: datetime.datetime | None = None
     wait_time: int | None = None
     max_wait_time: int | None = None
+    lease_token: int = 0 # Returned by the server when claiming the task, sent back with every update
 
     @field_serializer("started_at", "completed_at", "last_refresh")
     def serialize_time(self, value):
         ''' Serialize the time fields '''
         if value is None:
             return None
-        return value.isoformat()
\ No newline at end of file
+        return value.isoformat()
+
+# Validator of the lists of tasks sent by the server, built once
+executions_adapter = TypeAdapter(List[TaskExecution])
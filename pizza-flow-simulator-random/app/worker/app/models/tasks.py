@@ -2,6 +2,7 @@
 from communications.task_notifier_abs import TaskStatusNotifierProvider
 from communications.task_notifier_http import send_task_result_http
 from .task_execution import TaskExecution, TaskStatus
+import asyncio
 import datetime
 import traceback
 from logs import logger
@@ -12,6 +13,9 @@ class Task:
     parameters: dict | None = {}
     max_retries: int | None = None
     notifier: TaskStatusNotifierProvider | None = None
+    waits: int = 0 # Checks done while in waiting status
+    process: bool = False # Run in the process pool, for CPU bound tasks
+    resources: tuple = () # Resources reserved before accepting the task, see interfaces.resources
 
     def __init__(self, execution: TaskExecution = None):
         ''' Initialize the task '''
@@ -19,22 +23,32 @@ class Task:
             self.execution = execution
             self.parameters = execution.parameters
             
-    def execute(self, notifier: TaskStatusNotifierProvider = None) -> TaskExecution:
-        ''' Execute the task '''
+    def execute(self, notifier: TaskStatusNotifierProvider = None, claim = None) -> TaskExecution | None:
+        '''
+        Execute the task, claim sends the claim to the server, by default over the transport of the notifier.
+        None if the server refused the claim or it failed: the task is not ours, nothing to report
+        '''
         self.notifier = notifier
         logger.info(f'Executing task {self.identifier}. Parameters: {self.execution.parameters}')
         logger.info(f'Current status: {self.execution.status}')
         logger.info(f'Result: {self.execution.result}')
         # If the task is pending, check if it can be executed
-        if self.execution.status == TaskStatus.pending:
+        resume = self.execution.status == TaskStatus.pending_wait
+        if self.execution.status in (TaskStatus.pending, TaskStatus.pending_wait):
             self.execution.status = TaskStatus.running
             self.execution.started_at = datetime.datetime.now()
-            result = send_task_result_http(self.execution)
-            try:
-                if result['status'] != 'ok':
-                    raise Exception(f"Assigning task in progress: {result['status']}")
-            except Exception as e:
-                return self.execution
+            # The claim goes over the transport of the notifier, on its open connection
+            claim = claim or (notifier.claim if notifier else send_task_result_http)
+            result = claim(self.execution)
+            if not result or result.get('status') != 'ok':
+                logger.info(f'Task {self.identifier} not claimed: {result}')
+                self.execution.status = TaskStatus.pending_wait if resume else TaskStatus.pending
+                self.execution.started_at = None
+                return None
+            self.execution.lease_token = result.get('lease_token', 0)
+            if resume:
+                # Claimed to check it, another worker was waiting on it
+                self.execution.status = TaskStatus.waiting
         try:
             if self.execution.status in (TaskStatus.waiting, TaskStatus.pending_wait):
                 self.execution = self.on_wait(self.execution)
@@ -42,7 +56,7 @@ class Task:
             else:
                 if not self.execution.started_at:
                     self.execution.started_at = datetime.datetime.now()
-                self.execution = self.run(self.execution)
+                self.execution = self.run_task(self.execution)
         except Exception as e:
             self.execution.error = str(e)
             self.execution.status = TaskStatus.errored
@@ -53,6 +67,46 @@ class Task:
             self.notify()
         return self.execution
     
+    async def execute_async(self, claim) -> TaskExecution | None:
+        ''' Execute the task in the asyncio runtime, claim is a coroutine sending the claim to the server. None if not claimed '''
+        logger.info(f'Executing task {self.identifier}. Parameters: {self.execution.parameters}')
+        resume = self.execution.status == TaskStatus.pending_wait
+        if self.execution.status in (TaskStatus.pending, TaskStatus.pending_wait):
+            self.execution.status = TaskStatus.running
+            self.execution.started_at = datetime.datetime.now()
+            result = await claim(self.execution)
+            if not result or result.get('status') != 'ok':
+                logger.info(f'Task {self.identifier} not claimed: {result}')
+                self.execution.status = TaskStatus.pending_wait if resume else TaskStatus.pending
+                self.execution.started_at = None
+                return None
+            self.execution.lease_token = result.get('lease_token', 0)
+            if resume:
+                # Claimed to check it, another worker was waiting on it
+                self.execution.status = TaskStatus.waiting
+        try:
+            if self.execution.status in (TaskStatus.waiting, TaskStatus.pending_wait):
+                self.execution = await self.on_wait_async(self.execution)
+                self.execution.last_refresh = datetime.datetime.now()
+            else:
+                if not self.execution.started_at:
+                    self.execution.started_at = datetime.datetime.now()
+                self.execution = await self.run_async(self.execution)
+        except Exception as e:
+            self.execution.error = str(e)
+            self.execution.status = TaskStatus.errored
+            logger.error(f'Error executing task {self.identifier}: {traceback.format_exc()}')
+        if self.execution.status == TaskStatus.completed or self.execution.status == TaskStatus.errored:
+            self.execution.completed_at = datetime.datetime.now()
+        return self.execution
+
+    def run_task(self, execution: TaskExecution) -> TaskExecution:
+        ''' Run the task in this thread, or in the process pool if the task opted in '''
+        if self.process:
+            from processes import get_process_pool, run_in_process
+            return get_process_pool().submit(run_in_process, type(self), execution).result()
+        return self.run(execution)
+
     def notify(self, execution: TaskExecution = None):
         ''' Send the task update to the server '''
         if not execution:
@@ -67,3 +121,14 @@ class Task:
     def on_wait(self, execution: TaskExecution) -> TaskExecution:
         ''' Check a task in waiting status '''
         return execution
+
+    # Asyncio runtime, override them with coroutines when the task does not block
+    async def run_async(self, execution: TaskExecution) -> TaskExecution:
+        ''' Run the task, by default run in the thread pool or in the process pool if the task opted in '''
+        if self.process:
+            from processes import get_process_pool, run_in_process
+            return await asyncio.get_running_loop().run_in_executor(get_process_pool(), run_in_process, type(self), execution)
+        return await asyncio.to_thread(self.run, execution)
+    async def on_wait_async(self, execution: TaskExecution) -> TaskExecution:
+        ''' Check a task in waiting status, by default in the thread pool '''
+        return await asyncio.to_thread(self.on_wait, execution)
@@ -0,0 +1,28 @@
+''' Process pool running the CPU bound tasks, see Task.process '''
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from models.task_execution import TaskExecution
+from config import PROCESS_POOL_SIZE
+from logs import logger
+
+process_pool = None
+
+def get_process_pool() -> ProcessPoolExecutor:
+    ''' Process pool, created on first use '''
+    global process_pool
+    if process_pool is None:
+        # forkserver, forking a process with threads running is not safe
+        process_pool = ProcessPoolExecutor(max_workers=PROCESS_POOL_SIZE, mp_context=multiprocessing.get_context('forkserver'))
+        logger.info(f"Process pool started with {process_pool._max_workers} processes")
+    return process_pool
+
+def run_in_process(task_class: type, execution: TaskExecution) -> TaskExecution:
+    ''' Run a task in a process of the pool, the class and the execution are pickled '''
+    return task_class(execution).run(execution)
+
+def shutdown_process_pool() -> None:
+    ''' Stop the processes of the pool '''
+    global process_pool
+    if process_pool is not None:
+        process_pool.shutdown(cancel_futures=True)
+        process_pool = None
@@ -0,0 +1,44 @@
+''' Cache of the results of the finished tasks '''
+import time
+from collections import OrderedDict
+from threading import Lock
+from models.task_execution import TaskExecution, TaskStatus
+from config import RESULTS_CACHE_SIZE, RESULTS_CACHE_TTL
+
+class ResultsCache():
+    '''
+    LRU cache of the recently finished executions by task uuid, entries expire after ttl seconds.
+    A task sent again by the server, ie after a reconnect, gets its result back without running again.
+    Only for the same run: a rerun increments retries and a claim by another worker the lease token
+    '''
+    def __init__(self, size: int = RESULTS_CACHE_SIZE, ttl: float = RESULTS_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict() # uuid -> (expiration, execution)
+        self.lock = Lock()
+
+    def put(self, execution: TaskExecution) -> None:
+        ''' Keep the result of a finished task '''
+        if execution.status not in (TaskStatus.completed, TaskStatus.errored):
+            return
+        with self.lock:
+            self.entries[execution.uuid] = (time.monotonic() + self.ttl, execution)
+            self.entries.move_to_end(execution.uuid)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def get(self, execution: TaskExecution) -> TaskExecution | None:
+        ''' Result of the same run of the task, if it finished recently '''
+        with self.lock:
+            entry = self.entries.get(execution.uuid)
+            if not entry:
+                return None
+            expiration, result = entry
+            same_run = result.retries == execution.retries and result.lease_token == execution.lease_token
+            if expiration < time.monotonic() or not same_run:
+                del self.entries[execution.uuid]
+                return None
+            self.entries.move_to_end(execution.uuid)
+            return result
+
+results_cache = ResultsCache()
@@ -0,0 +1,166 @@
+''' Asyncio runtime of the worker, enabled with WORKER_RUNTIME=asyncio '''
+import asyncio
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from models.task_execution import TaskStatus
+from models.tasks import Task
+from logs import logger
+from processes import shutdown_process_pool
+from results_cache import results_cache
+from interfaces import resources
+from config import SERVER_URL, WORKER_TOKEN, ASYNC_CONCURRENCY, ASYNC_THREADS
+
+class AsyncTaskRunner():
+    ''' Runs every task as an asyncio task, journaling each result as soon as it is produced '''
+
+    def __init__(self, notifier, concurrency: int = ASYNC_CONCURRENCY):
+        self.notifier = notifier
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.running = set()
+        self.waiting = {} # task uuid -> (timer, task)
+        self.owned = set() # uuids of the tasks of this worker, running or waiting
+        self.capacity_callback = None # Coroutine asking the server for tasks, with the free capacity as credits
+        self.missed = False # The server has tasks for us: tasks were refused or the last pull used all the credits
+        self.stopping = False
+
+    def free_capacity(self) -> int:
+        ''' Tasks the runner can accept right now, waiting tasks do not count '''
+        return max(0, self.concurrency - len(self.owned) + len(self.waiting))
+
+    def on_capacity(self, callback) -> None:
+        ''' Set the coroutine pulling tasks when the runner has capacity again '''
+        self.capacity_callback = callback
+
+    def pulled(self, response: dict | None = None) -> None:
+        ''' Acknowledgement of a pull, the server tells if it had more tasks than credits '''
+        if response and response.get('more'):
+            self.missed = True
+
+    def check_capacity(self, force: bool = False) -> None:
+        ''' Pull tasks if the server has some for us and at least half of the capacity is free, or any if forced '''
+        if not self.missed or not self.capacity_callback or self.stopping:
+            return
+        credits = self.free_capacity()
+        if credits > 0 and (force or credits * 2 >= self.concurrency):
+            self.missed = False
+            self.start(self.capacity_callback(credits))
+
+    def start(self, coroutine) -> None:
+        ''' Run a coroutine in the background, stop waits for it '''
+        job = asyncio.get_running_loop().create_task(coroutine)
+        self.running.add(job)
+        job.add_done_callback(self.running.discard)
+
+    def submit(self, task: Task) -> None:
+        ''' Run a task received from the server, or send again the result of a task already finished '''
+        uuid = task.execution.uuid
+        cached = results_cache.get(task.execution)
+        if cached:
+            logger.info(f"Task {cached.uuid} already {cached.status.value}, sending the result again")
+            self.start(self.notifier.notify_status(cached))
+            return
+        if uuid in self.owned:
+            # Sent again while we run or wait on it, ie after a reconnect
+            logger.debug(f"Task {uuid} already owned, ignored")
+            return
+        if not self.free_capacity() or not resources.reserve(task):
+            # Still pending in the server, pulled again when we have capacity
+            logger.debug(f"Task {uuid} refused, no free capacity or {'/'.join(task.resources)}")
+            self.missed = True
+            return
+        self.owned.add(uuid)
+        self.start(self.execute(task))
+
+    def forget(self, task: Task) -> None:
+        ''' The runner is done with the task '''
+        self.owned.discard(task.execution.uuid)
+        resources.release(task)
+        # Tasks refused for lack of resources may fit now
+        self.check_capacity(force=bool(task.resources))
+
+    async def execute(self, task: Task) -> None:
+        ''' Execute the task and send the result '''
+        async with self.semaphore:
+            res = await task.execute_async(self.notifier.claim)
+        if res is None:
+            # Not claimed, another worker has it or the server will hand it out again
+            self.forget(task)
+            return
+        if res.status == TaskStatus.waiting:
+            if res.max_wait_time and task.waits >= res.max_wait_time:
+                res.status = TaskStatus.errored
+                res.error = "Max wait time reached"
+            elif self.stopping:
+                res.status = TaskStatus.pending_wait # Another worker will keep checking it
+            else:
+                self.schedule(task)
+        logger.debug(f"Task {res.task_id} {res.status.value}")
+        results_cache.put(res)
+        await self.notifier.notify_status(res)
+        if res.status != TaskStatus.waiting:
+            self.forget(task)
+
+    def schedule(self, task: Task) -> None:
+        ''' Check a waiting task again after its wait_time '''
+        timer = asyncio.get_running_loop().call_later(task.execution.wait_time or 30, self.wake, task)
+        self.waiting[task.execution.uuid] = (timer, task)
+
+    def wake(self, task: Task) -> None:
+        ''' A waiting task is due '''
+        self.waiting.pop(task.execution.uuid, None)
+        task.waits += 1
+        # Still owned, with its resources reserved
+        self.start(self.execute(task))
+
+    async def stop(self) -> None:
+        ''' Give the waiting tasks back to the server and wait for the running ones '''
+        self.stopping = True
+        waiting, self.waiting = self.waiting, {}
+        for timer, task in waiting.values():
+            timer.cancel()
+            task.execution.status = TaskStatus.pending_wait
+            await self.notifier.notify_status(task.execution)
+            self.owned.discard(task.execution.uuid)
+            resources.release(task)
+        logger.info(f"Released {len(waiting)} waiting tasks, waiting for {len(self.running)} running tasks")
+        await asyncio.gather(*self.running, return_exceptions=True)
+        shutdown_process_pool()
+
+async def run() -> None:
+    ''' Run the worker until SIGTERM/SIGINT '''
+    from tasks import registry
+    from interfaces.ws import connect_ws_async
+    from communications.task_notifier_ws import TaskStatusNotifierWSAsync
+    from communications.task_notifier_batch import TaskStatusNotifierBatchAsync
+    from communications.task_retriever_ws import TaskRetrieverWSAsync
+    loop = asyncio.get_running_loop()
+    # Sync tasks run in this pool
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=ASYNC_THREADS))
+    stopping = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+
+    ws = await connect_ws_async(SERVER_URL, WORKER_TOKEN)
+    # Updates go through the journal, sent again when the connection is back
+    notifier = TaskStatusNotifierBatchAsync(TaskStatusNotifierWSAsync(ws))
+    notifier.start()
+    runner = AsyncTaskRunner(notifier)
+    task_retriever = TaskRetrieverWSAsync(registry=registry, sio=ws)
+    task_retriever.set_callback(runner.submit)
+    async def pull(credits: int) -> None:
+        await task_retriever.get_tasks(credits, callback=runner.pulled, limits=resources.handler_limits(registry))
+    async def on_connect() -> None:
+        # Updates and tasks missed while disconnected
+        await notifier.replay()
+        if runner.free_capacity():
+            await pull(runner.free_capacity())
+    ws.on('connect', on_connect, namespace='/worker')
+    runner.on_capacity(pull)
+    logger.info(f"Task capabilities: {registry.get_tasks()}")
+    await pull(runner.free_capacity())
+    await stopping.wait()
+    logger.error('Received signal, exiting.')
+    await runner.stop()
+    await notifier.stop()
+    await ws.disconnect()
@@ -3,11 +3,13 @@ from models.task_execution import TaskExecution, TaskStatus
 from tasks import registry
 from logs import logger
 from interfaces.pizzaiolo import Pizzaiolo
+from interfaces.oven import AsyncOven
 
 @registry.register()
 class MakeDoughTask(Task):
     ''' Task to make the dough '''
     identifier = 'make_dough'
+    resources = ('pizzaiolo',)
 
     def run(self, execution: TaskExecution):
         ''' Run the task '''
@@ -24,6 +26,7 @@ class MakeDoughTask(Task):
 class AddToppingsTask(Task):
     ''' Task to add toppings to the pizza '''
     identifier = 'add_toppings'
+    resources = ('pizzaiolo',)
 
     def run(self, execution: TaskExecution):
         ''' Run the task '''
@@ -40,14 +43,20 @@ class AddToppingsTask(Task):
 class BakePizzaTask(Task):
     ''' Task to bake the pizza '''
     identifier = 'bake_pizza'
+    resources = ('oven',)
 
     def run(self, execution: TaskExecution):
-        ''' Run the task '''
+        ''' Run the task, the pizza bakes in the oven slot reserved for the task '''
         pizza_name = execution.parameters['name']
         logger.info(f'Baking pizza {pizza_name}')
 
-        pizzaiolo = Pizzaiolo()
-        pizzaiolo.bake_pizza(execution.parameters['temperature'], execution.parameters['time'])
+        oven = AsyncOven()
+        oven.bake(execution.uuid, execution.parameters['temperature'], execution.parameters['time'])
+        try:
+            pizzaiolo = Pizzaiolo()
+            pizzaiolo.bake_pizza(execution.parameters['temperature'], execution.parameters['time'])
+        finally:
+            oven.remove(execution.uuid)
 
         execution.status = TaskStatus.completed
         return execution
@@ -56,6 +65,7 @@ class BakePizzaTask(Task):
 class DeliverPizzaTask(Task):
     ''' Task to deliver the pizza '''
     identifier = 'deliver_pizza'
+    resources = ('pizzaiolo',)
 
     def run(self, execution: TaskExecution):
         ''' Run the task '''
@@ -4,9 +4,11 @@ class TaskRegister():
     ''' A class to register tasks '''
     registry = {}
 
-    def register(self):
-        ''' Adds a task only for a certain operation '''
+    def register(self, process: bool | None = None):
+        ''' Adds a task only for a certain operation, process runs it in the process pool '''
         def deco(a_class):
+            if process is not None:
+                a_class.process = process
             self.registry[a_class.identifier] = a_class
             return a_class
         return deco
@@ -18,6 +20,13 @@ class TaskRegister():
         except KeyError:
             raise NotImplementedError(f'Task with id {task_id} not found')
 
+    def create_task(self, execution):
+        ''' Returns the handler of a task execution, found by the identifier the server sends '''
+        task_class = self.registry.get(execution.task or execution.task_id)
+        if not task_class:
+            raise NotImplementedError(f'Task {execution.task} with id {execution.task_id} not found')
+        return task_class(execution)
+
     def get_tasks(self):
         ''' Returns all the registered tasks '''
         return list(self.registry.keys())
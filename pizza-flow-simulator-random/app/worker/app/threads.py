@@ -1,15 +1,168 @@
+import os
 import time
-from queue import Queue, ShutDown, Empty
-from threading import Thread, Event
+import heapq
+import itertools
+from queue import Queue, ShutDown, Empty, Full
+from threading import Thread, Event, Condition, Lock
 from logs import logger
 from models.task_execution import TaskStatus, TaskExecution
 from models.tasks import Task
+from config import MIN_THREADS, MAX_THREADS, QUEUE_LATENCY_TARGET, CPU_LIMIT
+from processes import shutdown_process_pool
+from results_cache import results_cache
+from interfaces import resources
 
 # Thread safe queue
-num_threads = 5
-tasks_queue = Queue(maxsize=num_threads*2)
-results_queue = Queue(maxsize=num_threads*2)
+num_threads = min(max(5, MIN_THREADS), MAX_THREADS) # Initial size of the pool
+queue_factor = 2 # Tasks accepted per thread
+tasks_queue = Queue() # Bounded by the credits given to the server, see submit
+results_queue = Queue(maxsize=MAX_THREADS*2)
 worker_threads = []
+thread_ids = itertools.count()
+wait_scheduler = None
+scaler = None
+claim = None # Claims the tasks over the transport of the notifier, see Task.execute
+
+# Tasks of this worker, queued, running or waiting
+owned = set()
+owned_lock = Lock()
+capacity_callback = None # Asks the server for tasks, with the free capacity as credits
+missed = False           # The server has tasks for us: tasks were refused or the last pull used all the credits
+
+def free_capacity() -> int:
+    ''' Tasks the worker can accept right now '''
+    busy = tasks_queue.qsize() + len([x for x in worker_threads if x.status == 'working'])
+    return max(0, len(worker_threads) * queue_factor - busy)
+
+def enqueue(task: Task) -> None:
+    ''' Queue a task for the worker threads '''
+    task.queued_at = time.monotonic()
+    tasks_queue.put(task)
+
+def submit(task: Task) -> bool:
+    '''
+    Accept a task sent by the server, never blocks.
+    False if there is no free capacity, the task is still pending in the server and comes back on the next pull
+    '''
+    global missed
+    cached = results_cache.get(task.execution)
+    if cached:
+        # Finished but not acknowledged before a reconnect, send the result again instead of running it
+        logger.info(f"Task {cached.uuid} already {cached.status.value}, sending the result again")
+        try:
+            results_queue.put_nowait(cached)
+        except Full:
+            return False
+        return True
+    with owned_lock:
+        if task.execution.uuid in owned:
+            return True
+        if free_capacity() <= 0:
+            missed = True
+            return False
+        if not resources.reserve(task):
+            logger.debug(f"Task {task.execution.uuid} refused, no free {'/'.join(task.resources)}")
+            missed = True
+            return False
+        owned.add(task.execution.uuid)
+    enqueue(task)
+    return True
+
+def forget(task: Task) -> None:
+    ''' The worker is done with the task '''
+    with owned_lock:
+        owned.discard(task.execution.uuid)
+    resources.release(task)
+    # Tasks refused for lack of resources may fit now
+    check_capacity(force=bool(task.resources))
+
+def on_capacity(callback) -> None:
+    ''' Set the function pulling tasks when the worker has capacity again '''
+    global capacity_callback
+    capacity_callback = callback
+
+def pulled(response: dict | None = None) -> None:
+    ''' Acknowledgement of a pull, the server tells if it had more tasks than credits '''
+    global missed
+    if response and response.get('more'):
+        missed = True
+
+def check_capacity(force: bool = False) -> None:
+    ''' Pull tasks if the server has some for us and at least half of the capacity is free, or any if forced '''
+    global missed
+    if not missed or not capacity_callback or tasks_queue.is_shutdown:
+        return
+    credits = free_capacity()
+    if credits > 0 and (force or credits * 2 >= len(worker_threads) * queue_factor):
+        missed = False
+        capacity_callback(credits)
+
+class WaitScheduler(Thread):
+    '''
+    Single thread keeping the tasks in waiting status in a heap by due time.
+    When a check is due the task goes back to the tasks queue, so worker threads never sleep on a waiting task
+    '''
+    def __init__(self, tasks_queue: Queue, results_queue: Queue):
+        Thread.__init__(self)
+        self.tasks_queue = tasks_queue
+        self.results_queue = results_queue
+        self.daemon = True
+        self.event = Event()
+        self.condition = Condition()
+        self.heap = []
+        self.counter = itertools.count() # Tie breaker, tasks are not comparable
+        self.start()
+
+    def schedule(self, task: Task) -> None:
+        ''' Check the task again after its wait_time '''
+        if self.event.is_set():
+            self.release(task)
+            return
+        due = time.monotonic() + (task.execution.wait_time or 30)
+        with self.condition:
+            heapq.heappush(self.heap, (due, next(self.counter), task))
+            if self.heap[0][2] is task:
+                self.condition.notify()
+
+    def run(self):
+        ''' Send the due tasks to the workers '''
+        logger.info("[Scheduler] Starting wait scheduler")
+        while not self.event.is_set():
+            with self.condition:
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+                delay = self.heap[0][0] - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                _, _, task = heapq.heappop(self.heap)
+            task.waits += 1
+            try:
+                enqueue(task)
+            except ShutDown:
+                self.release(task)
+        logger.debug("[Scheduler] Stopped wait scheduler")
+
+    def release(self, task: Task) -> None:
+        ''' Give the task back to the server, another worker will keep checking it '''
+        task.execution.status = TaskStatus.pending_wait
+        forget(task)
+        try:
+            # Never block, on shutdown the results are consumed by the thread stopping us
+            self.results_queue.put(task.execution, block=False)
+        except Full:
+            logger.error(f"[Scheduler] Could not release task {task.execution.task_id}, results queue full")
+
+    def stop(self) -> None:
+        ''' Stop the scheduler, releasing the tasks it has '''
+        self.event.set()
+        with self.condition:
+            pending, self.heap = self.heap, []
+            self.condition.notify()
+        for _, _, task in pending:
+            self.release(task)
+        logger.info(f"[Scheduler] Released {len(pending)} waiting tasks")
 
 class TaskWorker(Thread):
     status = 'stopped'
@@ -26,66 +179,159 @@ class TaskWorker(Thread):
         ''' Method that runs the worker '''
         logger.info(f"[T{self.identifier}] Starting worker thread")
         while not self.event.is_set():
-            if self.status != 'waiting':
-                self.status = 'idle'
+            self.status = 'idle'
             try:
-                task = self.tasks_queue.get()
+                task = self.tasks_queue.get(timeout=1)
+            except Empty:
+                if scaler and scaler.retire():
+                    break
+                continue
             except ShutDown:
-                self.status = 'stopped'
                 break
             self.status = 'working'
-            res = task.execute()
-            match res.status:
+            if scaler:
+                scaler.observe(time.monotonic() - task.queued_at)
+            res = task.execute(claim=claim)
+            match res and res.status:
+                case None:
+                    # Not claimed, another worker has it or the server will hand it out again
+                    forget(task)
+                case TaskStatus.waiting if res.max_wait_time and task.waits >= res.max_wait_time:
+                    logger.debug(f"[T{self.identifier}] Task {res.task_id} max wait time reached")
+                    res.status = TaskStatus.errored
+                    res.error = "Max wait time reached"
+                    results_cache.put(res)
+                    self.results_queue.put(res)
+                    forget(task)
                 case TaskStatus.waiting:
                     logger.debug(f"[T{self.identifier}] Task {res.task_id} waiting")
                     self.results_queue.put(res)
-                    self.status = 'waiting'
-                    self.wait(task)
+                    wait_scheduler.schedule(task)
                 case _:
                     logger.debug(f"[T{self.identifier}] Task {res.task_id} {res.status.value}")
+                    results_cache.put(res)
                     self.results_queue.put(res)
+                    forget(task)
                 
             #task.execute(notifier=task_notifier)
             self.tasks_queue.task_done()
+            if scaler and scaler.retire():
+                break
+        self.status = 'stopped'
+        if not self.event.is_set():
+            # Retired by the scaler, on shutdown stop_threads removes the threads
+            with owned_lock:
+                worker_threads.remove(self)
         logger.debug(f"[T{self.identifier}] Stoped worker thread")
 
-    def wait(self, task: Task) -> None:
-        ''' Trigger a task in waiting status '''
-        count = 0
-        while task.execution.status == TaskStatus.waiting or self.event.is_set():
-            for _ in range(task.execution.wait_time):
-                if self.event.is_set():
-                    logger.debug(f"[T{self.identifier}] Event is set, stopping worker thread")
-                    task.execution.status = TaskStatus.pending_wait
-                    self.results_queue.put(task.execution)
-                    return
-                time.sleep(1)
-            count += 1
-            task.execute()
-            self.results_queue.put(task.execution)
-            if task.execution.max_wait_time and count > task.execution.max_wait_time:
-                task.execution.status = TaskStatus.errored
-                task.execution.error = "Max wait time reached"
-                break
-        self.status = 'idle'
+class PoolScaler(Thread):
+    '''
+    Resizes the pool of worker threads between MIN_THREADS and MAX_THREADS.
+    Grows while tasks wait in the queue longer than QUEUE_LATENCY_TARGET and the CPU is below CPU_LIMIT,
+    shrinks while threads are idle
+    '''
+    interval = 2
+
+    def __init__(self, tasks_queue: Queue, results_queue: Queue):
+        Thread.__init__(self)
+        self.tasks_queue = tasks_queue
+        self.results_queue = results_queue
+        self.daemon = True
+        self.event = Event()
+        self.lock = Lock()
+        self.latencies = []
+        self.retiring = 0 # Threads to stop when they are idle
+        self.last_wall, self.last_cpu = time.monotonic(), time.process_time()
+        self.start()
 
+    def observe(self, latency: float) -> None:
+        ''' Time a task waited in the queue '''
+        with self.lock:
+            self.latencies.append(latency)
 
-def start_threads():
-    for i in range(num_threads):
-        worker = TaskWorker(i, tasks_queue, results_queue)
+    def retire(self) -> bool:
+        ''' Whether the calling worker thread has to stop '''
+        with self.lock:
+            if not self.retiring:
+                return False
+            self.retiring -= 1
+            return True
+
+    def queue_latency(self) -> float:
+        ''' Average wait of the dequeued tasks, or the wait of the oldest queued task if longer '''
+        with self.lock:
+            latencies, self.latencies = self.latencies, []
+        latency = sum(latencies) / len(latencies) if latencies else 0
+        with self.tasks_queue.mutex:
+            if self.tasks_queue.queue:
+                latency = max(latency, time.monotonic() - self.tasks_queue.queue[0].queued_at)
+        return latency
+
+    def cpu_usage(self) -> float:
+        ''' Share of the CPUs used by the process since the last check '''
+        wall, cpu = time.monotonic(), time.process_time()
+        usage = (cpu - self.last_cpu) / max(wall - self.last_wall, 1e-6) / (os.cpu_count() or 1)
+        self.last_wall, self.last_cpu = wall, cpu
+        return usage
+
+    def run(self):
+        ''' Resize the pool periodically '''
+        while not self.event.wait(self.interval):
+            try:
+                self.resize()
+            except Exception as e:
+                logger.error(f"[Scaler] Error resizing the pool: {e}")
+
+    def resize(self) -> None:
+        ''' Add or retire one thread '''
+        latency, cpu = self.queue_latency(), self.cpu_usage()
+        size = len(worker_threads) - self.retiring
+        idle = len([x for x in worker_threads if x.status == 'idle'])
+        if latency > QUEUE_LATENCY_TARGET and cpu < CPU_LIMIT and size < MAX_THREADS:
+            add_thread()
+            logger.info(f"[Scaler] Queue latency {latency:.2f}s, CPU {cpu:.0%}: pool grows to {size + 1} threads")
+        elif latency < QUEUE_LATENCY_TARGET / 10 and idle > 1 and size > MIN_THREADS:
+            with self.lock:
+                self.retiring += 1
+            logger.info(f"[Scaler] {idle} idle threads: pool shrinks to {size - 1} threads")
+        logger.debug(f"[Scaler] Resources usage: {resources.utilization()}")
+        check_capacity()
+
+    def stop(self) -> None:
+        ''' Stop resizing the pool '''
+        self.event.set()
+
+def add_thread() -> None:
+    ''' Add a thread to the pool '''
+    worker = TaskWorker(next(thread_ids), tasks_queue, results_queue)
+    with owned_lock:
         worker_threads.append(worker)
 
+
+def start_threads(claim_with=None):
+    global wait_scheduler, scaler, claim
+    claim = claim_with
+    wait_scheduler = WaitScheduler(tasks_queue, results_queue)
+    for i in range(num_threads):
+        add_thread()
+    scaler = PoolScaler(tasks_queue, results_queue)
+
 def stop_threads():
+    scaler.stop()
     tasks_queue.shutdown(immediate=True)
     [x.event.set() for x in worker_threads]
+    wait_scheduler.stop()
     count = 0
     while len(worker_threads):
         logger.debug(f"[Shutdown {count}] Workers status: {', '.join([f'{x.identifier}: {x.status}' for x in worker_threads])}")
-        for worker in [x for x in worker_threads if x.status in ('stopped', 'waiting')]:
+        for worker in [x for x in worker_threads if x.status == 'stopped']:
             worker.join()
-            worker_threads.remove(worker)
+            with owned_lock:
+                if worker in worker_threads:
+                    worker_threads.remove(worker)
         count += 1
         time.sleep(0.5)
+    shutdown_process_pool()
     logger.info("All workers stopped, emptying the queue")
     while not results_queue.empty():
         try:
@@ -46,13 +46,21 @@ def approve_rfa(rfa_id: str) -> Dict[str, Any]:
         return {}
     return response.json()
 
+rfa_etags = {}
+
 def get_rfa_status(rfa_id: str) -> Dict[str, Any]:
-    """Get the current status of an RFA"""
+    """Get the current status of an RFA, empty if it did not change since the last call"""
     url = f"{BASE_URL}/api/rfa/{rfa_id}"
-    response = requests.get(url, headers=get_headers())
+    headers = get_headers()
+    if rfa_id in rfa_etags:
+        headers["If-None-Match"] = rfa_etags[rfa_id]
+    response = requests.get(url, headers=headers)
+    if response.status_code == 304:
+        return {}
     if response.status_code != 200:
         print(f"Error getting RFA status: {response.text}")
         return {}
+    rfa_etags[rfa_id] = response.headers.get("ETag")
     return response.json()
 
 class PizzaWatcher:
@@ -63,6 +71,7 @@ class PizzaWatcher:
         self.setup_event_handlers()
         self.connected = False
         self.updates = []
+        self.sequences = {}  # Last sequence received per room
         
     def setup_event_handlers(self):
         @self.sio.event
@@ -80,25 +89,43 @@ class PizzaWatcher:
             print(f"[ERROR] Connection error: {data}")
             self.connected = False
         
-        @self.sio.on('task_update')
-        def on_task_update(data):
-            print(f"\n[TASK] Task Update: {json.dumps(data, indent=2)}")
-            self.updates.append(('task', data))
-        
-        @self.sio.on('operation_update')
-        def on_operation_update(data):
-            print(f"\n[OPERATION] Operation Update: {json.dumps(data, indent=2)}")
-            self.updates.append(('operation', data))
-        
-        @self.sio.on('pizza_update')
-        def on_pizza_update(data):
-            print(f"\n[PIZZA] Pizza Update: {json.dumps(data, indent=2)}")
-            self.updates.append(('pizza', data))
-            
+        @self.sio.on('updates')
+        def on_updates(frame):
+            room, seq = frame['room'], frame['seq']
+            last = self.sequences.get(room)
+            if last is not None and seq > last + 1:
+                print(f"\n[SYNC] Missed {seq - last - 1} frames of {room}, resyncing")
+                self.sio.start_background_task(self.resync, room)
+            self.sequences[room] = max(seq, last or 0)
+            for update in frame['updates']:
+                self.on_update(update)
+
         @self.sio.on('customer')
         def on_customer_event(data):
             print(f"\n[CUSTOMER] Customer Event: {json.dumps(data, indent=2)}")
             self.updates.append(('customer', data))
+
+    def on_update(self, update: Dict[str, Any]):
+        event, data = update['event'], update['data']
+        if event == 'task_update':
+            print(f"\n[TASK] Task Update {update['id']}: {json.dumps(data, indent=2)}")
+            self.updates.append(('task', data))
+        elif event == 'operation_update':
+            print(f"\n[OPERATION] Operation Update {update['id']}: {json.dumps(data, indent=2)}")
+            self.updates.append(('operation', data))
+        elif event == 'pizza_update':
+            print(f"\n[PIZZA] Pizza Update: {json.dumps(data, indent=2)}")
+            self.updates.append(('pizza', data))
+            # Follow the tasks of the operation making the pizza
+            if data.get('operation_id'):
+                self.join(f"operation.{data['operation_id']}")
+
+    def resync(self, room: str):
+        """Get the full state of a room after missing frames"""
+        frame = self.sio.call('resync', room, timeout=5)
+        self.sequences[room] = max(frame['seq'], self.sequences.get(room, 0))
+        for update in frame['updates']:
+            self.on_update(update)
     
     def connect(self):
         try:
@@ -116,6 +143,11 @@ class PizzaWatcher:
             print(f"Failed to connect to WebSocket server: {e}")
             return False
     
+    def join(self, room: str):
+        """Subscribe to the updates sent to a room"""
+        if self.connected:
+            self.sio.emit('join', room)
+
     def disconnect(self):
         if self.connected:
             self.sio.disconnect()
@@ -151,6 +183,7 @@ def main():
             return
             
         print(f"Order created with RFA ID: {rfa_id}")
+        watcher.join(f"rfa.{rfa_id}")
         
         # Step 2: Approve the RFA
         print("\n2. Approving RFA...")